@@ -1,13 +1,11 @@
-import paramiko
-
-ssh=paramiko.SSHClient()
-ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+import cp_ssh
 
 hostname="192.168.182.13"   
 username = "admin" #input("Enter username:")
 password = "Admin123" #input("Enter password:")
 cluster_node = "vsx03"
 
-ssh.connect(hostname=hostname,port=22,username=username,password=password)
-ssh.exec_command("add cluster member method hostname identifier " + cluster_node + " site-id 1 format json")
-ssh.close
\ No newline at end of file
+with cp_ssh.SshPool(username, password=password) as pool:
+    result = pool.run(hostname, "add cluster member method hostname identifier " + cluster_node + " site-id 1 format json")
+    print(f"rc={result['rc']}")
+    print(result["stdout"] or result["stderr"])
@@ -0,0 +1,171 @@
+"""
+End to end benchmark of change_backup_server.py against the local Check Point stand-in.
+
+Starts cp_standin.py with 10, 100 and 1000 gateways and runs change_backup_server.py on each
+fleet with every --workers count. The gateway list is asked from the stand-in's Management API
+on every run, no inventory cache carries over. Reports the wall time of the whole script, the
+gateways updated per second, the tail latency of a single gateway's update from the results
+stream, and the SSH connections the stand-in accepted per gateway, which shows whether
+connections are reused.
+
+Afterwards the stand-in is asked how many gateways have the new backup server set: every
+gateway reported ok has to have it. --latency, --jitter, --failure-rate and --down-rate are
+passed to the stand-in to see how a rollout copes with slow or failing gateways.
+
+Run from the repository root:
+    python Python/Checkpoint/benchmarks/bench_fleet.py --sizes 10 100 --workers 1 20 --json results.json
+    python Python/Checkpoint/benchmarks/bench_fleet.py --compare results.json
+"""
+
+import argparse
+import json
+import os
+import re
+import ssl
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCRIPT = os.path.join(HERE, "..", "change_backup_server.py")
+STANDIN = os.path.join(HERE, "cp_standin.py")
+
+LISTENING = re.compile(r"listening on (\S+):(\d+), .* on SSH port (\d+)")
+BACKUPSERVER = "10.20.30.40"
+REGRESSION = 0.2   # Drop of hosts/s or growth of p99 latency over the baseline that is flagged
+
+
+def start_standin(size, args):
+    command = [sys.executable, STANDIN, "--port", "0", "--ssh-port", "0", "--gateways", str(size),
+               "--latency", str(args.latency), "--jitter", str(args.jitter),
+               "--failure-rate", str(args.failure_rate), "--down-rate", str(args.down_rate)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline()
+    match = LISTENING.search(line)
+    if not match:
+        process.kill()
+        exit(f"The Check Point stand-in did not start: {line.strip()}")
+    return process, f"{match.group(1)}:{match.group(2)}", match.group(3)
+
+
+def standin_stats(mgmt, reset=False):
+    context = ssl._create_unverified_context()
+    with urllib.request.urlopen(f"https://{mgmt}/stats{'?reset=1' if reset else ''}", context=context) as resp:
+        return json.load(resp)
+
+
+# The value below which the given share of the sorted values lies, by nearest rank
+def percentile(values, share):
+    if not values:
+        return 0
+    return values[min(len(values) - 1, max(0, int(round(share * len(values))) - 1))]
+
+
+# Run the script once on the stand-in's fleet and measure it
+def run_script(mgmt, ssh_port, size, workers, args):
+    with tempfile.TemporaryDirectory(prefix="cp_bench_") as workdir:
+        command = [sys.executable, SCRIPT, "--mgmt-host", mgmt, "--mgmt-user", "admin", "--mgmt-pass", "admin",
+                   "--ssh-user", "admin", "--ssh-pass", "admin", "--ssh-port", ssh_port,
+                   "--new-backup", BACKUPSERVER, "--workers", str(workers), "--host-deadline", str(args.host_deadline),
+                   "--inventory-ttl", "0", "--results", "results.jsonl"]
+
+        standin_stats(mgmt, reset=True)
+        started = time.perf_counter()
+        with open(os.path.join(workdir, "script.log"), 'w') as log:
+            process = subprocess.run(command, cwd=workdir, stdout=log, stderr=subprocess.STDOUT)
+        wall = time.perf_counter() - started
+        stats = standin_stats(mgmt)
+
+        records = []
+        results = os.path.join(workdir, "results.jsonl")
+        if os.path.isfile(results):
+            with open(results, encoding='utf-8') as f:
+                records = [json.loads(line) for line in f if line.strip()]
+        if not records:
+            with open(os.path.join(workdir, "script.log")) as log:
+                tail = log.read()[-2000:]
+            print(f"{size} gateways with {workers} workers failed (exit {process.returncode}):\n{tail}", file=sys.stderr)
+
+    statuses = {}
+    for record in records:
+        statuses[record['status']] = statuses.get(record['status'], 0) + 1
+    latencies = sorted(record['seconds'] * 1000 for record in records if record['status'] in ("ok", "failed", "timeout"))
+    configured = stats['backup_servers'].get(BACKUPSERVER, 0)
+    if configured != statuses.get("ok", 0):
+        print(f"{size} gateways with {workers} workers: {statuses.get('ok', 0)} reported ok but {configured} have the backup server set", file=sys.stderr)
+
+    return {'size': size,
+            'workers': workers,
+            'wall': wall,
+            'hosts_per_second': len(latencies) / wall,
+            'ok': statuses.get("ok", 0),
+            'failed': len(records) - statuses.get("ok", 0),
+            'p50_ms': percentile(latencies, 0.5),
+            'p95_ms': percentile(latencies, 0.95),
+            'p99_ms': percentile(latencies, 0.99),
+            'max_ms': latencies[-1] if latencies else 0,
+            'connections_per_host': stats['connections'] / size if size else 0,
+            'api_calls': sum(stats['api_calls'].values())}
+
+
+def print_results(results, baseline):
+    print(f"{'gateways':>8} {'workers':>7} {'wall s':>8} {'hosts/s':>8} {'ok':>6} {'failed':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8} {'conn/host':>9} {'api':>5}")
+    for result in results:
+        line = (f"{result['size']:>8} {result['workers']:>7} {result['wall']:>8.2f} {result['hosts_per_second']:>8.1f} "
+                f"{result['ok']:>6} {result['failed']:>6} {result['p50_ms']:>8.0f} {result['p95_ms']:>8.0f} "
+                f"{result['p99_ms']:>8.0f} {result['max_ms']:>8.0f} {result['connections_per_host']:>9.2f} {result['api_calls']:>5}")
+        before = baseline.get((result['size'], result['workers']))
+        if before:
+            flags = []
+            if result['hosts_per_second'] < before['hosts_per_second'] * (1 - REGRESSION):
+                flags.append(f"hosts/s {result['hosts_per_second'] / before['hosts_per_second']:.2f}x")
+            if result['p99_ms'] > before['p99_ms'] * (1 + REGRESSION):
+                flags.append(f"p99 {result['p99_ms'] / before['p99_ms']:.2f}x")
+            if result['ok'] != before['ok']:
+                flags.append(f"ok {before['ok']} -> {result['ok']}")
+            if flags:
+                line += "  REGRESSION: " + ", ".join(flags)
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark change_backup_server.py against a local Check Point stand-in")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000], help="Fleet sizes in gateways (default: 10 100 1000)")
+    parser.add_argument("--workers", type=int, nargs="+", default=[20], help="--workers counts to run the script with (default: 20)")
+    parser.add_argument("--latency", type=float, default=0, help="Milliseconds every gateway command takes (default: 0)")
+    parser.add_argument("--jitter", type=float, default=0, help="Up to this many milliseconds more a command takes at random (default: 0)")
+    parser.add_argument("--failure-rate", type=float, default=0, help="Share of gateway commands that fail (default: 0)")
+    parser.add_argument("--down-rate", type=float, default=0, help="Share of gateways that refuse SSH connections (default: 0)")
+    parser.add_argument("--host-deadline", type=float, default=90, help="--host-deadline of the script (default: 90)")
+    parser.add_argument("--json", help="Write the results to this file, to compare later runs against")
+    parser.add_argument("--compare", help="Results of an earlier run to flag regressions against")
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = {(result['size'], result['workers']): result for result in json.load(f)['results']}
+
+    results = []
+    for size in args.sizes:
+        process, mgmt, ssh_port = start_standin(size, args)
+        try:
+            for workers in args.workers:
+                result = run_script(mgmt, ssh_port, size, workers, args)
+                print(f"{size} gateways with {workers} workers: {result['wall']:.2f} s, {result['hosts_per_second']:.1f} hosts/s", flush=True)
+                results.append(result)
+        finally:
+            process.terminate()
+            process.wait()
+
+    print()
+    print_results(results, baseline)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'settings': vars(args), 'results': results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
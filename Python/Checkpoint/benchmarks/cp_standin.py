@@ -0,0 +1,437 @@
+"""
+Local stand-in for a Check Point management server and its gateways, for benchmarking and
+testing the Checkpoint scripts without appliances.
+
+The management server answers the Management API, web_api, over HTTPS with a self-signed
+certificate: login, show-gateways-and-servers with limit/offset paging and details-level,
+show-object and logout. Every command but login needs the session id of a login, as the
+X-chkp-sid header or cookie. With --hidden-addresses a share of the gateways is listed without
+an address at details-level standard, so only their full details tell where they are.
+
+Each of the --gateways gateways is an SSH server of its own on a loopback address, 127.1.0.1,
+127.1.0.2 and so on, all on the same port. The SSH servers run in this process with paramiko and
+accept the --user and --password of the stand-in. Commands are answered like clish does, run
+directly or as clish -c "...": set/show backup-server, set/show hostname, save config, add
+cluster member and lock database override; any other command is invalid. --responses names a
+JSON list of {"match": regex, "stdout", "stderr", "rc"} answers tried before the built-in ones.
+Commands take --latency milliseconds plus up to --jitter more, a share of them fails with a
+locked configuration database with --failure-rate, and with --down-rate a share of the gateways
+refuses connections.
+
+GET /stats on the management server returns the counters as JSON, add ?reset=1 to zero them and
+set the gateways back to how they started. The backup_servers counter tells how many gateways
+have which backup server set.
+
+The loopback addresses past 127.0.0.1 exist on Linux; on macOS they have to be added first.
+    python Python/Checkpoint/benchmarks/cp_standin.py --gateways 100 --port 8443 --ssh-port 2222
+    python Python/Checkpoint/change_backup_server.py --mgmt-host 127.0.0.1:8443 --mgmt-user admin \\
+        --mgmt-pass admin --ssh-user admin --ssh-pass admin --ssh-port 2222 --new-backup 10.0.0.5
+"""
+
+import argparse
+import datetime
+import http.cookies
+import json
+import logging
+import random
+import re
+import selectors
+import socket
+import ssl
+import tempfile
+import threading
+import time
+import urllib.parse
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import paramiko
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+
+MAXLIMIT = 500     # Most objects show-gateways-and-servers returns at once, as the real API
+DEFAULTLIMIT = 50
+FIRSTADDRESS = 1   # Gateway addresses start at 127.1.0.1
+INVALID = "CLINFR0329  Invalid command:'{}'."
+LOCKED = "CLINFR0771  Config lock is owned by admin. Use the command 'lock database override' to acquire the lock."
+CLISH = re.compile(r"""^\s*clish\s+-c\s+(["'])(.*)\1\s*$""")
+
+
+# The loopback address of the gateway with the given index
+def gateway_address(index):
+    number = index + FIRSTADDRESS
+    if number >= 256 * 256:
+        raise ValueError("The stand-in emulates at most 65535 gateways")
+    return f"127.1.{number // 256}.{number % 256}"
+
+
+class Gateway:
+    def __init__(self, index, down=False, hidden=False):
+        self.name = f"gw{index:05d}"
+        self.ip = gateway_address(index)
+        self.uid = str(uuid.uuid5(uuid.NAMESPACE_DNS, self.name))
+        self.down = down
+        self.hidden = hidden
+        self.hostname = self.name
+        self.backup_server = None
+        self.lock = threading.Lock()
+
+    # The object as show-gateways-and-servers and show-object list it
+    def object(self, details_level):
+        obj = {"uid": self.uid, "name": self.name, "type": "simple-gateway", "domain": {"name": "SMC User"}}
+        if details_level == "full" or not self.hidden:
+            obj["ipv4-address"] = self.ip
+        if details_level == "full":
+            obj.update({"version": "R81.20", "os-name": "Gaia", "hardware": "Open server",
+                        "interfaces": [{"name": "eth0", "ipv4-address": self.ip, "ipv4-mask-length": 24}]})
+        return obj
+
+
+class StandIn:
+    def __init__(self, gateways, user, password, latency, jitter, failure_rate, down_rate, hidden_addresses,
+                 api_latency, responses, seed):
+        self.random = random.Random(seed)
+        self.gateways = [Gateway(index, self.random.random() < down_rate, self.random.random() < hidden_addresses)
+                         for index in range(gateways)]
+        self.by_ip = {gateway.ip: gateway for gateway in self.gateways}
+        self.by_uid = {gateway.uid: gateway for gateway in self.gateways}
+        self.management = {"uid": str(uuid.uuid5(uuid.NAMESPACE_DNS, "mgmt")), "name": "mgmt",
+                           "type": "checkpoint-host", "ipv4-address": "127.0.0.1"}
+        self.user = user
+        self.password = password
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.api_latency = api_latency
+        self.responses = [(re.compile(response["match"]), response) for response in responses]
+        self.sessions = set()
+        self.lock = threading.Lock()
+        self.reset()
+
+    # Zero the counters and set the gateways back to how they started
+    def reset(self):
+        for gateway in self.gateways:
+            with gateway.lock:
+                gateway.hostname = gateway.name
+                gateway.backup_server = None
+        with self.lock:
+            self.stats = {'api_calls': {}, 'logins': 0, 'connections': 0, 'auth_failures': 0, 'commands': 0,
+                          'failed_commands': 0, 'started': time.time()}
+
+    def snapshot(self):
+        with self.lock:
+            stats = json.loads(json.dumps(self.stats))
+        stats['elapsed'] = time.time() - stats.pop('started')
+        backup_servers = {}
+        for gateway in self.gateways:
+            if gateway.backup_server:
+                backup_servers[gateway.backup_server] = backup_servers.get(gateway.backup_server, 0) + 1
+        stats['backup_servers'] = backup_servers
+        return stats
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.stats[name] += value
+
+    def fails(self):
+        with self.lock:
+            return self.random.random() < self.failure_rate
+
+    def delay(self):
+        with self.lock:
+            return self.latency + self.random.random() * self.jitter
+
+    # Answer a Management API command, returns the HTTP status and the JSON answer
+    def api(self, command, payload, sid):
+        with self.lock:
+            self.stats['api_calls'][command] = self.stats['api_calls'].get(command, 0) + 1
+        if self.api_latency:
+            time.sleep(self.api_latency)
+
+        if command == "login":
+            if payload.get("user") != self.user or payload.get("password") != self.password:
+                return 400, {"code": "err_login_failed", "message": "Authentication to server failed."}
+            sid = uuid.uuid4().hex
+            with self.lock:
+                self.sessions.add(sid)
+                self.stats['logins'] += 1
+            return 200, {"sid": sid, "url": "https://127.0.0.1/web_api", "session-timeout": 600, "api-server-version": "1.9"}
+
+        with self.lock:
+            known = sid in self.sessions
+        if not known:
+            return 400, {"code": "generic_err_wrong_session_id", "message": "Wrong session id [{}]. Session may be expired. Please check session id and resend the request".format(sid or "")}
+
+        if command == "logout":
+            with self.lock:
+                self.sessions.discard(sid)
+            return 200, {"message": "OK"}
+
+        if command == "show-gateways-and-servers":
+            details_level = payload.get("details-level", "standard")
+            limit = min(int(payload.get("limit", DEFAULTLIMIT)), MAXLIMIT)
+            offset = int(payload.get("offset", 0))
+            listed = [self.management] + self.gateways
+            objects = [obj if isinstance(obj, dict) else obj.object(details_level) for obj in listed[offset:offset + limit]]
+            return 200, {"objects": objects, "from": offset + 1 if objects else 0, "to": offset + len(objects), "total": len(listed)}
+
+        if command == "show-object":
+            gateway = self.by_uid.get(payload.get("uid"))
+            if gateway is None:
+                return 404, {"code": "generic_err_object_not_found", "message": "Requested object [{}] not found".format(payload.get("uid"))}
+            return 200, {"object": gateway.object(payload.get("details-level", "standard"))}
+
+        return 404, {"code": "generic_err_command_not_found", "message": f"Unknown command \"{command}\""}
+
+    # Run a command on a gateway the way clish answers it, returns stdout, stderr and exit status
+    def run(self, gateway, command):
+        self.count('commands')
+        time.sleep(self.delay())
+        match = CLISH.match(command)
+        if match:
+            command = match.group(2)
+        command = " ".join(command.split())
+
+        for pattern, response in self.responses:
+            if pattern.search(command):
+                return response.get("stdout", ""), response.get("stderr", ""), int(response.get("rc", 0))
+
+        if self.fails():
+            self.count('failed_commands')
+            return "", LOCKED + "\n", 1
+
+        words = command.split(" ")
+        with gateway.lock:
+            if words[:2] == ["set", "backup-server"] and len(words) == 3:
+                gateway.backup_server = words[2]
+                return "", "", 0
+            if words[:2] == ["show", "backup-server"] or words[:2] == ["show", "backup-servers"]:
+                return (gateway.backup_server or "") + "\n", "", 0
+            if words[:2] == ["set", "hostname"] and len(words) == 3:
+                gateway.hostname = words[2]
+                return "", "", 0
+            if words == ["show", "hostname"]:
+                return gateway.hostname + "\n", "", 0
+            if words in (["save", "config"], ["lock", "database", "override"]):
+                return "", "", 0
+            if words[:3] == ["add", "cluster", "member"]:
+                return json.dumps({"result": "OK"}) + "\n", "", 0
+
+        self.count('failed_commands')
+        return "", INVALID.format(command) + "\n", 1
+
+
+class GatewayServer(paramiko.ServerInterface):
+    def __init__(self, standin, gateway):
+        self.standin = standin
+        self.gateway = gateway
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_auth_password(self, username, password):
+        if username == self.standin.user and password == self.standin.password:
+            return paramiko.AUTH_SUCCESSFUL
+        self.standin.count('auth_failures')
+        return paramiko.AUTH_FAILED
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED if kind == "session" else paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    # The command runs in a thread of its own, so several channels of a connection run side by side.
+    # paramiko only confirms the request once this returns, which on a busy stand-in can be after
+    # the command finished; the channel is therefore not closed here but left to the client to
+    # close, a close before the confirmation fails the request on the client.
+    def check_channel_exec_request(self, channel, command):
+        def run():
+            try:
+                stdout, stderr, rc = self.standin.run(self.gateway, command.decode(errors="ignore"))
+                if stdout:
+                    channel.sendall(stdout.encode())
+                if stderr:
+                    channel.sendall_stderr(stderr.encode())
+                channel.send_exit_status(rc)
+                channel.shutdown_write()
+            except (OSError, EOFError, paramiko.SSHException):
+                channel.close()
+
+        threading.Thread(target=run, daemon=True).start()
+        return True
+
+
+# Every gateway listens on its own address, the listening sockets are watched by one thread and
+# every connection is negotiated in a thread of its own
+class GatewayListener:
+    def __init__(self, standin, port):
+        self.standin = standin
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self.selector = selectors.DefaultSelector()
+        self.sockets = []
+        for gateway in standin.gateways:
+            if gateway.down:
+                continue
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind((gateway.ip, port))
+            sock.listen(64)
+            sock.setblocking(False)
+            port = sock.getsockname()[1]
+            self.selector.register(sock, selectors.EVENT_READ, gateway)
+            self.sockets.append(sock)
+        self.port = port
+
+    def serve_forever(self):
+        while True:
+            for key, _ in self.selector.select():
+                try:
+                    conn, _ = key.fileobj.accept()
+                except BlockingIOError:
+                    continue
+                conn.setblocking(True)
+                threading.Thread(target=self.negotiate, args=(conn, key.data), daemon=True).start()
+
+    def negotiate(self, conn, gateway):
+        self.standin.count('connections')
+        transport = paramiko.Transport(conn)
+        transport.add_server_key(self.host_key)
+        try:
+            transport.start_server(server=GatewayServer(self.standin, gateway))
+        except (paramiko.SSHException, EOFError, OSError):
+            transport.close()
+
+
+def make_handler(standin):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, status, answer):
+            body = json.dumps(answer).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urllib.parse.urlsplit(self.path)
+            if url.path.rstrip("/") != "/stats":
+                self.send_json(404, {"message": "Not found"})
+                return
+            if dict(urllib.parse.parse_qsl(url.query)).get("reset"):
+                standin.reset()
+            self.send_json(200, standin.snapshot())
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            path = urllib.parse.urlsplit(self.path).path.strip("/").split("/")
+            if len(path) != 2 or path[0] != "web_api":
+                self.send_json(404, {"message": "Not found"})
+                return
+            try:
+                payload = json.loads(body or b"{}")
+            except ValueError:
+                self.send_json(400, {"code": "generic_err_invalid_syntax", "message": "Invalid JSON"})
+                return
+
+            sid = self.headers.get("X-chkp-sid")
+            if not sid:
+                cookie = http.cookies.SimpleCookie(self.headers.get("Cookie", ""))
+                sid = cookie["X-chkp-sid"].value if "X-chkp-sid" in cookie else None
+            self.send_json(*standin.api(path[1], payload, sid))
+
+    return Handler
+
+
+# A self-signed certificate for 127.0.0.1, written to a file the ssl module can load
+def certificate_files(directory):
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "cp-standin")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key())
+            .serial_number(x509.random_serial_number()).not_valid_before(now - datetime.timedelta(days=1))
+            .not_valid_after(now + datetime.timedelta(days=30))
+            .add_extension(x509.SubjectAlternativeName([x509.DNSName("localhost")]), critical=False)
+            .sign(key, hashes.SHA256()))
+    path = f"{directory}/standin.pem"
+    with open(path, "wb") as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.TraditionalOpenSSL, serialization.NoEncryption()))
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    return path
+
+
+# The TLS handshake is done in the thread that handles the connection, not where it is accepted,
+# so a slow client does not hold up the others
+class TlsServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, handler, context):
+        self.context = context
+        super().__init__(address, handler)
+
+    def finish_request(self, request, client_address):
+        try:
+            request = self.context.wrap_socket(request, server_side=True)
+        except (ssl.SSLError, OSError):
+            return
+        super().finish_request(request, client_address)
+
+
+def serve(standin, host, port, certfile):
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(certfile)
+    return TlsServer((host, port), make_handler(standin), context)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a local stand-in for a Check Point management server and its gateways")
+    parser.add_argument("--host", default="127.0.0.1", help="Address the management server listens on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8443, help="Port of the management server, 0 picks a free one (default: 8443)")
+    parser.add_argument("--ssh-port", type=int, default=2222, help="SSH port of the gateways, 0 picks a free one (default: 2222)")
+    parser.add_argument("--gateways", type=int, default=10, help="Gateways to emulate (default: 10)")
+    parser.add_argument("--user", default="admin", help="User the management server and the gateways accept (default: admin)")
+    parser.add_argument("--password", default="admin", help="Password the management server and the gateways accept (default: admin)")
+    parser.add_argument("--latency", type=float, default=0, help="Milliseconds every gateway command takes (default: 0)")
+    parser.add_argument("--jitter", type=float, default=0, help="Up to this many milliseconds more a command takes at random (default: 0)")
+    parser.add_argument("--failure-rate", type=float, default=0, help="Share of gateway commands that fail with a locked configuration database (default: 0)")
+    parser.add_argument("--down-rate", type=float, default=0, help="Share of gateways that refuse SSH connections (default: 0)")
+    parser.add_argument("--hidden-addresses", type=float, default=0, help="Share of gateways listed without an address at details-level standard (default: 0)")
+    parser.add_argument("--api-latency", type=float, default=0, help="Milliseconds every Management API call takes (default: 0)")
+    parser.add_argument("--responses", help="JSON file with a list of {match, stdout, stderr, rc} answers to gateway commands")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for choosing the failing commands and gateways (default: 0)")
+    args = parser.parse_args()
+
+    # A client that closes its connection is no error worth reporting
+    logging.getLogger("paramiko").setLevel(logging.CRITICAL)
+
+    responses = []
+    if args.responses:
+        with open(args.responses, encoding="utf-8") as f:
+            responses = json.load(f)
+
+    standin = StandIn(args.gateways, args.user, args.password, args.latency / 1000, args.jitter / 1000, args.failure_rate,
+                      args.down_rate, args.hidden_addresses, args.api_latency / 1000, responses, args.seed)
+    try:
+        gateways = GatewayListener(standin, args.ssh_port)
+    except OSError as e:
+        exit(f"Could not listen on the gateway addresses {gateway_address(0)} and up: {e}")
+    threading.Thread(target=gateways.serve_forever, daemon=True).start()
+
+    with tempfile.TemporaryDirectory(prefix="cp_standin_") as directory:
+        server = serve(standin, args.host, args.port, certificate_files(directory))
+    host, port = server.server_address[:2]
+    print(f"Check Point stand-in listening on {host}:{port}, {args.gateways} gateways from {gateway_address(0)} on SSH port {gateways.port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -6,14 +6,23 @@ import sys
 from typing import Optional
 import requests
 import paramiko
+import time
+
+import cp_fleet
+import cp_inventory
+import cp_ssh
 
 #!/usr/bin/env python3
 """
 Linearized version of the original change_backup_server.py script.
 
-All functionality is in a single top-to-bottom block (no function definitions).
-Behavior preserved: login to management API, list gateways, extract IPs, SSH to each
-gateway and run the provided command template.
+The script runs top to bottom: login to management API, list gateways, extract IPs, SSH to each
+gateway and run the provided command template, over the connections of cp_ssh. The gateway list
+comes from cp_inventory, which pages through the Management API and keeps the list on disk for
+--inventory-ttl seconds; while it is fresh the management server is not contacted at all. Only
+the update of a single gateway is a function, so cp_fleet can run it on several gateways at once
+in rolling batches (--workers, --canary). A gateway past --host-deadline has its SSH connection
+closed, which stops its update. By default the gateways are still updated one after another.
 """
 
 
@@ -29,6 +38,7 @@ parser.add_argument("--new-backup", required=True, help="New Gaia backup server
 parser.add_argument("--ssh-user", required=True, help="SSH username for gateways")
 parser.add_argument("--ssh-pass", help="SSH password for gateways (omit to prompt). If using key, omit password.")
 parser.add_argument("--ssh-key", help="Path to private key for SSH auth (optional)")
+parser.add_argument("--ssh-port", type=int, default=22, help="SSH port of the gateways (default: 22)")
 parser.add_argument(
     "--cmd-template",
     default='clish -c "set backup-server {ip}"',
@@ -47,13 +57,24 @@ parser.add_argument("--gw-api-user", help="HTTP basic auth user for gateway API
 parser.add_argument("--gw-api-pass", help="HTTP basic auth password for gateway API (omit to prompt)")
 parser.add_argument("--gw-api-token", help="Bearer token for gateway API (mutually exclusive with user/pass)")
 parser.add_argument("--gw-api-verify", action="store_true", help="Verify TLS certificates when connecting to gateway APIs (default: not verified)")
+parser.add_argument("--workers", type=int, default=1, help="Gateways updated at the same time (default: 1)")
+parser.add_argument("--canary", type=int, default=0, help="Update this many gateways first and stop if any fails, then continue in batches that grow by --batch-growth (default: 0, a single batch)")
+parser.add_argument("--batch-growth", type=float, default=2, help="Factor each batch after the canary grows by (default: 2)")
+parser.add_argument("--host-deadline", type=float, default=90, help="Seconds a gateway's update may take, connecting included, before it counts as timed out (default: 90)")
+parser.add_argument("--max-failures", help="Stop the rollout once more gateways failed than this, a count or a share such as 10%% (default: no limit)")
+parser.add_argument("--results", default="-", help="Append one JSON line per gateway with its status and command output to this file, - for standard output (default: -)")
+parser.add_argument("--inventory-ttl", type=int, default=cp_inventory.CACHETTL, help=f"Seconds a cached gateway list is used for, 0 to always ask the management server (default: {cp_inventory.CACHETTL})")
+parser.add_argument("--refresh-inventory", action="store_true", help="Ask the management server for the gateway list even if a cached one is fresh")
 parser.add_argument("--verbose", action="store_true")
 args = parser.parse_args()
+if args.use_gateway_api and not args.gw_api_url_template:
+    parser.error("--use-gateway-api requires --gw-api-url-template")
 
 if args.verbose:
     logging.getLogger().setLevel(logging.DEBUG)
 
-mgmt_pass = args.mgmt_pass or getpass.getpass("Management API password: ")
+targets = None if args.refresh_inventory else cp_inventory.cached_targets(args.mgmt_host, args.inventory_ttl)
+mgmt_pass = args.mgmt_pass or (getpass.getpass("Management API password: ") if targets is None else None)
 ssh_pass = args.ssh_pass
 if not ssh_pass and not args.ssh_key:
     ssh_pass = getpass.getpass("Gateway SSH password: ")
@@ -63,142 +84,126 @@ gw_api_pass = args.gw_api_pass
 if args.use_gateway_api and args.gw_api_user and not gw_api_pass and not args.gw_api_token:
     gw_api_pass = getpass.getpass("Gateway API password: ")
 
+# SSH connections to the gateways, see cp_ssh
+ssh_pool = cp_ssh.SshPool(args.ssh_user, password=ssh_pass, port=args.ssh_port,
+                          pkey=paramiko.RSAKey.from_private_key_file(args.ssh_key) if args.ssh_key else None)
+
+# Seconds left until a gateway's deadline, capped at the timeouts the script always used
+def remaining(deadline, cap=30):
+    return max(1, min(cap, deadline - time.monotonic())) if deadline else cap
+
+
+# Run the command on one gateway, through its HTTP API or over SSH. Returns the result record
+# cp_fleet writes for it.
+def update_gateway(t, deadline):
+    cmd = args.cmd_template.format(ip=args.new_backup)
+
+    # If requested, use gateway HTTP API instead of SSH
+    if args.use_gateway_api:
+        url = args.gw_api_url_template.format(ip=t["ip"], name=t["name"])
+        payload_str = args.gw_api_payload_template.format(cmd=cmd, ip=t["ip"], name=t["name"])
+        headers = {}
+        auth = None
+        if args.gw_api_token:
+            headers["Authorization"] = f"Bearer {args.gw_api_token}"
+        elif args.gw_api_user:
+            auth = (args.gw_api_user, gw_api_pass)
+
+        verify = args.gw_api_verify
+        logging.info("Calling gateway API %s", url)
+
+        try:
+            # try to send JSON if payload_str is JSON, otherwise send as raw data
+            try:
+                payload_obj = json.loads(payload_str)
+                resp = requests.post(url, json=payload_obj, headers=headers or None, auth=auth, verify=verify, timeout=remaining(deadline))
+            except ValueError:
+                resp = requests.post(url, data=payload_str, headers=headers or None, auth=auth, verify=verify, timeout=remaining(deadline))
+
+            resp.raise_for_status()
+            logging.info("Gateway API call succeeded for %s", t["ip"])
+            logging.debug("Response: %s", resp.text)
+            return {"status": "ok", "http_status": resp.status_code, "response": resp.text}
+        except Exception as e:
+            logging.error("Gateway API call failed for %s: %s", t["ip"], e)
+            return {"status": "failed", "error": str(e)}
+
+    logging.info("Running the command on %s as %s", t["ip"], args.ssh_user)
+    try:
+        result = ssh_pool.run(t["ip"], cmd, timeout=remaining(deadline))
+        rc, out, err = result["rc"], result["stdout"], result["stderr"]
+        logging.info("Command on %s finished rc=%s", t["ip"], rc)
+        if out:
+            logging.debug("STDOUT: %s", out.strip())
+        if err:
+            logging.debug("STDERR: %s", err.strip())
+
+        if rc != 0:
+            logging.error("Command failed on %s (rc=%s). stderr: %s", t["ip"], rc, err.strip())
+        else:
+            logging.info("Command succeeded on %s", t["ip"])
+        return {"status": "ok" if rc == 0 else "failed", "rc": rc, "stdout": out, "stderr": err}
+
+    except Exception as e:
+        logging.error("SSH command failed on %s: %s", t["ip"], e)
+        return {"status": "failed", "error": str(e)}
+    finally:
+        # A gateway gets a single command, its connection is closed once it is updated
+        ssh_pool.close_host(t["ip"])
+
+
 session = requests.Session()
 # disable warnings for self-signed certs often used in labs; in production supply proper cert validation.
 requests.packages.urllib3.disable_warnings()
 
-# --- login to management API (inlined) ---
-try:
-    login_url = f"https://{args.mgmt_host}/web_api/login"
-    resp = session.post(login_url, json={"user": args.mgmt_user, "password": mgmt_pass}, verify=False, timeout=30)
-    resp.raise_for_status()
-    data = resp.json()
-    sid = data.get("sid")
-    if not sid:
-        logging.error("Login succeeded but no SID returned")
+if targets is None:
+    # --- login to management API (inlined) ---
+    try:
+        login_url = f"https://{args.mgmt_host}/web_api/login"
+        resp = session.post(login_url, json={"user": args.mgmt_user, "password": mgmt_pass}, verify=False, timeout=30)
+        resp.raise_for_status()
+        data = resp.json()
+        sid = data.get("sid")
+        if not sid:
+            logging.error("Login succeeded but no SID returned")
+            sys.exit(1)
+        session.cookies.set("X-chkp-sid", sid)
+        logging.debug("Management API login successful, SID set")
+    except Exception as e:
+        logging.error("Failed to login to management API: %s", e)
         sys.exit(1)
-    session.cookies.set("X-chkp-sid", sid)
-    logging.debug("Management API login successful, SID set")
-except Exception as e:
-    logging.error("Failed to login to management API: %s", e)
-    sys.exit(1)
 
+    try:
+        # --- get gateways and build the target list, page by page (see cp_inventory) ---
+        targets = cp_inventory.fetch_targets(session, args.mgmt_host)
+        if args.inventory_ttl:
+            cp_inventory.save_targets(args.mgmt_host, targets)
+    except Exception as e:
+        logging.error("Failed to list the gateways: %s", e)
+        sys.exit(1)
+    finally:
+        # logout (inlined)
+        try:
+            logout_url = f"https://{args.mgmt_host}/web_api/logout"
+            session.post(logout_url, json={}, verify=False, timeout=10)
+        except Exception:
+            pass
+
+logging.info("Prepared %d targets to update", len(targets))
+
+# update the targets, in rolling batches when asked to (see cp_fleet)
+cmd = args.cmd_template.format(ip=args.new_backup)
+for t in targets:
+    logging.info("Target %s (%s): command: %s", t["name"], t["ip"], cmd)
+
+results = cp_fleet.FleetResults(args.results)
 try:
-    # --- get gateways (inlined) ---
-    gw_url = f"https://{args.mgmt_host}/web_api/show-gateways-and-servers"
-    payload = {"details-level": "full"}
-    resp = session.post(gw_url, json=payload, verify=False, timeout=60)
-    resp.raise_for_status()
-    data = resp.json()
-    objects = data.get("objects") or []
-    logging.info("Found %d gateway/server objects", len(objects))
-
-    # build target list (inlined extract_ip logic)
-    targets = []
-    for obj in objects:
-        typ = obj.get("type", "").lower()
-        if "gateway" in typ or "server" in typ:
-            # try several common fields for an IP
-            ip = None
-            for key in ("ipv4-address", "ip-address", "management-ip"):
-                v = obj.get(key)
-                if v:
-                    ip = v
-                    break
-            if not ip and "interfaces" in obj:
-                for iface in obj.get("interfaces", []):
-                    if iface.get("ipv4-address"):
-                        ip = iface.get("ipv4-address")
-                        break
-
-            name = obj.get("name", "<unnamed>")
-            if ip:
-                targets.append({"name": name, "ip": ip})
-            else:
-                logging.warning("Skipping %s (no IP found)", name)
-
-    logging.info("Prepared %d targets to update", len(targets))
-
-    # iterate targets and run SSH commands (inlined ssh_run_command)
-    for t in targets:
-        cmd = args.cmd_template.format(ip=args.new_backup)
-        logging.info("Target %s (%s): command: %s", t["name"], t["ip"], cmd)
-        if args.dry_run:
-            continue
-
-        # If requested, use gateway HTTP API instead of SSH
-        if args.use_gateway_api:
-            if not args.gw_api_url_template:
-                logging.error("--use-gateway-api requires --gw-api-url-template")
-                continue
-
-            url = args.gw_api_url_template.format(ip=t["ip"], name=t["name"])
-            payload_str = args.gw_api_payload_template.format(cmd=cmd, ip=t["ip"], name=t["name"])
-            headers = {}
-            auth = None
-            if args.gw_api_token:
-                headers["Authorization"] = f"Bearer {args.gw_api_token}"
-            elif args.gw_api_user:
-                auth = (args.gw_api_user, gw_api_pass)
-
-            verify = args.gw_api_verify
-            logging.info("Calling gateway API %s", url)
-            if args.dry_run:
-                logging.debug("Dry-run payload: %s", payload_str)
-                continue
-
-            try:
-                # try to send JSON if payload_str is JSON, otherwise send as raw data
-                try:
-                    payload_obj = json.loads(payload_str)
-                    resp = requests.post(url, json=payload_obj, headers=headers or None, auth=auth, verify=verify, timeout=30)
-                except ValueError:
-                    resp = requests.post(url, data=payload_str, headers=headers or None, auth=auth, verify=verify, timeout=30)
-
-                resp.raise_for_status()
-                logging.info("Gateway API call succeeded for %s", t["ip"])
-                logging.debug("Response: %s", resp.text)
-            except Exception as e:
-                logging.error("Gateway API call failed for %s: %s", t["ip"], e)
-
-        else:
-            logging.info("Connecting to %s as %s", t["ip"], args.ssh_user)
-            client = paramiko.SSHClient()
-            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            try:
-                if args.ssh_key:
-                    key = paramiko.RSAKey.from_private_key_file(args.ssh_key)
-                    client.connect(hostname=t["ip"], username=args.ssh_user, pkey=key, timeout=30)
-                else:
-                    client.connect(hostname=t["ip"], username=args.ssh_user, password=ssh_pass, timeout=30)
-
-                stdin, stdout, stderr = client.exec_command(cmd, timeout=30)
-                out = stdout.read().decode(errors="ignore")
-                err = stderr.read().decode(errors="ignore")
-                rc = stdout.channel.recv_exit_status()
-                logging.info("Command on %s finished rc=%s", t["ip"], rc)
-                if out:
-                    logging.debug("STDOUT: %s", out.strip())
-                if err:
-                    logging.debug("STDERR: %s", err.strip())
-
-                if rc != 0:
-                    logging.error("Command failed on %s (rc=%s). stderr: %s", t["ip"], rc, err.strip())
-                else:
-                    logging.info("Command succeeded on %s", t["ip"])
-
-            except Exception as e:
-                logging.error("SSH command failed on %s: %s", t["ip"], e)
-            finally:
-                try:
-                    client.close()
-                except Exception:
-                    pass
-
+    counts = cp_fleet.run_fleet(targets, update_gateway, workers=args.workers, canary=args.canary, growth=args.batch_growth,
+                                deadline=args.host_deadline, max_failures=args.max_failures, results=results, dry_run=args.dry_run,
+                                abort=lambda t: ssh_pool.close_host(t["ip"]))
 finally:
-    # logout (inlined)
-    try:
-        logout_url = f"https://{args.mgmt_host}/web_api/logout"
-        session.post(logout_url, json={}, verify=False, timeout=10)
-    except Exception:
-        pass
+    results.close()
+    ssh_pool.close()
+
+if any(status not in ("ok", "dry-run") for status in counts):
+    sys.exit(1)
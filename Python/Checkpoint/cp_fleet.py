@@ -0,0 +1,181 @@
+"""
+Rolling execution of a change across a fleet of gateways, for the Checkpoint scripts.
+
+Updating gateways one after another makes a change window as long as the sum of every host,
+and a dead host costs its full timeouts before the next one starts. run_fleet runs the change on
+up to `workers` gateways at a time, in rolling batches: a small canary batch first, then batches
+that grow by `growth` each round. A batch is finished before the next one starts, so a change
+that breaks gateways is stopped after the canary instead of reaching the whole fleet. Once more
+gateways failed than `max_failures` allows, updates that did not start yet are skipped.
+
+Every gateway gets `deadline` seconds from when its update starts. The action is handed the
+deadline so it can bound its own connect and command timeouts, and a gateway still running
+after it is reported as timed out and no longer waited for. `abort` is then called for it to
+stop the update, such as by closing its connection, so its worker is free for the next gateway.
+Each batch gets workers of its own, an update that could not be stopped does not leave the
+batches after it with fewer.
+
+One JSON line per gateway is written to the results stream as soon as it finishes, with its
+batch, status (ok, failed, timeout, skipped or dry-run), timing and whatever the action returned,
+such as the exit status and output of a command.
+"""
+
+import concurrent.futures
+import datetime
+import json
+import logging
+import sys
+import threading
+import time
+
+GRACE = 5   # Seconds given to an action past its deadline before it is reported as timed out
+
+
+# A stream of JSON lines, '-' for standard output. Lines are written whole and flushed, so the
+# stream can be followed while the rollout runs.
+class FleetResults:
+    def __init__(self, path="-"):
+        self.file = sys.stdout if path in (None, "-") else open(path, "a", encoding="utf-8")
+        self.lock = threading.Lock()
+
+    def write(self, record):
+        line = json.dumps(record, default=str) + "\n"
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+
+    def close(self):
+        if self.file is not sys.stdout:
+            self.file.close()
+
+
+# Read a failure threshold given as a count, '5', or a share of the fleet, '10%'. Returns the
+# number of failed gateways that is still tolerated, None for no limit.
+def failure_limit(value, total):
+    if value is None:
+        return None
+    value = str(value).strip()
+    if value.endswith("%"):
+        return int(total * float(value[:-1]) / 100)
+    return int(value)
+
+
+# Split the targets into rolling batches: `canary` first, then each batch `growth` times the
+# size of the one before. Without a canary every target is in one batch.
+def plan_batches(targets, canary=0, growth=2):
+    if canary <= 0:
+        return [list(targets)] if targets else []
+
+    batches = []
+    size = canary
+    position = 0
+    while position < len(targets):
+        batches.append(list(targets[position:position + size]))
+        position += size
+        size = max(size + 1, int(size * growth))
+    return batches
+
+
+# Run action(target, deadline) on every target. deadline is a time.monotonic() value the action
+# should finish by; it returns a dict with at least a 'status', or raises to fail the target.
+# abort(target) is called for a target that timed out. Returns the number of targets by status.
+def run_fleet(targets, action, workers=1, canary=0, growth=2, deadline=None, max_failures=None, results=None, dry_run=False,
+              abort=None):
+    batches = plan_batches(targets, canary, growth)
+    limit = failure_limit(max_failures, len(targets))
+    counts = {}
+    failed = 0
+    started = time.monotonic()
+
+    def record(target, batch, status, began, outcome=None):
+        counts[status] = counts.get(status, 0) + 1
+        line = {'name': target.get('name'), 'ip': target.get('ip'), 'batch': batch, 'status': status,
+                'started': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='milliseconds') if began is None
+                           else datetime.datetime.fromtimestamp(began, datetime.timezone.utc).isoformat(timespec='milliseconds'),
+                'seconds': round(time.time() - began, 3) if began is not None else 0}
+        if outcome:
+            line.update((key, value) for key, value in outcome.items() if key != 'status')
+        if results is not None:
+            results.write(line)
+        return status
+
+    # When each running update started, by the id of its target
+    starts = {}
+
+    def run(target):
+        began = time.time()
+        starts[id(target)] = time.monotonic()
+        if dry_run:
+            return began, {'status': "dry-run"}
+        try:
+            return began, action(target, starts[id(target)] + deadline if deadline else None)
+        except Exception as e:
+            return began, {'status': "failed", 'error': str(e)}
+
+    executor = None
+    try:
+        for number, batch in enumerate(batches):
+            reason = None
+            if canary > 0 and number == 1 and failed:
+                reason = "the canary batch failed"
+            elif limit is not None and failed > limit:
+                reason = f"{failed} gateways failed, more than the {limit} tolerated"
+            if reason:
+                logging.error("Stopping the rollout, %s; skipping %d gateways", reason, sum(len(rest) for rest in batches[number:]))
+                for rest in batches[number:]:
+                    for target in rest:
+                        record(target, None, "skipped", None, {'error': f"Rollout stopped, {reason}"})
+                break
+
+            logging.info("Batch %d of %d: %d gateways", number + 1, len(batches), len(batch))
+            batch_started = time.monotonic()
+
+            # Updates of the batch before that timed out may still hold threads of its pool
+            if executor is not None:
+                executor.shutdown(wait=False)
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="fleet")
+
+            # An update's deadline runs from when a worker picks it up, so the deadlines are
+            # checked while waiting rather than handed to wait()
+            pending = {executor.submit(run, target): target for target in batch}
+            while pending:
+                done, _ = concurrent.futures.wait(pending, timeout=1, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    target = pending.pop(future)
+                    began, outcome = future.result()
+                    status = record(target, number, outcome.get('status', "ok"), began, outcome)
+                    if status in ("failed", "timeout"):
+                        failed += 1
+                        logging.error("%s (%s): %s %s", target.get('name'), target.get('ip'), status, outcome.get('error', ""))
+
+                if deadline:
+                    now = time.monotonic()
+                    for future, target in list(pending.items()):
+                        began = starts.get(id(target))
+                        if began is not None and now - began > deadline + GRACE:
+                            pending.pop(future)
+                            failed += 1
+                            record(target, number, "timeout", time.time() - (now - began), {'error': f"No result after {deadline} seconds"})
+                            logging.error("%s (%s): timed out after %s seconds", target.get('name'), target.get('ip'), deadline)
+                            if abort is not None:
+                                try:
+                                    abort(target)
+                                except Exception as e:
+                                    logging.debug("Could not stop the update of %s: %s", target.get('ip'), e)
+
+                # Past the threshold, the updates of the batch that did not start yet are dropped
+                if limit is not None and failed > limit:
+                    for future, target in list(pending.items()):
+                        if future.cancel():
+                            pending.pop(future)
+                            record(target, number, "skipped", None, {'error': f"Rollout stopped, {failed} gateways failed"})
+
+            logging.info("Batch %d finished in %.1f seconds", number + 1, time.monotonic() - batch_started)
+    finally:
+        # Updates that timed out are left to finish in the background, they are bounded by their deadline
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    logging.info("Rollout finished in %.1f seconds: %s", time.monotonic() - started,
+                 ", ".join(f"{count} {status}" for status, count in sorted(counts.items())))
+    return counts
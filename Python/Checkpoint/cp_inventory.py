@@ -0,0 +1,151 @@
+"""
+Gateway inventory from the Check Point Management API, for the Checkpoint scripts.
+
+show-gateways-and-servers with details-level full returns every object with all its settings in
+one answer, which gets very large, and on big Multi-Domain installations slow or cut short.
+fetch_targets asks for the objects in pages of PAGESIZE with details-level standard instead,
+fetches the pages after the first one concurrently, and only asks for the full details of the
+objects whose address is not in the standard answer.
+
+The targets, the name and IP address of every gateway and server, are kept on disk for
+CACHETTL seconds per management server, so the scripts that run one after another in a change
+window, or the same script run again, do not need to log in to the management server to list
+the gateways. The cache holds names and addresses only, no credentials.
+"""
+
+import concurrent.futures
+import json
+import logging
+import os
+import tempfile
+import time
+
+PAGESIZE = 500      # Objects per page, the most the Management API returns at once
+WORKERS = 8         # Pages and detail objects fetched at the same time
+CACHEDIR = "Python/Checkpoint/.cp_inventory"
+CACHETTL = 3600     # Seconds a cached inventory is used for, 0 to always ask the management server
+TIMEOUT = 60        # Seconds an API call may take
+
+IPFIELDS = ("ipv4-address", "ip-address", "management-ip")
+
+
+# Call a Management API command on a logged in session and return the decoded answer
+def api_call(session, host, command, payload, timeout=TIMEOUT):
+    resp = session.post(f"https://{host}/web_api/{command}", json=payload, verify=False, timeout=timeout)
+    resp.raise_for_status()
+    return resp.json()
+
+
+def is_target(obj):
+    typ = obj.get("type", "").lower()
+    return "gateway" in typ or "server" in typ
+
+
+# The address to reach a gateway at: one of several common fields, or the first interface with one
+def extract_ip(obj):
+    for key in IPFIELDS:
+        v = obj.get(key)
+        if v:
+            return v
+    for iface in obj.get("interfaces", []) or []:
+        if iface.get("ipv4-address"):
+            return iface.get("ipv4-address")
+    return None
+
+
+# Every gateway and server object, in the order the management server lists them. The first page
+# tells how many there are, the other pages are then fetched at the same time.
+def fetch_objects(session, host, details_level="standard", workers=WORKERS):
+    def page(offset):
+        return api_call(session, host, "show-gateways-and-servers",
+                        {"details-level": details_level, "limit": PAGESIZE, "offset": offset})
+
+    first = page(0)
+    objects = list(first.get("objects") or [])
+    total = first.get("total", len(objects))
+    offsets = range(len(objects), total, PAGESIZE) if objects else ()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        for answer in executor.map(page, offsets):
+            objects.extend(answer.get("objects") or [])
+
+    if len(objects) != total:
+        logging.warning("The management server announced %d gateway/server objects but listed %d", total, len(objects))
+    return objects
+
+
+# Fill in the full details of the targets whose address the standard answer does not carry
+def fetch_details(session, host, objects, workers=WORKERS):
+    missing = [obj for obj in objects if is_target(obj) and not extract_ip(obj) and obj.get("uid")]
+    if not missing:
+        return objects
+
+    def details(obj):
+        try:
+            return api_call(session, host, "show-object", {"uid": obj["uid"], "details-level": "full"}).get("object") or {}
+        except Exception as e:
+            logging.warning("Could not fetch the details of %s: %s", obj.get("name", obj["uid"]), e)
+            return {}
+
+    logging.info("Fetching the details of %d objects without an address", len(missing))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        for obj, full in zip(missing, executor.map(details, missing)):
+            for key, value in full.items():
+                obj.setdefault(key, value)
+    return objects
+
+
+# The gateways and servers that can be updated, as {"name", "ip", "uid", "type"}
+def build_targets(objects):
+    targets = []
+    for obj in objects:
+        if not is_target(obj):
+            continue
+        name = obj.get("name", "<unnamed>")
+        ip = extract_ip(obj)
+        if ip:
+            targets.append({"name": name, "ip": ip, "uid": obj.get("uid"), "type": obj.get("type")})
+        else:
+            logging.warning("Skipping %s (no IP found)", name)
+    return targets
+
+
+def fetch_targets(session, host, workers=WORKERS):
+    started = time.monotonic()
+    objects = fetch_details(session, host, fetch_objects(session, host, workers=workers), workers)
+    targets = build_targets(objects)
+    logging.info("Found %d gateway/server objects, %d targets, in %.1f seconds", len(objects), len(targets), time.monotonic() - started)
+    return targets
+
+
+def cache_path(host, cachedir=CACHEDIR):
+    return os.path.join(cachedir, "".join(c if c.isalnum() or c in ".-" else "_" for c in host) + ".json")
+
+
+# The cached targets of a management server, or None when there are none younger than ttl seconds
+def cached_targets(host, ttl=CACHETTL, cachedir=CACHEDIR):
+    if not ttl:
+        return None
+    try:
+        with open(cache_path(host, cachedir), encoding="utf-8") as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if cached.get("host") != host or time.time() - cached.get("fetched", 0) > ttl:
+        return None
+    logging.info("Using the inventory of %s cached %d seconds ago", host, time.time() - cached["fetched"])
+    return cached["targets"]
+
+
+# Replace the cached targets of a management server. The file is written next to the old one
+# and renamed over it, so another script reading it never sees half of it.
+def save_targets(host, targets, cachedir=CACHEDIR):
+    os.makedirs(cachedir, exist_ok=True)
+    fd, temp = tempfile.mkstemp(dir=cachedir, prefix=".inventory.")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"host": host, "fetched": time.time(), "targets": targets}, f)
+        os.replace(temp, cache_path(host, cachedir))
+    except BaseException:
+        os.unlink(temp)
+        raise
@@ -0,0 +1,149 @@
+"""
+Shared SSH connections for the Checkpoint scripts.
+
+Every paramiko.SSHClient connect is a TCP connect, a key exchange and an authentication, which
+on a busy gateway takes longer than the command itself. SshPool keeps one authenticated
+connection per host, port and user, and runs every command on its own channel of that
+connection. A change of several commands costs a single handshake per gateway, and commands are
+not started before the one before them finished, unless they are asked to run side by side.
+
+Connections are kept alive with SSH keepalives and closed once they were idle for `idle`
+seconds, or when the gateway closed them, in which case the next command connects again.
+Each command's exit status and output are collected in a dict:
+    {"command": ..., "rc": 0, "stdout": ..., "stderr": ...}
+"""
+
+import concurrent.futures
+import logging
+import threading
+import time
+
+import paramiko
+
+KEEPALIVE = 30   # Seconds between SSH keepalives on an idle connection
+IDLE = 300       # Seconds a connection may stay unused before it is closed
+TIMEOUT = 30     # Seconds to connect, and for a command to finish
+
+
+class SshPool:
+    def __init__(self, username, password=None, pkey=None, key_filename=None, port=22, timeout=TIMEOUT, keepalive=KEEPALIVE, idle=IDLE):
+        self.username = username
+        self.password = password
+        self.pkey = pkey
+        self.key_filename = key_filename
+        self.port = port
+        self.timeout = timeout
+        self.keepalive = keepalive
+        self.idle = idle
+        self.clients = {}    # (host, port, username) -> [SSHClient, last used]
+        self.connecting = {}   # (host, port, username) -> Lock, so a host is only connected once
+        self.lock = threading.Lock()
+        self.connects = 0
+        self.closed = False
+
+        # Idle connections are closed in the background, so a script that pauses does not keep
+        # sessions open on every gateway it touched
+        self.reaper = threading.Thread(target=self.reap, name="ssh-reaper", daemon=True)
+        self.reaper.start()
+
+    def key(self, host, port=None):
+        return (host, port or self.port, self.username)
+
+    # The connected client of a host, connecting first if there is none or it was closed
+    def client(self, host, port=None, timeout=None):
+        key = self.key(host, port)
+        with self.lock:
+            lock = self.connecting.setdefault(key, threading.Lock())
+
+        with lock:
+            with self.lock:
+                entry = self.clients.get(key)
+            if entry is not None:
+                transport = entry[0].get_transport()
+                if transport is not None and transport.is_active():
+                    entry[1] = time.monotonic()
+                    return entry[0]
+                self.close_host(host, port)
+
+            timeout = timeout or self.timeout
+            client = paramiko.SSHClient()
+            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            client.connect(hostname=host, port=key[1], username=self.username, password=self.password, pkey=self.pkey,
+                           key_filename=self.key_filename, timeout=timeout, banner_timeout=timeout, auth_timeout=timeout)
+            client.get_transport().set_keepalive(self.keepalive)
+            with self.lock:
+                self.clients[key] = [client, time.monotonic()]
+                self.connects += 1
+            logging.debug("Connected to %s:%s as %s", host, key[1], self.username)
+            return client
+
+    # Run a command on a channel of its own and wait for it to finish
+    def run(self, host, command, timeout=None, port=None):
+        timeout = timeout or self.timeout
+        client = self.client(host, port, timeout)
+        channel = client.get_transport().open_session(timeout=timeout)
+        try:
+            channel.settimeout(timeout)
+            channel.exec_command(command)
+            stdout = channel.makefile("rb").read().decode(errors="ignore")
+            stderr = channel.makefile_stderr("rb").read().decode(errors="ignore")
+            rc = channel.recv_exit_status()
+        finally:
+            channel.close()
+            with self.lock:
+                entry = self.clients.get(self.key(host, port))
+                if entry is not None:
+                    entry[1] = time.monotonic()
+        logging.debug("%s: %s finished rc=%s", host, command, rc)
+        return {"command": command, "rc": rc, "stdout": stdout, "stderr": stderr}
+
+    # Run several commands over one connection. In order, stopping at the first that fails unless
+    # keep_going is set, or all at once on channels side by side when parallel is set.
+    def run_all(self, host, commands, timeout=None, port=None, parallel=False, keep_going=False):
+        if parallel:
+            self.client(host, port, timeout)
+            with concurrent.futures.ThreadPoolExecutor(max_workers=len(commands) or 1) as executor:
+                return list(executor.map(lambda command: self.run(host, command, timeout, port), commands))
+
+        results = []
+        for command in commands:
+            results.append(self.run(host, command, timeout, port))
+            if results[-1]["rc"] != 0 and not keep_going:
+                break
+        return results
+
+    def close_host(self, host, port=None):
+        with self.lock:
+            entry = self.clients.pop(self.key(host, port), None)
+        if entry is not None:
+            try:
+                entry[0].close()
+            except Exception:
+                pass
+
+    # Close the connections nobody used for `idle` seconds
+    def evict_idle(self):
+        now = time.monotonic()
+        with self.lock:
+            idle = [key for key, (client, used) in self.clients.items() if now - used > self.idle]
+        for host, port, username in idle:
+            logging.debug("Closing the idle connection to %s:%s", host, port)
+            self.close_host(host, port)
+
+    def reap(self):
+        while not self.closed:
+            time.sleep(min(self.idle, KEEPALIVE))
+            self.evict_idle()
+
+    def close(self):
+        self.closed = True
+        with self.lock:
+            keys = list(self.clients)
+        for host, port, username in keys:
+            self.close_host(host, port)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
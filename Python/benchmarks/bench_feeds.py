@@ -0,0 +1,137 @@
+"""
+Benchmark of importing NVD JSON 2.0 feed archives with nist_vuln_checker.py --import-feeds.
+
+Writes a yearly feed archive, nvdcve-2.0-<year>.json.gz, for every year NVD publishes one, plus
+a modified feed. Each yearly feed holds --cves-per-year CVEs cloned from the fortios fixture in
+test_data, with their own ids and products. The modified feed holds newer copies of a share of
+them. The checker then imports the directory into an empty store, in a process of its own so
+that its peak RSS can be measured.
+
+Afterwards the store is checked: it has to hold every CVE exactly once, the modified copies have
+to have replaced the originals, the records have to read back the way the CVE API returns them,
+and the baseline for --sync has to be the publication time of the yearly feeds.
+
+Run from the repository root: python Python/benchmarks/bench_feeds.py --cves-per-year 10000
+"""
+
+import argparse
+import copy
+import datetime
+import gzip
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import nvd_feeds
+import nvd_store
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CHECKER = os.path.join(HERE, "..", "nist_vuln_checker.py")
+FIXTURE = os.path.join(HERE, "..", "test_data", "cve_results_cpe_2.3_o_fortinet_fortios_7.2.7_______.json")
+
+PUBLISHED = datetime.datetime(2026, 1, 2, 3, 0, 0, 123456)
+MODIFIEDSHARE = 0.05   # Share of the CVEs the modified feed holds newer copies of
+
+
+def feed_vulnerability(template, year, index, modified):
+    vulnerability = copy.deepcopy(template)
+    cve = vulnerability['cve']
+    cve['id'] = f"CVE-{year}-{index:06d}"
+    cve['lastModified'] = modified.isoformat(timespec='milliseconds')
+    for configuration in cve.get('configurations', []):
+        for node in configuration.get('nodes', []):
+            for match in node.get('cpeMatch', []):
+                components = match['criteria'].split(":")
+                components[3:5] = [f"feedvendor{index % 50}", f"product{index % 500:03d}"]
+                match['criteria'] = ":".join(components)
+    return vulnerability
+
+
+# Write a feed the way NVD does, the counts first and the vulnerabilities one after another
+def write_feed(path, vulnerabilities, count):
+    header = {'resultsPerPage': count, 'startIndex': 0, 'totalResults': count,
+              'format': "NVD_CVE", 'version': "2.0", 'timestamp': PUBLISHED.isoformat() + "1"}
+    with gzip.open(path, 'wt', encoding='utf-8') as f:
+        f.write(json.dumps(header)[:-1] + ', "vulnerabilities": [')
+        for index, vulnerability in enumerate(vulnerabilities):
+            f.write((",\n" if index else "\n") + json.dumps(vulnerability))
+        f.write("\n]}")
+
+
+def write_feeds(directory, templates, cves_per_year):
+    years = range(nvd_feeds.FIRSTYEAR, PUBLISHED.year + 1)
+    for year in years:
+        modified = datetime.datetime(year, 1, 1)
+        write_feed(os.path.join(directory, f"nvdcve-2.0-{year}.json.gz"),
+                   (feed_vulnerability(templates[index % len(templates)], year, index, modified) for index in range(cves_per_year)),
+                   cves_per_year)
+
+    # Newer copies of every so many CVEs of every year
+    step = int(1 / MODIFIEDSHARE)
+    updated = [(year, index) for year in years for index in range(0, cves_per_year, step)]
+    modified = PUBLISHED - datetime.timedelta(hours=1)
+    write_feed(os.path.join(directory, "nvdcve-2.0-modified.json.gz"),
+               (feed_vulnerability(templates[index % len(templates)], year, index, modified) for year, index in updated),
+               len(updated))
+    return len(years) * cves_per_year, len(updated), modified
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark importing NVD JSON 2.0 feed archives")
+    parser.add_argument("--cves-per-year", type=int, default=2000, help="CVEs in every yearly feed (default: 2000)")
+    args = parser.parse_args()
+
+    with open(FIXTURE, encoding='utf-8') as f:
+        templates = json.load(f)['vulnerabilities']
+
+    with tempfile.TemporaryDirectory(prefix="nvd_feeds_") as workdir:
+        feeds = os.path.join(workdir, "feeds")
+        os.mkdir(feeds)
+        started = time.perf_counter()
+        total, updated, modified = write_feeds(feeds, templates, args.cves_per_year)
+        size = sum(os.path.getsize(os.path.join(feeds, name)) for name in os.listdir(feeds))
+        print(f"Wrote {total} CVEs and {updated} modified copies in {len(os.listdir(feeds))} feeds of {size / 1024 / 1024:.1f} MB in {time.perf_counter() - started:.1f} seconds")
+
+        store_path = os.path.join(workdir, "store.sqlite")
+        started = time.perf_counter()
+        process = subprocess.Popen([sys.executable, CHECKER, "--import-feeds", feeds, "--store", store_path],
+                                   stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        output = process.stdout.read()
+        _, status, usage = os.wait4(process.pid, 0)
+        wall = time.perf_counter() - started
+        if os.waitstatus_to_exitcode(status) != 0:
+            exit(f"The import failed:\n{output[-2000:]}")
+
+        # ru_maxrss is in kilobytes on Linux, in bytes on macOS
+        peak_rss = usage.ru_maxrss / 1024 if sys.platform != "darwin" else usage.ru_maxrss / 1024 / 1024
+        print(f"Imported {total + updated} records in {wall:.1f} seconds, {(total + updated) / wall:.0f} CVEs/s, peak RSS {peak_rss:.1f} MB")
+
+        store = nvd_store.CveStore(store_path)
+        try:
+            problems = []
+            if store.count() != total:
+                problems.append(f"the store holds {store.count()} CVEs instead of {total}")
+            replaced = sum(1 for vulnerability in store.iter_cves(modified_since=modified.isoformat(timespec='milliseconds')))
+            if replaced != updated:
+                problems.append(f"{replaced} CVEs were replaced by their modified copies instead of {updated}")
+            first = next(store.iter_cves())
+            if set(first['cve']) != set(templates[0]['cve']):
+                problems.append("records do not read back in the shape the CVE API returns them")
+            baseline = nvd_feeds.feed_timestamp(PUBLISHED.isoformat())
+            if store.watermark(nvd_feeds.BASELINE) != baseline:
+                problems.append(f"the baseline is {store.watermark(nvd_feeds.BASELINE)} instead of {baseline}")
+        finally:
+            store.close()
+
+    if problems:
+        exit("The imported store is wrong: " + "; ".join(problems))
+    print("The imported store holds every CVE once, in its most recent version")
+
+
+if __name__ == "__main__":
+    main()
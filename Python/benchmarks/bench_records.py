@@ -0,0 +1,168 @@
+"""
+Micro-benchmark of building report rows, comparing the original per-field lookups into the CVE
+record and list rows against the compact rows of nvd_records.
+
+CVE records are cloned from the fortios fixture in test_data, each parsed separately as if it
+came off a different API page, and turned into rows for a few inventory CPE names each before
+the record is dropped. Reports the build time and the memory the finished table holds.
+
+Run from the repository root: python Python/benchmarks/bench_records.py --rows 100000
+"""
+
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import nvd_records
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "test_data",
+                       "cve_results_cpe_2.3_o_fortinet_fortios_7.2.7_______.json")
+
+
+# The row builder nist_vuln_checker.py used before nvd_records, kept as the baseline
+def legacy_build_row(cpe, cve, cpeMatch):
+
+    id= cve['cve']['id'] if 'id' in cve['cve'] else 'N/A'
+    cpeSearch = cpe
+    sourceIdentifier = cve['cve']['sourceIdentifier'] if 'sourceIdentifier' in cve['cve'] else 'N/A'
+    published = cve['cve']['published'] if 'published' in cve['cve'] else 'N/A'
+    lastModified = cve['cve']['lastModified'] if 'lastModified' in cve['cve'] else 'N/A'
+    vulnStatus = cve['cve']['vulnStatus'] if 'vulnStatus' in cve['cve'] else 'N/A'
+    descriptions = cve['cve']['descriptions'] if 'descriptions' in cve['cve'] else [{'value': 'N/A'}]
+
+    if 'cvssMetricV31' in cve['cve']['metrics']:
+        version = "3.1"
+        source= cve['cve']['metrics']['cvssMetricV31'][0]['source'] if 'cvssMetricV31' in cve['cve']['metrics'] else 'N/A'
+        baseScore = cve['cve']['metrics']['cvssMetricV31'][0]['cvssData']['baseScore'] if 'cvssMetricV31' in cve['cve']['metrics'] else 'N/A'
+        baseSeverity = cve['cve']['metrics']['cvssMetricV31'][0]['cvssData']['baseSeverity'] if 'cvssMetricV31' in cve['cve']['metrics'] else 'N/A'
+        attackVector = cve['cve']['metrics']['cvssMetricV31'][0]['cvssData']['attackVector'] if 'cvssMetricV31' in cve['cve']['metrics'] else 'N/A'
+        privilegesRequired = cve['cve']['metrics']['cvssMetricV31'][0]['cvssData']['privilegesRequired'] if 'cvssMetricV31' in cve['cve']['metrics'] else 'N/A'
+        userInteraction = cve['cve']['metrics']['cvssMetricV31'][0]['cvssData']['userInteraction'] if 'cvssMetricV31' in cve['cve']['metrics'] else 'N/A'
+        confidentialityImpact = cve['cve']['metrics']['cvssMetricV31'][0]['cvssData']['confidentialityImpact'] if 'cvssMetricV31' in cve['cve']['metrics'] else 'N/A'
+        integrityImpact = cve['cve']['metrics']['cvssMetricV31'][0]['cvssData']['integrityImpact'] if 'cvssMetricV31' in cve['cve']['metrics'] else 'N/A'
+        availabilityImpact = cve['cve']['metrics']['cvssMetricV31'][0]['cvssData']['availabilityImpact'] if 'cvssMetricV31' in cve['cve']['metrics'] else 'N/A'
+        exploitabilityScore = cve['cve']['metrics']['cvssMetricV31'][0]['exploitabilityScore'] if 'cvssMetricV31' in cve['cve']['metrics'] else 'N/A'
+        impactScore = cve['cve']['metrics']['cvssMetricV31'][0]['impactScore'] if 'cvssMetricV31' in cve['cve']['metrics'] else 'N/A'
+
+    elif 'cvssMetricV30' in cve['cve']['metrics']:
+        version = "3.0"
+        source = cve['cve']['metrics']['cvssMetricV30'][0]['source'] if 'cvssMetricV30' in cve['cve']['metrics'] else 'N/A'
+        baseScore = cve['cve']['metrics']['cvssMetricV30'][0]['cvssData']['baseScore'] if 'cvssMetricV30' in cve['cve']['metrics'] else 'N/A'
+        baseSeverity = cve['cve']['metrics']['cvssMetricV30'][0]['cvssData']['baseSeverity'] if 'cvssMetricV30' in cve['cve']['metrics'] else 'N/A'
+        attackVector = cve['cve']['metrics']['cvssMetricV30'][0]['cvssData']['attackVector'] if 'cvssMetricV30' in cve['cve']['metrics'] else 'N/A'
+        privilegesRequired = cve['cve']['metrics']['cvssMetricV30'][0]['cvssData']['privilegesRequired'] if 'cvssMetricV30' in cve['cve']['metrics'] else 'N/A'
+        userInteraction = cve['cve']['metrics']['cvssMetricV30'][0]['cvssData']['userInteraction'] if 'cvssMetricV30' in cve['cve']['metrics'] else 'N/A'
+        confidentialityImpact = cve['cve']['metrics']['cvssMetricV30'][0]['cvssData']['confidentialityImpact'] if 'cvssMetricV30' in cve['cve']['metrics'] else 'N/A'
+        integrityImpact = cve['cve']['metrics']['cvssMetricV30'][0]['cvssData']['integrityImpact'] if 'cvssMetricV30' in cve['cve']['metrics'] else 'N/A'
+        availabilityImpact = cve['cve']['metrics']['cvssMetricV30'][0]['cvssData']['availabilityImpact'] if 'cvssMetricV30' in cve['cve']['metrics'] else 'N/A'
+        exploitabilityScore = cve['cve']['metrics']['cvssMetricV30'][0]['exploitabilityScore'] if 'cvssMetricV30' in cve['cve']['metrics'] else 'N/A'
+        impactScore = cve['cve']['metrics']['cvssMetricV30'][0]['impactScore'] if 'cvssMetricV30' in cve['cve']['metrics'] else 'N/A'
+
+    else:
+        version = "2.0"
+        source= cve['cve']['metrics']['cvssMetricV2'][0]['source'] if 'cvssMetricV2' in cve['cve']['metrics'] else 'N/A'
+        baseScore = cve['cve']['metrics']['cvssMetricV2'][0]['cvssData']['baseScore'] if 'cvssMetricV2' in cve['cve']['metrics'] else 'N/A'
+        baseSeverity = cve['cve']['metrics']['cvssMetricV2'][0]['baseSeverity'] if 'cvssMetricV2' in cve['cve']['metrics'] else 'N/A'
+        attackVector = cve['cve']['metrics']['cvssMetricV2'][0]['cvssData']['accessVector'] if 'cvssMetricV2' in cve['cve']['metrics'] else 'N/A'
+        privilegesRequired = cve['cve']['metrics']['cvssMetricV2'][0]['cvssData']['authentication'] if 'cvssMetricV2' in cve['cve']['metrics'] else 'N/A'
+        userInteraction = cve['cve']['metrics']['cvssMetricV2'][0]['userInteractionRequired'] if 'cvssMetricV2' in cve['cve']['metrics'] else 'N/A'
+        confidentialityImpact = cve['cve']['metrics']['cvssMetricV2'][0]['cvssData']['confidentialityImpact'] if 'cvssMetricV2' in cve['cve']['metrics'] else 'N/A'
+        integrityImpact = cve['cve']['metrics']['cvssMetricV2'][0]['cvssData']['integrityImpact'] if 'cvssMetricV2' in cve['cve']['metrics'] else 'N/A'
+        availabilityImpact = cve['cve']['metrics']['cvssMetricV2'][0]['cvssData']['availabilityImpact'] if 'cvssMetricV2' in cve['cve']['metrics'] else 'N/A'
+        exploitabilityScore = cve['cve']['metrics']['cvssMetricV2'][0]['exploitabilityScore'] if 'cvssMetricV2' in cve['cve']['metrics'] else 'N/A'
+        impactScore = cve['cve']['metrics']['cvssMetricV2'][0]['impactScore'] if 'cvssMetricV2' in cve['cve']['metrics'] else 'N/A'                            
+
+    weaknesses = cve['cve']['weaknesses'] if 'weaknesses' in cve['cve'] else [{'description': [{'value': 'N/A'}]}]
+    vulnerable = cpeMatch['vulnerable'] if 'vulnerable' in cpeMatch else 'N/A'
+    criteria = cpeMatch['criteria'] if 'criteria' in cpeMatch else 'N/A'    
+    versionStartIncluding = cpeMatch['versionStartIncluding'] if 'versionStartIncluding' in cpeMatch else 'N/A'
+    versionEndExcluding = cpeMatch['versionEndExcluding'] if 'versionEndExcluding' in cpeMatch else 'N/A'
+                                                     
+    # Return this CVE information as a row of the table data
+    return [id,
+            cpeSearch,
+            sourceIdentifier,
+            published,
+            lastModified,
+            vulnStatus,
+            descriptions[0]['value'],
+            version,
+            source,
+            baseScore,
+            baseSeverity,
+            attackVector,
+            privilegesRequired,
+            userInteraction,
+            confidentialityImpact,
+            integrityImpact,
+            availabilityImpact,
+            exploitabilityScore,
+            impactScore,
+            weaknesses[0]['description'][0]['value'],
+            vulnerable,
+            criteria,
+            versionStartIncluding,
+            versionEndExcluding
+            ]
+
+
+
+# Yield freshly parsed CVE records, `count` in total, cycling through the fixture
+def iter_records(count):
+    with open(FIXTURE) as f:
+        templates = [json.dumps(vulnerability) for vulnerability in json.load(f)['vulnerabilities']]
+    for number in range(count):
+        vulnerability = json.loads(templates[number % len(templates)])
+        vulnerability['cve']['id'] = f"CVE-2099-{number:06d}"
+        yield vulnerability
+
+
+# Build the table with `build(vulnerability, matches)`, which returns the rows of a record for its
+# (cpe, cpeMatch) pairs like the matching produces them. Returns the build time in seconds and the
+# bytes still allocated for the table once the records are gone.
+def run(build, rows, per_cve, trace):
+    inventory = [f"cpe:2.3:o:fortinet:fortios:7.2.{version}:*:*:*:*:*:*:*" for version in range(per_cve)]
+    gc.collect()
+    if trace:
+        tracemalloc.start()
+    elapsed = 0.0
+    table_data = []
+    for vulnerability in iter_records(rows // per_cve):
+        match = vulnerability['cve']['configurations'][0]['nodes'][0]['cpeMatch'][0]
+        started = time.perf_counter()
+        table_data.extend(build(vulnerability, [(cpe, match) for cpe in inventory]))
+        elapsed += time.perf_counter() - started
+        del vulnerability, match
+    gc.collect()
+    held = tracemalloc.get_traced_memory()[0] if trace else 0
+    if trace:
+        tracemalloc.stop()
+    return len(table_data), elapsed, held
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare building report rows with and without nvd_records")
+    parser.add_argument("--rows", type=int, default=100000, help="Number of rows to build (default: 100000)")
+    parser.add_argument("--per-cve", type=int, default=4, help="Inventory CPE names matched by each CVE (default: 4)")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per approach, the fastest is reported (default: 3)")
+    args = parser.parse_args()
+
+    # Each run gets a fresh builder, so no CVE summaries carry over between runs
+    approaches = (("list rows", lambda: lambda vulnerability, matches: [legacy_build_row(cpe, vulnerability, match) for cpe, match in matches]),
+                  ("nvd_records", lambda: nvd_records.RowBuilder().rows))
+    print(f"{'approach':<12} {'rows':>8} {'build s':>8} {'us/row':>7} {'table MB':>9} {'bytes/row':>10}")
+    for name, builder in approaches:
+        # Time without tracing, then measure the memory in a separate run
+        elapsed = min(run(builder(), args.rows, args.per_cve, False)[1] for _ in range(args.repeat))
+        count, _, held = run(builder(), args.rows, args.per_cve, True)
+        print(f"{name:<12} {count:>8} {elapsed:>8.2f} {elapsed / count * 1e6:>7.2f} {held / 2**20:>9.1f} {held / count:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+"""
+Local stand-in for the NVD CPE and CVE APIs, for benchmarking nist_vuln_checker.py without
+touching the real service or its quota.
+
+The CVE API answers cpeName and virtualMatchString queries with CVEs built from the recorded
+fixtures in test_data. By default every part:vendor:product gets --cves-per-product CVEs, cloned
+from the fixtures with their CPE criteria rewritten to that product and their ids derived from
+it, so the same query always gets the same answer. With --cves-per-product 0 the fixtures are
+replayed unchanged and a query gets the recorded CVEs whose criteria name its product. Version
+bounds are not applied, the checker filters versions itself. lastModStartDate/lastModEndDate
+and resultsPerPage/startIndex are honored as in the real API.
+
+The CPE API answers with the CPE name itself for a concrete version, or with a few versions of
+the product otherwise. Asked without a cpeMatchString it serves a CPE dictionary of
+--dictionary-products products, named like the inventories of run_suite.py, and honors the
+lastModStartDate/lastModEndDate of an incremental update. Responses can be delayed with --latency and a share of them turned into
+429, 500 or 503 errors with --error-rate. GET /stats returns the counters as JSON, add ?reset=1
+to zero them.
+
+Point the checker at it with NVD_URL, and lift the client side rate limit with NVD_RATELIMIT:
+    python Python/benchmarks/nvd_standin.py --port 8765
+    NVD_URL=http://127.0.0.1:8765 NVD_RATELIMIT=1000/1 python Python/nist_vuln_checker.py
+"""
+
+import argparse
+import copy
+import datetime
+import json
+import os
+import random
+import threading
+import time
+import urllib.parse
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FIXTURES = [os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "test_data",
+                         "cve_results_cpe_2.3_o_fortinet_fortios_7.2.7_______.json")]
+
+CPEVERSIONS = ("6.4.9", "7.0.12", "7.2.7", "7.4.3", "7.6.0")   # Versions the CPE API offers for a product
+PARTS = ("o", "a", "h")   # Parts of the dictionary's products, by product number as in run_suite.py
+ERRORS = (429, 500, 503)
+MAXCVES = 2000     # resultsPerPage limits of the real API
+MAXCPES = 10000
+DATEFORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+
+# The part:vendor:product of a CPE string, which may be partial
+def product_key(cpe):
+    return ":".join((cpe.split(":") + [""] * 5)[2:5])
+
+
+# Dates are compared without a time zone, ones that carry an offset are converted to UTC first
+def parse_date(value):
+    if not value:
+        return None
+    moment = datetime.datetime.fromisoformat(value.replace("Z", ""))
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+def cpe_matches(vulnerability):
+    for configuration in vulnerability['cve'].get('configurations', []):
+        for node in configuration.get('nodes', []):
+            yield from node.get('cpeMatch', [])
+
+
+class StandIn:
+    def __init__(self, fixtures, cves_per_product, latency, error_rate, retry_after, seed, dictionary_products=0):
+        self.recorded = []
+        for path in fixtures:
+            with open(path, encoding='utf-8') as f:
+                self.recorded.extend(json.load(f).get('vulnerabilities', []))
+        if not self.recorded:
+            raise ValueError("The fixtures hold no vulnerabilities")
+
+        self.cves_per_product = cves_per_product
+        self.latency = latency
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.now = datetime.datetime.now()
+        self.products = {}
+        self.dictionary = self.cpe_dictionary(dictionary_products)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.stats = {'requests': 0, 'cpe_requests': 0, 'cve_requests': 0, 'errors': {},
+                          'items': 0, 'bytes': 0, 'started': time.time()}
+
+    def snapshot(self):
+        with self.lock:
+            stats = copy.deepcopy(self.stats)
+        stats['elapsed'] = time.time() - stats.pop('started')
+        return stats
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.stats[name] += value
+
+    # Decide whether a request fails, and how
+    def error(self):
+        with self.lock:
+            if self.random.random() >= self.error_rate:
+                return None
+            status = self.random.choice(ERRORS)
+            self.stats['errors'][str(status)] = self.stats['errors'].get(str(status), 0) + 1
+            return status
+
+    # The CVEs of a product, built once and kept
+    def product_cves(self, key):
+        with self.lock:
+            if key not in self.products:
+                self.products[key] = self.replay(key) if self.cves_per_product == 0 else self.synthesize(key)
+            return self.products[key]
+
+    def replay(self, key):
+        return [vulnerability for vulnerability in self.recorded
+                if any(product_key(match.get('criteria', '')) == key for match in cpe_matches(vulnerability))]
+
+    # Clone the recorded CVEs round robin, pointing them at the product. Ids and modification
+    # times only depend on the product, so repeated runs see the same CVEs. Every CVE was modified
+    # between one and sixty days ago, inside the checker's default search window however soon
+    # after the stand-in it starts.
+    def synthesize(self, key):
+        base = zlib.crc32(key.encode())
+        cves = []
+        for index in range(self.cves_per_product):
+            vulnerability = copy.deepcopy(self.recorded[index % len(self.recorded)])
+            cve = vulnerability['cve']
+            cve['id'] = f"CVE-2099-{base:010d}{index:04d}"
+            modified = self.now - datetime.timedelta(days=1 + (base + index) % 60, minutes=index)
+            cve['lastModified'] = modified.strftime(DATEFORMAT)[:-3]
+            for match in cpe_matches(vulnerability):
+                components = match['criteria'].split(":")
+                components[2:5] = key.split(":")
+                match['criteria'] = ":".join(components)
+            cves.append(vulnerability)
+        return cves
+
+    def cves(self, params):
+        cpe = params.get('cpeName') or params.get('virtualMatchString') or ""
+        vulnerabilities = self.product_cves(product_key(cpe))
+
+        start, end = parse_date(params.get('lastModStartDate')), parse_date(params.get('lastModEndDate'))
+        if start or end:
+            vulnerabilities = [vulnerability for vulnerability in vulnerabilities
+                               if (start is None or parse_date(vulnerability['cve']['lastModified']) >= start)
+                               and (end is None or parse_date(vulnerability['cve']['lastModified']) <= end)]
+        return 'vulnerabilities', vulnerabilities, MAXCVES
+
+    # CPE names for the benchmark products, each modified between one and sixty days ago
+    def cpe_dictionary(self, count):
+        dictionary = []
+        for index in range(count):
+            key = f"{PARTS[index % len(PARTS)]}:benchvendor{index % 7}:product{index:04d}"
+            modified = self.now - datetime.timedelta(days=1 + zlib.crc32(key.encode()) % 60)
+            for release in CPEVERSIONS:
+                dictionary.append({'cpe': {'cpeName': f"cpe:2.3:{key}:{release}:*:*:*:*:*:*:*", 'deprecated': False,
+                                           'lastModified': modified.strftime(DATEFORMAT)[:-3]}})
+        return dictionary
+
+    def cpes(self, params):
+        if 'cpeMatchString' not in params:
+            start, end = parse_date(params.get('lastModStartDate')), parse_date(params.get('lastModEndDate'))
+            products = [product for product in self.dictionary
+                        if (start is None or parse_date(product['cpe']['lastModified']) >= start)
+                        and (end is None or parse_date(product['cpe']['lastModified']) <= end)]
+            return 'products', products, MAXCPES
+
+        components = (params.get('cpeMatchString', "").split(":") + [""] * 6)[:6]
+        key, version = product_key(":".join(components)), components[5]
+        versions = [version] if version not in ("", "*", "-") else CPEVERSIONS
+        products = [{'cpe': {'cpeName': f"cpe:2.3:{key}:{release}:*:*:*:*:*:*:*", 'deprecated': False}}
+                    for release in versions]
+        return 'products', products, MAXCPES
+
+    # A page of the results of a query, in the shape of the API's responses
+    def page(self, path, params):
+        if path.startswith("/cpes/2.0"):
+            self.count('cpe_requests')
+            key, items, limit = self.cpes(params)
+        elif path.startswith("/cves/2.0"):
+            self.count('cve_requests')
+            key, items, limit = self.cves(params)
+        else:
+            return None
+
+        start = int(params.get('startIndex', 0))
+        per_page = min(int(params.get('resultsPerPage', limit)), limit)
+        selected = items[start:start + per_page]
+        self.count('items', len(selected))
+        return {'resultsPerPage': len(selected),
+                'startIndex': start,
+                'totalResults': len(items),
+                'format': "NVD_CVE" if key == 'vulnerabilities' else "NVD_CPE",
+                'version': "2.0",
+                'timestamp': self.now.strftime(DATEFORMAT)[:-3],
+                key: selected}
+
+
+def make_handler(standin):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_body(self, status, body, headers=()):
+            self.send_response(status)
+            for name, value in headers:
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urllib.parse.urlsplit(self.path)
+            params = dict(urllib.parse.parse_qsl(url.query))
+            path = url.path.rstrip("/")
+
+            if path == "/stats":
+                if params.get('reset'):
+                    standin.reset()
+                self.send_body(200, json.dumps(standin.snapshot()).encode(), [("Content-Type", "application/json")])
+                return
+
+            standin.count('requests')
+            if standin.latency:
+                time.sleep(standin.latency)
+
+            status = standin.error()
+            if status in (429, 503):
+                self.send_body(status, b"", [("Retry-After", str(standin.retry_after))])
+                return
+            if status:
+                self.send_body(status, b"")
+                return
+
+            try:
+                page = standin.page(path, params)
+            except ValueError as e:
+                self.send_body(404, str(e).encode(), [("message", str(e))])
+                return
+            if page is None:
+                self.send_body(404, b"")
+                return
+
+            body = json.dumps(page).encode()
+            standin.count('bytes', len(body))
+            self.send_body(200, body, [("Content-Type", "application/json")])
+
+    return Handler
+
+
+def serve(standin, host, port):
+    server = ThreadingHTTPServer((host, port), make_handler(standin))
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a local stand-in for the NVD CPE and CVE APIs")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on, 0 picks a free one (default: 8765)")
+    parser.add_argument("--fixture", action="append", help="Recorded CVE API response to serve from, may be repeated (default: the fortios fixture in test_data)")
+    parser.add_argument("--cves-per-product", type=int, default=20, help="CVEs synthesized for every product, 0 replays the fixtures unchanged (default: 20)")
+    parser.add_argument("--latency", type=float, default=0, help="Milliseconds to wait before every response (default: 0)")
+    parser.add_argument("--error-rate", type=float, default=0, help="Share of requests answered with 429, 500 or 503 (default: 0)")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with a 429 or 503 (default: 1)")
+    parser.add_argument("--dictionary-products", type=int, default=0, help="Products in the CPE dictionary served without a cpeMatchString (default: 0)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for choosing the failing requests (default: 0)")
+    args = parser.parse_args()
+
+    standin = StandIn(args.fixture or FIXTURES, args.cves_per_product, args.latency / 1000,
+                      args.error_rate, args.retry_after, args.seed, args.dictionary_products)
+    server = serve(standin, args.host, args.port)
+    host, port = server.server_address[:2]
+    print(f"NVD stand-in listening on http://{host}:{port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+End to end benchmark of nist_vuln_checker.py against the local NVD stand-in.
+
+Starts nvd_standin.py on a free port and runs the checker on synthetic inventories of 10, 100
+and 1000 products, once for every strategy: the query plan, the per-CPE flow (--no-plan),
+streamed pages (--stream), worker processes (--processes) and a sync into a local store (--sync).
+Every run starts in an empty directory, so no response cache or store carries over between runs.
+Reports the wall time, the API requests the stand-in served and the rate of them, the peak RSS of
+the checker and the report rows written per second. The peak RSS is that of the checker process
+alone, the worker processes of --processes are not included.
+
+The inventories hold families of four versions of a product, as product lists usually do. The
+client side rate limit is lifted with NVD_RATELIMIT so that the checker itself is measured;
+--latency and --error-rate are passed to the stand-in to see how a run copes with a slow or
+failing API.
+
+Run from the repository root:
+    python Python/benchmarks/run_suite.py --sizes 10 100 --json results.json
+    python Python/benchmarks/run_suite.py --compare results.json
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CHECKER = os.path.join(HERE, "..", "nist_vuln_checker.py")
+STANDIN = os.path.join(HERE, "nvd_standin.py")
+
+VERSIONS = ("6.4.9", "7.0.12", "7.2.7", "7.4.3")   # Versions of every product family, within the fixture's ranges
+PARTS = ("o", "a", "h")
+
+# Strategy name and the checker arguments it adds
+STRATEGIES = {
+    'plan': [],
+    'no-plan': ["--no-plan"],
+    'stream': ["--stream"],
+    'processes': ["--processes"],
+    'sync': ["--sync", "--store", "store.sqlite"],
+}
+
+REGRESSION = 0.2   # Slowdown of wall time or growth of peak RSS over the baseline that is flagged
+
+
+# Write a product list of `size` entries in families of versions of one product
+def write_inventory(path, size):
+    with open(path, 'w', newline='') as f:
+        for index in range(size):
+            family, version = divmod(index, len(VERSIONS))
+            part = PARTS[family % len(PARTS)]
+            f.write(f"cpe:2.3:{part}:benchvendor{family % 7}:product{family:04d}:{VERSIONS[version]}\n")
+
+
+def start_standin(args):
+    command = [sys.executable, STANDIN, "--port", "0",
+               "--cves-per-product", str(args.cves_per_product),
+               "--latency", str(args.latency),
+               "--error-rate", str(args.error_rate)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline()
+    if not line.startswith("NVD stand-in listening on "):
+        process.kill()
+        exit(f"The NVD stand-in did not start: {line.strip()}")
+    return process, line.rsplit(" ", 1)[1].strip()
+
+
+def standin_stats(url, reset=False):
+    with urllib.request.urlopen(f"{url}/stats{'?reset=1' if reset else ''}") as resp:
+        return json.load(resp)
+
+
+# Run the checker once in an empty directory and measure it
+def run_checker(url, size, strategy, args):
+    with tempfile.TemporaryDirectory(prefix="nvd_bench_") as workdir:
+        write_inventory(os.path.join(workdir, "products.csv"), size)
+        env = dict(os.environ, NVD_URL=url, NVD_RATELIMIT=args.ratelimit)
+        env.pop("NVD_API_KEY", None)
+        command = [sys.executable, CHECKER, "--products", "products.csv", "--output", "report.jsonl"] + STRATEGIES[strategy]
+
+        standin_stats(url, reset=True)
+        started = time.perf_counter()
+        with open(os.path.join(workdir, "checker.log"), 'w') as log:
+            process = subprocess.Popen(command, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+            _, status, usage = os.wait4(process.pid, 0)
+        wall = time.perf_counter() - started
+        stats = standin_stats(url)
+
+        report = os.path.join(workdir, "report.jsonl")
+        rows = 0
+        if os.path.isfile(report):
+            with open(report, 'rb') as f:
+                rows = sum(1 for _ in f)
+
+        if os.waitstatus_to_exitcode(status) != 0 and rows == 0:
+            with open(os.path.join(workdir, "checker.log")) as log:
+                tail = log.read()[-2000:]
+            print(f"{strategy} on {size} products failed:\n{tail}", file=sys.stderr)
+
+    # ru_maxrss is in kilobytes on Linux, in bytes on macOS
+    peak_rss = usage.ru_maxrss / 1024 if sys.platform != "darwin" else usage.ru_maxrss / 1024 / 1024
+    return {'size': size,
+            'strategy': strategy,
+            'wall': wall,
+            'requests': stats['requests'],
+            'errors': sum(stats['errors'].values()),
+            'requests_per_second': stats['requests'] / wall,
+            'peak_rss_mb': peak_rss,
+            'rows': rows,
+            'rows_per_second': rows / wall}
+
+
+def print_results(results, baseline):
+    print(f"{'products':>8} {'strategy':<10} {'wall s':>8} {'requests':>8} {'errors':>6} {'req/s':>8} {'peak MB':>8} {'rows':>8} {'rows/s':>9}")
+    for result in results:
+        line = (f"{result['size']:>8} {result['strategy']:<10} {result['wall']:>8.2f} {result['requests']:>8} "
+                f"{result['errors']:>6} {result['requests_per_second']:>8.1f} {result['peak_rss_mb']:>8.1f} "
+                f"{result['rows']:>8} {result['rows_per_second']:>9.0f}")
+        before = baseline.get((result['size'], result['strategy']))
+        if before:
+            flags = []
+            if result['wall'] > before['wall'] * (1 + REGRESSION):
+                flags.append(f"wall {result['wall'] / before['wall']:.2f}x")
+            if result['peak_rss_mb'] > before['peak_rss_mb'] * (1 + REGRESSION):
+                flags.append(f"rss {result['peak_rss_mb'] / before['peak_rss_mb']:.2f}x")
+            if result['rows'] != before['rows']:
+                flags.append(f"rows {before['rows']} -> {result['rows']}")
+            if flags:
+                line += "  REGRESSION: " + ", ".join(flags)
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark nist_vuln_checker.py against a local NVD stand-in")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000], help="Inventory sizes in products (default: 10 100 1000)")
+    parser.add_argument("--strategies", nargs="+", choices=list(STRATEGIES), default=list(STRATEGIES), help="Strategies to run (default: all)")
+    parser.add_argument("--cves-per-product", type=int, default=20, help="CVEs the stand-in serves for every product (default: 20)")
+    parser.add_argument("--latency", type=float, default=0, help="Milliseconds the stand-in waits before every response (default: 0)")
+    parser.add_argument("--error-rate", type=float, default=0, help="Share of requests the stand-in fails with 429, 500 or 503 (default: 0)")
+    parser.add_argument("--ratelimit", default="1000/1", help="Client side rate limit as requests/seconds (default: 1000/1)")
+    parser.add_argument("--json", help="Write the results to this file, to compare later runs against")
+    parser.add_argument("--compare", help="Results of an earlier run to flag regressions against")
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = {(result['size'], result['strategy']): result for result in json.load(f)['results']}
+
+    process, url = start_standin(args)
+    results = []
+    try:
+        for size in args.sizes:
+            for strategy in args.strategies:
+                result = run_checker(url, size, strategy, args)
+                print(f"{strategy} on {size} products: {result['wall']:.2f} s, {result['rows']} rows", flush=True)
+                results.append(result)
+    finally:
+        process.terminate()
+        process.wait()
+
+    print()
+    print_results(results, baseline)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'settings': vars(args), 'results': results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,72 @@
 import requests
+import argparse
 import csv
 import datetime
 import time
+import os
 import os.path 
 import json
-import packaging   # pip install packaging
+import threading
+import email.utils
+import collections
+import concurrent.futures
 import urllib.parse     #pip install urllib.parse
-import xlsxwriter   #pip install xlsxwriter
+import nvd_cache
+import nvd_cpe_dict
+import nvd_feeds
+import nvd_journal
+import nvd_match
+import nvd_metrics
+import nvd_planner
+import nvd_records
+import nvd_rollup
+import nvd_service
+import nvd_sinks
+import nvd_store
+import nvd_stream
+import nvd_workers
 
 # References
 APPLICATION="a"
 OPERATINGSYSTEM="o"
 HARDWARE="h"
 PRODUCTLIST="Python/test_data/productlist.csv"
-FILENAME="Python/test_data/cves.xlsx"
+FILENAME="Python/test_data/cves.xlsx"   # Default report, --output also takes .csv and .jsonl files
 MAXRETRIES=3   # Number of retry attempts for network requests
+MAXWORKERS=8   # Number of concurrent requests in flight, all of them share the rate limiter below
+REQUESTTIMEOUT=60   # Seconds to wait for the NVD API to answer a single request
+
+# NVD API rate limits (https://nvd.nist.gov/developers/start-here), requests per rolling window in seconds
+NVD_API_KEY=os.environ.get("NVD_API_KEY")   # Request a key from NVD and export it, never commit it
+NVD_RATELIMIT=(50, 30) if NVD_API_KEY else (5, 30)
+if os.environ.get("NVD_RATELIMIT"):   # "requests/seconds", for use against a stand-in API only
+    NVD_RATELIMIT=tuple(float(value) for value in os.environ["NVD_RATELIMIT"].split("/"))
+THROTTLED=(403, 429, 503)   # NVD answers 403 or 429 when throttling and 503 when overloaded
+THROTTLEWAIT=30   # Seconds to back off when the API does not send a Retry-After header
+NVD_URL=os.environ.get("NVD_URL", "https://services.nvd.nist.gov/rest/json")   # Point at a stand-in such as Python/benchmarks/nvd_standin.py
+
+# On-disk response cache, set CACHEDIR to None to always query the API
+CACHEDIR="Python/.nvd_cache"
+CACHETTL={'/cpes/2.0': 7*24*3600,   # The CPE dictionary rarely changes, keep answers for a week
+          '/cves/2.0': 8*3600}      # CVEs change daily, keep answers for a working day
+CACHESIZE=512*1024*1024   # Least recently used responses are evicted beyond this many bytes
+
+# Local CVE store kept up to date by --sync
+STOREFILE="Python/.nvd_store.sqlite"
+
+# Checkpoint journal kept by --journal, an interrupted run started again continues from it
+JOURNALFILE="Python/.nvd_journal.jsonl"
+
+# Local CPE dictionary used by --cpe-dictionary to resolve the product list without the CPE API
+CPEDICTFILE="Python/.nvd_cpes.sqlite"
+
+# Lookup service started by --serve, answering from the local CVE store
+SERVICEHOST="127.0.0.1"   # Only answer lookups from this machine
+SERVICEPORT=8770
+SERVICEREFRESH=4*3600     # Seconds between syncs of the store behind the service
+
+# Narrow grouped queries to the versions in the product list, set to False to fetch every version of a product
+VERSIONBOUNDS=True
 
 # Define a product class to hold product information
 class product:
@@ -28,293 +80,923 @@ class product:
     def cpe_string(self):
         return f"cpe:2.3:{self.type}:{self.manufacturer}:{self.software}:{self.version}:*:*:*:*:*:*:*"
 
-# Define a function to query the NVD api for CPEs and CVEs
-def query_nvd(url, context, retries):
+# Define a token bucket shared by every request so that concurrent workers stay inside the NVD quota
+class TokenBucket:
+    def __init__(self, limit, window):
+        # Tokens refill evenly over the window. The bucket only holds a single token so that no
+        # rolling window can see a burst on top of the refill rate, i.e. at most `limit` requests
+        self.fill_rate = limit / window
+        self.capacity = 1
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.resume_at = 0
+        self.granted = 0   # Requests let through, reported at the end of a run
+        self.lock = threading.Lock()
+
+    # Block until a token is available, then take it. Returns the seconds spent waiting.
+    def acquire(self):
+        waited = 0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now >= self.resume_at:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.fill_rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        self.granted += 1
+                        return waited
+                    wait = (1 - self.tokens) / self.fill_rate
+                else:
+                    wait = self.resume_at - now
+            time.sleep(wait)
+            waited += wait
+
+    # Stop handing out tokens to every worker for the given number of seconds (Retry-After)
+    def pause(self, seconds):
+        with self.lock:
+            self.resume_at = max(self.resume_at, time.monotonic() + seconds)
+            self.tokens = 0
+            self.updated = self.resume_at
+
+rate_limiter = TokenBucket(*NVD_RATELIMIT)
+response_cache = None   # Opened by main() when CACHEDIR is set
+stream_pages = False    # Set by --stream, parse CVE pages as they arrive instead of all at once
+stages = nvd_metrics.StageTimer()   # Time of the main thread by stage, see nvd_metrics
+tracer = nvd_metrics.Tracer()       # Spans of the run, kept when they are pushed with --otlp
+journal = None   # Opened by main() with --journal, see nvd_journal
+cpe_dictionary = None   # Opened by main() with --cpe-dictionary, see nvd_cpe_dict
+thread_data = threading.local()
+
+# Each worker thread keeps its own HTTP session so connections are reused without sharing state
+def get_session():
+    if not hasattr(thread_data, 'session'):
+        thread_data.session = requests.Session()
+        if NVD_API_KEY:
+            thread_data.session.headers['apiKey'] = NVD_API_KEY
+    return thread_data.session
+
+# Work out how long the API asked us to wait, Retry-After is either seconds or an HTTP date
+def retry_after(resp):
+    value = resp.headers.get('Retry-After')
+    if value is None:
+        return THROTTLEWAIT
+    if value.strip().isdigit():
+        return int(value)
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+        return max(0, (retry_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return THROTTLEWAIT
+
+# Raised by query_nvd when every attempt failed, as opposed to returning None when there are no results
+class NvdQueryError(Exception):
+    pass
+
+# Check if we got any results but continue if not
+def check_results(resp_json, context):
+    total_results = resp_json['totalResults']
+
+    if total_results == 0:
+        print(f'No results found for {context}')
+        return None
+
+    return resp_json
+
+# Send a request to the NVD API and hand the response to `parse`, which returns what the caller
+# needs from it. Network errors, throttling, error statuses and responses that `parse` rejects
+# with a ValueError are retried.
+def request_nvd(url, context, retries, parse, stream=False):
+    endpoint = nvd_metrics.endpoint(url)
 
     # We will make retry attempts in case of network issues or rate limiting
     for attempt in range(retries):
+        # Wait for our turn in the shared quota
+        nvd_metrics.RATELIMIT_SECONDS.inc(rate_limiter.acquire())
+
+        span = tracer.start(f"GET {endpoint}", nvd_metrics.CLIENT, url=url, attempt=attempt + 1)
         try:
             # Fetch the data from the NVD API
-            resp = requests.get(url)
-            resp_json = resp.json()
-
-            # Check if we got any results but continue if not
-            total_results = resp_json['totalResults']
-
-            if total_results == 0:
-                print(f'No results found for {context}')
-                return None
-
-            return resp_json
-
+            resp = get_session().get(url, timeout=REQUESTTIMEOUT, stream=stream)
         except requests.RequestException as e:
-            if resp.status_code == 429:  # Rate limit exceeded, backing off according to NVD API guidelines
-                print(f"Rate limit exceeded, retrying in 30 seconds...")
-                time.sleep(30)
-                continue
-            else:
-                print(f"Error querying NVD API for {context}: {resp.status_code} - {resp.reason}. Retrying {retries - attempt - 1} more times...")
-                time.sleep(1)
-                continue
+            request_done(endpoint, span, "error", "network")
+            print(f"Error querying NVD API for {context}: {e}. Retrying {retries - attempt - 1} more times...")
+            nvd_metrics.backoff(1, "error")
+            continue
+
+        if resp.status_code in THROTTLED:  # Rate limit exceeded, backing off for as long as the API asks
+            delay = retry_after(resp)
+            resp.close()
+            request_done(endpoint, span, resp.status_code, "throttled")
+            nvd_metrics.THROTTLED.inc(endpoint=endpoint, status=resp.status_code)
+            nvd_metrics.BACKOFF_SECONDS.inc(delay, reason="retry_after")
+            print(f"Rate limit exceeded for {context}, retrying in {delay:.0f} seconds...")
+            rate_limiter.pause(delay)
+            continue
+
+        if not resp.ok:
+            resp.close()
+            request_done(endpoint, span, resp.status_code, "status")
+            print(f"Error querying NVD API for {context}: {resp.status_code} - {resp.reason}. Retrying {retries - attempt - 1} more times...")
+            nvd_metrics.backoff(1, "error")
+            continue
 
-    print(f"Failed to fetch data from NVD for {context} after {retries} attempts.")
-    return None
+        try:
+            result = parse(resp)
+        except (ValueError, requests.RequestException) as e:
+            resp.close()
+            request_done(endpoint, span, resp.status_code, "invalid")
+            print(f"Invalid response from NVD API for {context}: {e}. Retrying {retries - attempt - 1} more times...")
+            nvd_metrics.backoff(1, "error")
+            continue
+
+        request_done(endpoint, span, resp.status_code)
+        return result
+
+    nvd_metrics.FAILED.inc(endpoint=endpoint)
+    raise NvdQueryError(f"Failed to fetch data from NVD for {context} after {retries} attempts.")
+
+# Time a finished attempt by endpoint and status and count it when it has to be retried
+def request_done(endpoint, span, status, retry=None):
+    seconds = tracer.end(span, error=retry, status=str(status))
+    nvd_metrics.REQUEST_SECONDS.observe(seconds, endpoint=endpoint, status=status)
+    if retry:
+        nvd_metrics.RETRIES.inc(endpoint=endpoint, reason=retry)
+
+# Define a function to query the NVD api for CPEs and CVEs
+def query_nvd(url, context, retries, cache=True):
+
+    # Answer from the on-disk cache when it holds a fresh copy, this costs none of the quota
+    if cache and response_cache is not None:
+        body = response_cache.get(url)
+        if body is not None:
+            return check_results(json.loads(body), context)
+
+    resp_json, body = request_nvd(url, context, retries, lambda resp: (resp.json(), resp.content))
+    nvd_metrics.RESPONSE_BYTES.inc(len(body), endpoint=nvd_metrics.endpoint(url))
+
+    if cache and response_cache is not None:
+        response_cache.put(url, body)
+
+    return check_results(resp_json, context)
+
+# Like query_nvd, but the body is parsed while it is read from the socket. The page only holds the
+# fields that come before the `key` array, and `key` is an iterator over its items, pruned to what
+# the report uses. The iterator must be consumed by the caller and raises NvdQueryError if the body
+# breaks off. A complete body is also written to the cache on the way through. Without prune the
+# items are handed out whole, as the local store needs them.
+def stream_nvd(url, context, retries, key, cache=True, prune=True):
+
+    def page(fields, items, source, writer):
+        fields[key] = stream_items(items, source, writer, context, prune)
+        if not fields.get('totalResults'):
+            # Nothing to hand out, finish the body now so the response is released and cached
+            fields[key] = list(fields[key])
+        return fields
+
+    if cache and response_cache is not None:
+        f = response_cache.open(url)
+        if f is not None:
+            try:
+                fields, items = nvd_stream.parse_page(iter(lambda: f.read(nvd_stream.CHUNKSIZE), b''), key)
+                return check_results(page(fields, items, f, None), context)
+            except (ValueError, OSError, EOFError):
+                # A damaged cache entry is replaced by asking the API again
+                f.close()
+
+    def parse(resp):
+        writer = response_cache.writer(url) if cache and response_cache is not None else None
+        chunks = nvd_metrics.count_bytes(resp.iter_content(nvd_stream.CHUNKSIZE), nvd_metrics.endpoint(url))
+        try:
+            fields, items = nvd_stream.parse_page(writer.tee(chunks) if writer else chunks, key)
+        except Exception:
+            if writer:
+                writer.discard()
+            raise
+        return page(fields, items, resp, writer)
+
+    return check_results(request_nvd(url, context, retries, parse, stream=True), context)
+
+# Hand out the items of a streamed page, closing the response or cache file once done with it
+def stream_items(items, source, writer, context, prune=True):
+    try:
+        for item in items:
+            yield nvd_stream.prune(item) if prune else item
+        if writer:
+            writer.commit()
+    except (ValueError, OSError, EOFError, requests.RequestException) as e:
+        raise NvdQueryError(f"Reading the response from NVD for {context} failed: {e}") from e
+    finally:
+        if writer:
+            writer.discard()
+        source.close()
+
+# Fetch a page without decoding it, so that a worker process can do that instead. Only the counts
+# at the start of the body are read here. Returns them with the raw body under 'body'.
+def fetch_page(url, context, retries, key, cache=True):
+
+    def parse(resp):
+        fields, items = nvd_stream.parse_page([resp.content], key)
+        return fields, resp.content
+
+    fields = None
+    if cache and response_cache is not None:
+        body = response_cache.get(url)
+        if body is not None:
+            try:
+                fields, items = nvd_stream.parse_page([body], key)
+            except ValueError:
+                fields = None
+
+    if fields is None:
+        fields, body = request_nvd(url, context, retries, parse)
+        nvd_metrics.RESPONSE_BYTES.inc(len(body), endpoint=nvd_metrics.endpoint(url))
+        if cache and response_cache is not None:
+            response_cache.put(url, body)
+
+    fields['body'] = body
+    return check_results(fields, context)
 
 # Set the CVE search parameters
-max_results = 2000     # Maximum number of results per query, set to 1 for testing, Maximum is 2000
+max_results = 2000     # Maximum number of results per page, set to 1 for testing, Maximum is 2000
+max_cpe_results = 10000    # Maximum number of CPE names per page, Maximum is 10000
 #exact_cpe = True   # Functionality removed
 search_days = 90    # set to 0 for full search, or set number of days to limit the search
+MAXWINDOW = 120     # The API rejects lastModStartDate/lastModEndDate ranges longer than 120 days
+SYNCBATCH = 500     # Number of CVEs upserted into the local store at a time
 
 # Calculate the date range
 mod_end = datetime.datetime.now()
 mod_start = datetime.datetime.now() - datetime.timedelta(days=search_days)
 
-# Declare and initialize the product list and table data arrays
-product_list = []
-cpe_list = []
-table_data = []
+# Read the product list and convert each row to a CPE string
+def read_product_list(filename):
+    product_list = []
 
-# Check for a cpe list file first
-#if os.path.isfile(CPELIST):
+    # Check for a cpe list file first
+    #if os.path.isfile(CPELIST):
 
-    # Open the CSV file for reading
-#    csv_reader = csv.reader(open(CPELIST, 'r', newline=''))
+        # Open the CSV file for reading
+    #    csv_reader = csv.reader(open(CPELIST, 'r', newline=''))
 
-    # Import each line into a new product object and append to list
-#    for row in csv_reader:
-#        new_cpe = row[0]
-#        cpe_list.append(new_cpe)
+        # Import each line into a new product object and append to list
+    #    for row in csv_reader:
+    #        new_cpe = row[0]
+    #        cpe_list.append(new_cpe)
 
-#else:
+    #else:
 
-# Check if the product list file exists
-if not os.path.isfile(PRODUCTLIST):
-    exit(f"Product list file '{PRODUCTLIST}' not found. Please create it with the required product information.")
+    # Check if the product list file exists
+    if not os.path.isfile(filename):
+        exit(f"Product list file '{filename}' not found. Please create it with the required product information.")
 
-# Open the CSV file for reading
-csv_reader = csv.reader(open(PRODUCTLIST, 'r', newline=''))
+    # Open the CSV file for reading
+    with open(filename, 'r', newline='') as f:
+        csv_reader = csv.reader(f)
+
+        # Import each line and convert if necessary to append to list
+        for row in csv_reader:
+            if row[0].startswith('cpe:2.3'):
+                # If the row starts with 'cpe:2.3', treat it as a CPE formatted string
+                cpe_string = row[0]
+            
+            else:
+                #else, treat it as a product entry with manufacturer, software, type, and version and construct a CPE string
+                new_product = product(row[0], row[1], row[2], row[3])
+                cpe_string = new_product.cpe_string()
 
-# Import each line and convert if necessary to append to list
-for row in csv_reader:
-    if row[0].startswith('cpe:2.3'):
-        # If the row starts with 'cpe:2.3', treat it as a CPE formatted string
-        cpe_string = row[0]
-    
-    else:
-        #else, treat it as a product entry with manufacturer, software, type, and version and construct a CPE string
-        new_product = product(row[0], row[1], row[2], row[3])
-        cpe_string = new_product.cpe_string()
+            product_list.append(cpe_string)
 
-    product_list.append(cpe_string)
-    
-# Loop through each product in the list
-for cpe_string in product_list:
+    return product_list
+
+# Build the CPE API query that expands a product CPE string into the matching CPE names
+def cpe_query_url(cpe_string):
 
     # Encode the CPE string for use in the URL querystring
     cpe_match_str = urllib.parse.quote_plus(cpe_string)
 
-    cpe_url=f"https://services.nvd.nist.gov/rest/json/cpes/2.0/?cpeMatchString={cpe_match_str}"
-    #print(cpe_url)
-
-    cpe_results = query_nvd(cpe_url, f"{cpe_string}", MAXRETRIES)
-
-    # If we got results, we will now extract the CPE names
-    if cpe_results is not None and 'products' in cpe_results:
+    return f"{NVD_URL}/cpes/2.0/?cpeMatchString={cpe_match_str}&resultsPerPage={max_cpe_results}"
 
-        for cpe in cpe_results['products']:
-            # Append the CPE name to the list
-            cpe_list.append(cpe['cpe']['cpeName'])
+# Build the CVE API query for a set of query parameters, such as {'cpeName': cpe}, within the search window
+def cve_query_url(query_params):
 
-# If we have a CPE list, we will now look for CVEs
-if len(cpe_list) == 0:
-    exit("No CPEs found. Please check your product list or CPE list file.")
-    
-# For each matching CPE we will now look for CVEs
-for cpe in cpe_list:
-
-    # Encode the CPE name and date range for use in the CVE querystring
-    cpe_name_str = urllib.parse.quote_plus(cpe)
+    # Encode the query parameters and date range for use in the CVE querystring
+    query_str = urllib.parse.urlencode(query_params)
     mod_end_str = urllib.parse.quote_plus(mod_end.strftime("%Y-%m-%dT%H:%M:%S"))
     mod_start_str = urllib.parse.quote_plus(mod_start.strftime("%Y-%m-%dT%H:%M:%S"))
     
     if search_days > 0:    
-        cve_url=f"https://services.nvd.nist.gov/rest/json/cves/2.0/?cpeName={cpe_name_str}&lastModStartDate={mod_start_str}&lastModEndDate={mod_end_str}&resultsPerPage={max_results}"
+        return f"{NVD_URL}/cves/2.0/?{query_str}&lastModStartDate={mod_start_str}&lastModEndDate={mod_end_str}&resultsPerPage={max_results}"
     else:
-        cve_url=f"https://services.nvd.nist.gov/rest/json/cves/2.0/?cpeName={cpe_name_str}&resultsPerPage={max_results}"
+        return f"{NVD_URL}/cves/2.0/?{query_str}&resultsPerPage={max_results}"
+
+# Build the CVE API queries that bring the local store up to date for a set of query parameters.
+# Without a high-water mark the full history is fetched, otherwise everything modified since then
+# is fetched in windows no longer than the API allows. The CPE dictionary is brought up to date
+# the same way through the CPE API.
+def sync_query_urls(query_params, since, until, endpoint="cves/2.0", per_page=None):
+    query_str = f"{urllib.parse.urlencode(query_params)}&" if query_params else ""
+    per_page = per_page or max_results
+    if since is None:
+        return [f"{NVD_URL}/{endpoint}/?{query_str}resultsPerPage={per_page}"]
+
+    urls = []
+    window_start = datetime.datetime.fromisoformat(since)
+    while window_start < until:
+        window_end = min(window_start + datetime.timedelta(days=MAXWINDOW), until)
+        mod_start_str = urllib.parse.quote_plus(window_start.isoformat(timespec='milliseconds'))
+        mod_end_str = urllib.parse.quote_plus(window_end.isoformat(timespec='milliseconds'))
+        urls.append(f"{NVD_URL}/{endpoint}/?{query_str}lastModStartDate={mod_start_str}&lastModEndDate={mod_end_str}&resultsPerPage={per_page}")
+        window_start = window_end
+    return urls
+
+# Queue the fetch of a single page of results starting at the given index. With --stream the
+# pages of CVEs are streamed, `key` names the array of items in them. A raw page is not decoded.
+# Streamed CVEs are pruned to what the report uses unless prune is False.
+def submit_page(executor, url, start_index, context, cache=True, key=None, raw=False, prune=True):
+    if raw:
+        return executor.submit(fetch_page, f"{url}&startIndex={start_index}", context, MAXRETRIES, key, cache)
+    if stream_pages and key == 'vulnerabilities':
+        return executor.submit(stream_nvd, f"{url}&startIndex={start_index}", context, MAXRETRIES, key, cache, prune)
+    return executor.submit(query_nvd, f"{url}&startIndex={start_index}", context, MAXRETRIES, cache)
+
+# Stage the main thread's wait for a page is booked to, by the key of the items on it
+FETCHSTAGES = {'products': 'cpe_resolution', 'vulnerabilities': 'cve_fetch'}
+
+# Walk every page of a query and yield the items under `key` one at a time. The next page is
+# fetched while the caller works through the current one, so at most two pages are held at once.
+# Only the main thread should iterate this, the executor must only ever run query_nvd itself.
+# A failed page ends the results with a message, or raises NvdQueryError when strict is set.
+# The walk can start part way at start_index. on_page(start, size, total) is called once the
+# caller has gone through every item of a page, and once with no items when there are no more.
+# prune is passed on to submit_page for the pages after the first.
+def iter_nvd_results(executor, url, context, key, first_page=None, strict=False, cache=True, start_index=0, on_page=None, prune=True):
+    page_future = first_page or submit_page(executor, url, start_index, context, cache, key, prune=prune)
+    stage = FETCHSTAGES[key]
+
+    while page_future is not None:
+        try:
+            with stages.time(stage):
+                page = page_future.result()
+        except NvdQueryError as e:
+            if strict:
+                raise
+            print(e)
+            return
+
+        if page is None or not page.get(key):
+            if on_page is not None:
+                on_page(start_index, 0, start_index)
+            return
+
+        items = page[key]
+        total_results = page['totalResults']
+        page_start = start_index
+
+        # A streamed page only tells how many items it holds through resultsPerPage, and its
+        # items are read off the socket as they are handed out
+        if isinstance(items, list):
+            page_size = len(items)
+        else:
+            page_size = page['resultsPerPage']
+            items = stages.timed(items, stage)
+        del page
+
+        # Queue the next page before handing out this one
+        start_index += page_size
+        page_future = submit_page(executor, url, start_index, context, cache, key, prune=prune) if page_size and start_index < total_results else None
 
+        try:
+            yield from items
+        except NvdQueryError as e:
+            if page_future is not None:
+                page_future.cancel()
+            if strict:
+                raise
+            print(e)
+            return
+        del items
+
+        if on_page is not None:
+            on_page(page_start, page_size, total_results)
+
+# Walk every page of a query like iter_nvd_results, but yield the raw body of each page as
+# (start, size, total, body). A last item without a body tells there are no more pages.
+def iter_nvd_pages(executor, url, context, key, first_page=None, cache=True, start_index=0):
+    page_future = first_page or submit_page(executor, url, start_index, context, cache, key, raw=True)
+
+    while page_future is not None:
+        try:
+            with stages.time(FETCHSTAGES[key]):
+                page = page_future.result()
+        except NvdQueryError as e:
+            print(e)
+            return
+
+        if page is None or not page.get('resultsPerPage'):
+            yield start_index, 0, start_index, None
+            return
+
+        # Queue the next page before handing out this one
+        page_start = start_index
+        start_index += page['resultsPerPage']
+        page_future = submit_page(executor, url, start_index, context, cache, key, raw=True) if start_index < page['totalResults'] else None
+
+        yield page_start, page['resultsPerPage'], page['totalResults'], page['body']
+        del page
+
+# Expand every product into its CPE names, in the order of the product list
+def iter_cpe_names(executor, product_list):
+    if cpe_dictionary is not None:
+        for cpe_string in product_list:
+            with stages.time('cpe_resolution'):
+                names = cpe_dictionary.resolve(cpe_string)
+            yield from names
+        return
+
+    # Queue the first page of every product resolution straight away, unless the journal has it
+    product_pages = [(cpe_string, None if journal and journal.resolved(cpe_string) is not None else submit_page(executor, cpe_query_url(cpe_string), 0, cpe_string))
+                     for cpe_string in product_list]
+
+    for cpe_string, first_page in product_pages:
+        if first_page is None:
+            yield from journal.resolved(cpe_string)
+            continue
+
+        names = []
+        last_page = []
+        for cpe_product in iter_nvd_results(executor, cpe_query_url(cpe_string), cpe_string, 'products', first_page,
+                                            on_page=lambda start, size, total: last_page.append(start + size >= total)):
+            names.append(cpe_product['cpe']['cpeName'])
+            yield names[-1]
+
+        # Only a resolution that got through every page is kept
+        if journal and last_page and last_page[-1]:
+            journal.add_resolution(cpe_string, names)
+
+# Drop repeated items while keeping the order
+def unique(items):
+    seen = set()
+    for item in items:
+        if item not in seen:
+            seen.add(item)
+            yield item
+
+# As each item, a CPE name or a planned query, becomes available `start` queues its first request
+# and later `finish` consumes the results in order. A bounded number of items are kept in flight
+# so the rate limiter stays busy without holding every result in memory. Returns the items.
+def run_pipeline(items, start, finish):
+    item_list = []
+    pending = collections.deque()
+
+    for item in items:
+        item_list.append(item)
+        pending.append((item, start(item)))
+
+        while len(pending) > MAXWORKERS:
+            finish(*pending.popleft())
+
+    while pending:
+        finish(*pending.popleft())
+
+    return item_list
+
+# Fetch the CVEs of every CPE name in the search window from the API and match them, one CPE
+# name at a time. This is the flow used before query planning, kept behind --no-plan.
+def fetch_report(executor, product_list, report):
+    rows = nvd_records.RowBuilder()
+
+    def start(cpe):
+        start_index = journal.resume_at(cpe) if journal else 0
+        if start_index is None:
+            return None   # Finished by an earlier run
+        cve_url = cve_query_url({'cpeName': cpe})
+        print(cve_url)
+        return cve_url, start_index, submit_page(executor, cve_url, start_index, cpe, key='vulnerabilities')
+
+    # Stream every page of CVEs for a CPE name through the matching
+    def finish(cpe, query):
+        if query is None:
+            return
+        cve_url, start_index, first_page = query
+        log = journal.log(cpe) if journal else None
+        matcher = nvd_match.InventoryMatcher([cpe])
+        with stages.time('matching'):
+            for cve in iter_nvd_results(executor, cve_url, cpe, 'vulnerabilities', first_page, start_index=start_index, on_page=log.page_done if log else None):
+                cve_rows = rows.rows(cve, matcher.match_record(cve))
+                report.extend(cve_rows)
+                if log:
+                    log.add(cve['cve']['id'], cve_rows)
+
+    return run_pipeline(iter_cpe_names(executor, product_list), start, finish)
+
+# Resolve the wildcard entries of a plan into CPE names through the CPE API and add them to its groups
+def expand_plan(executor, plan):
+    if not plan.expand:
+        return
+    with tracer.span("expand plan", entries=len(plan.expand)):
+        added = sum(plan.add(cpe) for cpe in iter_cpe_names(executor, plan.expand))
+    print(f"Expanded {len(plan.expand)} wildcard entries into {added} more CPE names, {len(plan.groups)} queries planned")
+
+# Fetch the CPE names modified since the last update of the local CPE dictionary. The first update
+# fetches the whole dictionary, importing the CPE feed with --import-feeds is quicker.
+def update_cpe_dictionary(executor, dictionary):
+    synced_at = datetime.datetime.now(datetime.timezone.utc)
+    cpe_urls = sync_query_urls({}, dictionary.watermark(), synced_at, "cpes/2.0", max_cpe_results)
+    if dictionary.watermark() is None:
+        print(f"The CPE dictionary {dictionary.path} is empty, fetching all of it from the CPE API")
+
+    batch = []
+    count = 0
+    try:
+        with tracer.span("update cpe dictionary"):
+            for cpe_url in cpe_urls:
+                for cpe_product in iter_nvd_results(executor, cpe_url, "CPE dictionary", 'products', strict=True, cache=False):
+                    batch.append(cpe_product)
+                    if len(batch) >= max_cpe_results:
+                        count += dictionary.upsert(batch)
+                        batch = []
+            count += dictionary.upsert(batch)
+    except NvdQueryError as e:
+        dictionary.commit()
+        print(f"{e} Resolving from the CPE dictionary as it is.")
+        return
+
+    dictionary.set_watermark(synced_at.isoformat(timespec='milliseconds'))
+    print(f"Updated {count} CPE names, the CPE dictionary {dictionary.path} holds {dictionary.count()}")
+
+# Queue the first page of a planned query for the search window, from where the journal left it.
+# Returns None when an earlier run finished the query.
+def start_query(executor, query, raw=False):
+    start_index = journal.resume_at(query.scope) if journal else 0
+    if start_index is None:
+        return None
+    cve_url = cve_query_url(query.params)
     print(cve_url)
-
-    cve_results = query_nvd(cve_url, cpe, MAXRETRIES)
-
-    # If we got results, we will now extract the CPE matches
-    if cve_results is not None and 'vulnerabilities' in cve_results:
-
-        # Saving json results to a file for debugging purposes
-#        with open(f"Python/test_data/cve_results_{cpe.replace(':', '_').replace('*', '')}.json", 'w') as f:
-#            json.dump(cve_results, f, indent=4)   
-
-        for cve in cve_results['vulnerabilities']:
-
-            #find our cpe match
-            for cpeMatch in cve['cve']['configurations'][0]['nodes'][0]['cpeMatch']:
-
-                if cpeMatch['criteria'].split('*',1)[0] in cpe:
-
-                    from packaging.version import Version
-                    cpe_version = cpe.split(':')[5]  # Extract the version from the CPE string for comparison
-                    
-                    # To avoid possible duplicates where multiple versions are included in the CPE
-                    if ('versionStartIncluding' in cpeMatch and 'versionEndExcluding' in cpeMatch) and \
-                        (Version(cpe_version) < Version(cpeMatch['versionStartIncluding']) or Version(cpe_version) >= Version(cpeMatch['versionEndExcluding'])):
-
-                        # Skip this CPE match as it does not match the version criteria
-                        continue    
-                    
-                    # To avoid further duplicates where multiple cpe matches are included in the CVE
-                    elif ('versionStartIncluding' not in cpeMatch or 'versionEndExcluding' not in cpeMatch) and \
-                        (cpe.split('*',1)[0] not in cpeMatch['criteria']):
-
-                         # Skip this CPE match as it does not match the cpe criteria completely
-                        continue 
-                    else:
-
-                        id= cve['cve']['id'] if 'id' in cve['cve'] else 'N/A'
-                        cpeSearch = cpe
-                        sourceIdentifier = cve['cve']['sourceIdentifier'] if 'sourceIdentifier' in cve['cve'] else 'N/A'
-                        published = cve['cve']['published'] if 'published' in cve['cve'] else 'N/A'
-                        lastModified = cve['cve']['lastModified'] if 'lastModified' in cve['cve'] else 'N/A'
-                        vulnStatus = cve['cve']['vulnStatus'] if 'vulnStatus' in cve['cve'] else 'N/A'
-                        descriptions = cve['cve']['descriptions'] if 'descriptions' in cve['cve'] else [{'value': 'N/A'}]
-
-                        if 'cvssMetricV31' in cve['cve']['metrics']:
-                            version = "3.1"
-                            source= cve['cve']['metrics']['cvssMetricV31'][0]['source'] if 'cvssMetricV31' in cve['cve']['metrics'] else 'N/A'
-                            baseScore = cve['cve']['metrics']['cvssMetricV31'][0]['cvssData']['baseScore'] if 'cvssMetricV31' in cve['cve']['metrics'] else 'N/A'
-                            baseSeverity = cve['cve']['metrics']['cvssMetricV31'][0]['cvssData']['baseSeverity'] if 'cvssMetricV31' in cve['cve']['metrics'] else 'N/A'
-                            attackVector = cve['cve']['metrics']['cvssMetricV31'][0]['cvssData']['attackVector'] if 'cvssMetricV31' in cve['cve']['metrics'] else 'N/A'
-                            privilegesRequired = cve['cve']['metrics']['cvssMetricV31'][0]['cvssData']['privilegesRequired'] if 'cvssMetricV31' in cve['cve']['metrics'] else 'N/A'
-                            userInteraction = cve['cve']['metrics']['cvssMetricV31'][0]['cvssData']['userInteraction'] if 'cvssMetricV31' in cve['cve']['metrics'] else 'N/A'
-                            confidentialityImpact = cve['cve']['metrics']['cvssMetricV31'][0]['cvssData']['confidentialityImpact'] if 'cvssMetricV31' in cve['cve']['metrics'] else 'N/A'
-                            integrityImpact = cve['cve']['metrics']['cvssMetricV31'][0]['cvssData']['integrityImpact'] if 'cvssMetricV31' in cve['cve']['metrics'] else 'N/A'
-                            availabilityImpact = cve['cve']['metrics']['cvssMetricV31'][0]['cvssData']['availabilityImpact'] if 'cvssMetricV31' in cve['cve']['metrics'] else 'N/A'
-                            exploitabilityScore = cve['cve']['metrics']['cvssMetricV31'][0]['exploitabilityScore'] if 'cvssMetricV31' in cve['cve']['metrics'] else 'N/A'
-                            impactScore = cve['cve']['metrics']['cvssMetricV31'][0]['impactScore'] if 'cvssMetricV31' in cve['cve']['metrics'] else 'N/A'
-
-                        elif 'cvssMetricV30' in cve['cve']['metrics']:
-                            version = "3.0"
-                            source = cve['cve']['metrics']['cvssMetricV30'][0]['source'] if 'cvssMetricV30' in cve['cve']['metrics'] else 'N/A'
-                            baseScore = cve['cve']['metrics']['cvssMetricV30'][0]['cvssData']['baseScore'] if 'cvssMetricV30' in cve['cve']['metrics'] else 'N/A'
-                            baseSeverity = cve['cve']['metrics']['cvssMetricV30'][0]['cvssData']['baseSeverity'] if 'cvssMetricV30' in cve['cve']['metrics'] else 'N/A'
-                            attackVector = cve['cve']['metrics']['cvssMetricV30'][0]['cvssData']['attackVector'] if 'cvssMetricV30' in cve['cve']['metrics'] else 'N/A'
-                            privilegesRequired = cve['cve']['metrics']['cvssMetricV30'][0]['cvssData']['privilegesRequired'] if 'cvssMetricV30' in cve['cve']['metrics'] else 'N/A'
-                            userInteraction = cve['cve']['metrics']['cvssMetricV30'][0]['cvssData']['userInteraction'] if 'cvssMetricV30' in cve['cve']['metrics'] else 'N/A'
-                            confidentialityImpact = cve['cve']['metrics']['cvssMetricV30'][0]['cvssData']['confidentialityImpact'] if 'cvssMetricV30' in cve['cve']['metrics'] else 'N/A'
-                            integrityImpact = cve['cve']['metrics']['cvssMetricV30'][0]['cvssData']['integrityImpact'] if 'cvssMetricV30' in cve['cve']['metrics'] else 'N/A'
-                            availabilityImpact = cve['cve']['metrics']['cvssMetricV30'][0]['cvssData']['availabilityImpact'] if 'cvssMetricV30' in cve['cve']['metrics'] else 'N/A'
-                            exploitabilityScore = cve['cve']['metrics']['cvssMetricV30'][0]['exploitabilityScore'] if 'cvssMetricV30' in cve['cve']['metrics'] else 'N/A'
-                            impactScore = cve['cve']['metrics']['cvssMetricV30'][0]['impactScore'] if 'cvssMetricV30' in cve['cve']['metrics'] else 'N/A'
-
-                        else:
-                            version = "2.0"
-                            source= cve['cve']['metrics']['cvssMetricV2'][0]['source'] if 'cvssMetricV2' in cve['cve']['metrics'] else 'N/A'
-                            baseScore = cve['cve']['metrics']['cvssMetricV2'][0]['cvssData']['baseScore'] if 'cvssMetricV2' in cve['cve']['metrics'] else 'N/A'
-                            baseSeverity = cve['cve']['metrics']['cvssMetricV2'][0]['baseSeverity'] if 'cvssMetricV2' in cve['cve']['metrics'] else 'N/A'
-                            attackVector = cve['cve']['metrics']['cvssMetricV2'][0]['cvssData']['accessVector'] if 'cvssMetricV2' in cve['cve']['metrics'] else 'N/A'
-                            privilegesRequired = cve['cve']['metrics']['cvssMetricV2'][0]['cvssData']['authentication'] if 'cvssMetricV2' in cve['cve']['metrics'] else 'N/A'
-                            userInteraction = cve['cve']['metrics']['cvssMetricV2'][0]['userInteractionRequired'] if 'cvssMetricV2' in cve['cve']['metrics'] else 'N/A'
-                            confidentialityImpact = cve['cve']['metrics']['cvssMetricV2'][0]['cvssData']['confidentialityImpact'] if 'cvssMetricV2' in cve['cve']['metrics'] else 'N/A'
-                            integrityImpact = cve['cve']['metrics']['cvssMetricV2'][0]['cvssData']['integrityImpact'] if 'cvssMetricV2' in cve['cve']['metrics'] else 'N/A'
-                            availabilityImpact = cve['cve']['metrics']['cvssMetricV2'][0]['cvssData']['availabilityImpact'] if 'cvssMetricV2' in cve['cve']['metrics'] else 'N/A'
-                            exploitabilityScore = cve['cve']['metrics']['cvssMetricV2'][0]['exploitabilityScore'] if 'cvssMetricV2' in cve['cve']['metrics'] else 'N/A'
-                            impactScore = cve['cve']['metrics']['cvssMetricV2'][0]['impactScore'] if 'cvssMetricV2' in cve['cve']['metrics'] else 'N/A'                            
-
-                        weaknesses = cve['cve']['weaknesses'] if 'weaknesses' in cve['cve'] else [{'description': [{'value': 'N/A'}]}]
-                        vulnerable = cpeMatch['vulnerable'] if 'vulnerable' in cpeMatch else 'N/A'
-                        criteria = cpeMatch['criteria'] if 'criteria' in cpeMatch else 'N/A'    
-                        versionStartIncluding = cpeMatch['versionStartIncluding'] if 'versionStartIncluding' in cpeMatch else 'N/A'
-                        versionEndExcluding = cpeMatch['versionEndExcluding'] if 'versionEndExcluding' in cpeMatch else 'N/A'
-                                                                        
-                        # Append this CVE information to the table data
-                        table_data.append([id,
-                                        cpeSearch,
-                                        sourceIdentifier,
-                                        published,
-                                        lastModified,
-                                        vulnStatus,
-                                        descriptions[0]['value'],
-                                        version,
-                                        source,
-                                        baseScore,
-                                        baseSeverity,
-                                        attackVector,
-                                        privilegesRequired,
-                                        userInteraction,
-                                        confidentialityImpact,
-                                        integrityImpact,
-                                        availabilityImpact,
-                                        exploitabilityScore,
-                                        impactScore,
-                                        weaknesses[0]['description'][0]['value'],
-                                        vulnerable,
-                                        criteria,
-                                        versionStartIncluding,
-                                        versionEndExcluding
-                                        ])
-
-                                           
-
-# Having completed loops the table_data should contain all found CVEs
-
-# Calculate the range for the table in the Excel file based on the number of entries and columns required
-#print(f"Length: {len(table_data)}, width: {chr(len(table_data[0]) + 96) if table_data else 0}")
-
-if len(table_data) == 0:
-    exit("No CVEs found for the provided CPEs.")
-       
-table_range = "A1:" + chr(len(table_data[0]) + 96).upper() + str(1+len(table_data))
-
-# If the file already exists, delete it to avoid appending to an old file
-if os.path.isfile(FILENAME):
-    os.remove(FILENAME)
-    print(f"Deleted existing file ready for new data: {FILENAME}")
-    
-# Create a new Excel file and add a worksheet
-workbook = xlsxwriter.Workbook(FILENAME)
-worksheet = workbook.add_worksheet()
-
-# Write table data and headers to the worksheet in a table format
-print(f"Writing {len(table_data)} entries to {FILENAME}...")
-worksheet.add_table(table_range, {'data': table_data, 'columns': [{'header': 'id'},
-                                                            {'header': 'configurations.cpeSearch'},
-                                                            {'header': 'sourceIdentifier'},
-                                                            {'header': 'published'},
-                                                            {'header': 'lastModified'},
-                                                            {'header': 'vulnStatus'},
-                                                            {'header': 'description'},
-                                                            {'header': 'configurations.version'},
-                                                            {'header': 'cvss.source'},
-                                                            {'header': 'cvss.baseScore'},
-                                                            {'header': 'cvss.baseSeverity'},
-                                                            {'header': 'cvss.attackVector'},
-                                                            {'header': 'cvss.privilegesRequired'},
-                                                            {'header': 'cvss.userInteraction'},
-                                                            {'header': 'cvss.confidentialityImpact'},
-                                                            {'header': 'cvss.integrityImpact'},
-                                                            {'header': 'cvss.availabilityImpact'},
-                                                            {'header': 'cvss.exploitabilityScore'},
-                                                            {'header': 'cvss.impactScore'},
-                                                            {'header': 'weakness.description'},
-                                                            {'header': 'configurations.vulnerable'},
-                                                            {'header': 'configurations.criteria'},
-                                                            {'header': 'configurations.versionStartIncluding'},
-                                                            {'header': 'configurations.versionEndExcluding'}
-                                                            ]})
-
-# Close and save the workbook
-workbook.close()
-
-
-
-
-
-
+    return cve_url, start_index, submit_page(executor, cve_url, start_index, query.label, key='vulnerabilities', raw=raw)
+
+# Run the planned queries for the search window. Each CVE is matched against the whole inventory
+# the first time any query returns it, so CVEs shared by several groups are only reported once.
+def plan_report(executor, plan, report):
+    matcher = nvd_match.InventoryMatcher(plan.inventory())
+    seen = set(journal.seen) if journal else set()
+    rows = nvd_records.RowBuilder()
+
+    def finish(query, pending):
+        if pending is None:
+            return
+        cve_url, start_index, first_page = pending
+        log = journal.log(query.scope) if journal else None
+        with stages.time('matching'):
+            for cve in iter_nvd_results(executor, cve_url, query.label, 'vulnerabilities', first_page, start_index=start_index, on_page=log.page_done if log else None):
+                cve_id = cve['cve']['id']
+                if cve_id in seen:
+                    continue
+                seen.add(cve_id)
+                cve_rows = rows.rows(cve, matcher.match_record(cve))
+                report.extend(cve_rows)
+                if log:
+                    log.add(cve_id, cve_rows)
+
+    run_pipeline(plan.queries(), lambda query: start_query(executor, query), finish)
+    return plan.inventory()
+
+# Like plan_report, but the pages are decoded and matched by a pool of worker processes while the
+# threads keep fetching. Up to `lookahead` pages are worked on at once, their rows are written
+# in the order the pages were fetched so the report is the same as without the pool.
+def parallel_plan_report(executor, pool, lookahead, plan, report):
+    seen = set(journal.seen) if journal else set()
+    pending = collections.deque()
+
+    # Waiting for the workers is booked as matching
+    def collect(limit):
+        while len(pending) > limit:
+            context, log, page, result = pending.popleft()
+            with stages.time('matching'):
+                try:
+                    cve_rows = result.result()
+                except ValueError as e:
+                    print(f"Invalid response from NVD API for {context}: {e}")
+                    continue
+                for cve_id, rows in cve_rows:
+                    if cve_id not in seen:
+                        seen.add(cve_id)
+                        report.extend(rows)
+                        if log:
+                            log.add(cve_id, rows)
+            if log:
+                log.page_done(*page)
+
+    def finish(query, pending_query):
+        if pending_query is None:
+            return
+        cve_url, start_index, first_page = pending_query
+        log = journal.log(query.scope) if journal else None
+        for page_start, page_size, total, body in iter_nvd_pages(executor, cve_url, query.label, 'vulnerabilities', first_page, start_index=start_index):
+            if body is None:
+                if log:
+                    log.page_done(page_start, page_size, total)
+                continue
+            pending.append((query.label, log, (page_start, page_size, total), pool.submit(nvd_workers.process_page, body)))
+            collect(lookahead)
+
+    run_pipeline(plan.queries(), lambda query: start_query(executor, query, raw=True), finish)
+    collect(0)
+    return plan.inventory()
+
+# Bring the local store up to date for every planned query, then match the CVEs of the search window from the store
+def sync_report(executor, store, plan, report):
+    sync_store(executor, store, plan)
+
+    # Match from the store, the whole inventory at once
+    cpe_list = plan.inventory()
+    match_store(store, cpe_list, report)
+
+    print(f"Local store {store.path} holds {store.count()} CVEs")
+    return cpe_list
+
+# Fetch what was modified since the last sync of every planned query into the local store. A query
+# never synced before starts from when the imported feeds were published, if they were.
+def sync_store(executor, store, plan):
+    synced_at = datetime.datetime.now(datetime.timezone.utc)
+    baseline = store.watermark(nvd_feeds.BASELINE)
+
+    def start(query):
+        since = max(filter(None, (store.watermark(query.scope), baseline)), default=None)
+        cve_urls = sync_query_urls(query.params, since, synced_at)
+        return cve_urls, submit_page(executor, cve_urls[0], 0, query.label, cache=False, key='vulnerabilities', prune=False)
+
+    # Upsert everything fetched for a query and only then move its high-water mark forward. The
+    # response cache is bypassed, a cached answer for an older window would leave a gap in the store.
+    # Streamed pages are not pruned, a pruned record would replace the full one of the same age
+    def finish(query, pending):
+        cve_urls, first_page = pending
+        batch = []
+        count = 0
+        try:
+            for index, cve_url in enumerate(cve_urls):
+                for cve in iter_nvd_results(executor, cve_url, query.label, 'vulnerabilities', first_page if index == 0 else None, strict=True, cache=False, prune=False):
+                    batch.append(cve)
+                    if len(batch) >= SYNCBATCH:
+                        with stages.time('store_update'):
+                            count += store.upsert(batch)
+                        batch = []
+            with stages.time('store_update'):
+                count += store.upsert(batch)
+        except NvdQueryError as e:
+            store.commit()
+            print(f"{e} Keeping the previous high-water mark for {query.label}.")
+            return
+
+        store.set_watermark(query.scope, synced_at.isoformat(timespec='milliseconds'))
+        print(f"Synced {count} modified CVEs for {query.label} in {len(cve_urls)} queries")
+
+    # The high-water mark belongs to the exact query, a group whose version bounds change starts over
+    run_pipeline(plan.queries(), start, finish)
+
+# Match CPE names against the CVEs held in the local store in a single pass, limited to the
+# search window just like the API queries. Only CVEs with criteria for the products of the
+# inventory are loaded into the index.
+def match_store(store, inventory, report):
+    modified_since = mod_start.strftime("%Y-%m-%dT%H:%M:%S") if search_days > 0 else None
+    keys = {nvd_match.product_key(nvd_match.parse_cpe(cpe)) for cpe in inventory}
+
+    started = time.perf_counter()
+    with stages.time('matching'):
+        index = nvd_match.CpeMatchIndex(keys)
+        for cve in store.iter_cves(modified_since=modified_since, products=keys):
+            index.add(cve)
+        indexed = time.perf_counter()
+
+        # The matches are collected before they are written, so the time printed is that of the matching
+        matches = list(index.match(inventory))
+        matched = time.perf_counter()
+
+    rows = nvd_records.RowBuilder()
+    report.extend(rows.row(cpe, cve, cpeMatch) for cpe, cve, cpeMatch in matches)
+    print(f"Indexed {len(index)} CVEs in {indexed - started:.2f} seconds, matched {len(inventory)} CPEs in {matched - indexed:.3f} seconds")
+
+# Answer lookups from the local store until interrupted. Unless --offline, the store is synced for
+# the planned queries of the product list in the background and the service reloads it after
+# every sync.
+def serve_lookups(args, plan):
+    # Runs in the refresh thread, which is the only one to resolve CPE names while serving
+    def refresh():
+        global cpe_dictionary
+        store = nvd_store.CveStore(args.store)
+        if args.cpe_dictionary:
+            cpe_dictionary = nvd_cpe_dict.CpeDictionary(args.cpe_dictionary)
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=MAXWORKERS) as executor:
+                if cpe_dictionary is not None:
+                    update_cpe_dictionary(executor, cpe_dictionary)
+                expand_plan(executor, plan)
+                sync_store(executor, store, plan)
+        finally:
+            store.close()
+            if cpe_dictionary is not None:
+                cpe_dictionary.close()
+                cpe_dictionary = None
+
+    service = nvd_service.VulnerabilityService(args.store, None if args.offline else refresh, args.refresh)
+    nvd_service.serve(service, SERVICEHOST, args.serve)
+
+# Record how the run went and hand its metrics and spans to where --metrics-file, --metrics-port
+# and --otlp send them
+def export_telemetry(args, mode, outcome, started, report, metrics_server):
+    stages.record()
+    nvd_metrics.REPORT_ROWS.set(report.count)
+    nvd_metrics.RUN_SECONDS.set(time.time() - started)
+    nvd_metrics.RUN_TIMESTAMP.set(time.time(), mode=mode, outcome=outcome)
+    if response_cache is not None:
+        nvd_metrics.record_cache(response_cache)
+    tracer.end(tracer.root, error=outcome != "success", outcome=outcome, rows=report.count,
+               **{f"stage.{stage}": seconds for stage, seconds in stages.seconds.items()})
+
+    if stages.seconds:
+        print("Time by stage: " + ", ".join(f"{stage} {seconds:.2f} s" for stage, seconds in stages.seconds.items()))
+    if args.metrics_file:
+        nvd_metrics.REGISTRY.write_textfile(args.metrics_file)
+        print(f"Wrote metrics to {args.metrics_file}")
+    if args.otlp and nvd_metrics.push_otlp(args.otlp, nvd_metrics.REGISTRY, tracer):
+        print(f"Pushed metrics and {len(tracer.spans)} spans to {args.otlp}")
+    if metrics_server is not None:
+        metrics_server.shutdown()
+
+# Import the CVE feeds into the local store and the CPE feed into the CPE dictionary
+def import_feeds(args):
+    cpe_feeds = nvd_cpe_dict.feed_files(args.import_feeds)
+    cve_feeds = [path for path in nvd_feeds.feed_files(args.import_feeds) if path not in cpe_feeds]
+    if not cpe_feeds and not cve_feeds:
+        exit(f"No feed files found in {', '.join(args.import_feeds)}")
+
+    started = time.perf_counter()
+    try:
+        if cve_feeds:
+            store = nvd_store.CveStore(args.store)
+            try:
+                count = nvd_feeds.import_feeds(store, cve_feeds)
+                print(f"Imported {count} CVEs in {time.perf_counter() - started:.1f} seconds, local store {store.path} holds {store.count()} CVEs")
+            finally:
+                store.close()
+        if cpe_feeds:
+            dictionary = nvd_cpe_dict.CpeDictionary(args.cpe_dictionary or CPEDICTFILE)
+            try:
+                count = nvd_cpe_dict.import_feeds(dictionary, cpe_feeds)
+                print(f"Imported {count} CPE names, the CPE dictionary {dictionary.path} holds {dictionary.count()}")
+            finally:
+                dictionary.close()
+    except ValueError as e:
+        exit(str(e))
+
+# Resolve the product list, fetch the CVEs for every CPE name and write the report
+def main():
+    parser = argparse.ArgumentParser(description="Look up the CVEs affecting the products in a product list and write them to an Excel table or other report files")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--sync", action="store_true", help="Keep a local CVE store up to date with only the CVEs modified since the last sync, and report from it")
+    mode.add_argument("--offline", action="store_true", help="Match the product list against the local CVE store without querying the API")
+    parser.add_argument("--store", default=STOREFILE, help=f"Local CVE store used by --sync, --offline, --serve and --import-feeds (default: {STOREFILE})")
+    parser.add_argument("--products", default=PRODUCTLIST, help=f"Product list to look up (default: {PRODUCTLIST})")
+    parser.add_argument("--output", action="append", help=f"Report file to write, .xlsx, .csv or .jsonl, repeat to write several (default: {FILENAME})")
+    parser.add_argument("--summary-top", type=int, default=nvd_rollup.TOP, help=f"CVEs the summary worksheets of an Excel report list for every CPE name and vendor, 0 to leave the summary worksheets out (default: {nvd_rollup.TOP})")
+    parser.add_argument("--processes", type=int, nargs="?", const=os.cpu_count(), help="Decode and match pages of CVEs in this many worker processes, every core when no number is given. Pages are then fetched whole, --stream does not apply")
+    parser.add_argument("--stream", action="store_true", help="Parse pages of CVEs as they arrive and keep only the fields the report uses, to cap memory on large scans")
+    parser.add_argument("--plan", action="store_true", help="Print the query plan for the product list and exit without querying the API")
+    parser.add_argument("--no-plan", action="store_true", help="Query the API once per CPE name found for each product list entry instead of following a query plan")
+    parser.add_argument("--metrics-file", help="Write the metrics of the run in the Prometheus text format to this file when it ends, e.g. for the node_exporter textfile collector")
+    parser.add_argument("--metrics-port", type=int, help="Serve the metrics in the Prometheus text format on this port at /metrics while the run lasts")
+    parser.add_argument("--metrics-host", default=nvd_metrics.HOST, help=f"Address to serve the metrics of --metrics-port on, e.g. 0.0.0.0 for scrapers on other hosts (default: {nvd_metrics.HOST})")
+    parser.add_argument("--otlp", default=os.environ.get("OTEL_EXPORTER_OTLP_ENDPOINT"), help="Push the metrics and traces of the run to this OpenTelemetry collector over OTLP/HTTP when it ends, e.g. http://localhost:4318 (default: $OTEL_EXPORTER_OTLP_ENDPOINT)")
+    parser.add_argument("--journal", nargs="?", const=JOURNALFILE, help=f"Keep a checkpoint journal so that the run continues where it stopped when it is started again after an interruption (default: {JOURNALFILE})")
+    parser.add_argument("--import-feeds", nargs="+", metavar="FEED", help="Import NVD JSON 2.0 feed files, or directories of them, into the local store and exit. Download every yearly feed so that --sync only fetches what changed since. The CPE feed goes into the CPE dictionary")
+    parser.add_argument("--cpe-dictionary", nargs="?", const=CPEDICTFILE, help=f"Resolve the product list from a local copy of the CPE dictionary, brought up to date through the CPE API first, instead of asking the CPE API for every entry (default: {CPEDICTFILE})")
+    parser.add_argument("--serve", type=int, nargs="?", const=SERVICEPORT, help=f"Keep answering CVE lookups for CPE names over HTTP on this port from the local store, synced for the product list in the background unless --offline (default: {SERVICEPORT})")
+    parser.add_argument("--refresh", type=float, default=SERVICEREFRESH, help=f"Seconds between syncs of the store behind --serve (default: {SERVICEREFRESH})")
+    args = parser.parse_args()
+    if args.journal and (args.sync or args.offline):
+        parser.error("--journal does not apply to --sync or --offline, the local store keeps their progress")
+    if args.serve is not None and (args.sync or args.journal or args.no_plan or args.processes):
+        parser.error("--serve keeps its store synced by itself, it does not combine with --sync, --journal, --no-plan or --processes")
+
+    if args.import_feeds:
+        import_feeds(args)
+        return
+
+    global response_cache, stream_pages, journal, cpe_dictionary, mod_start, mod_end
+    stream_pages = args.stream
+    if CACHEDIR:
+        response_cache = nvd_cache.ResponseCache(CACHEDIR, CACHETTL, CACHESIZE)
+
+    # Declare and initialize the product list
+    product_list = read_product_list(args.products)
+
+    # Collapse the product list into as few API queries as possible
+    plan = nvd_planner.QueryPlan(product_list, VERSIONBOUNDS)
+    if args.plan or not (args.offline or args.no_plan):
+        print(plan.describe())
+    if args.plan:
+        return
+
+    if args.serve is not None:
+        serve_lookups(args, plan)
+        return
+
+    # Entries are resolved locally, there is nothing to resolve in the offline mode
+    if args.cpe_dictionary and not args.offline:
+        cpe_dictionary = nvd_cpe_dict.CpeDictionary(args.cpe_dictionary)
+
+    # Continue an interrupted run of the same scan, in the search window it started with
+    if args.journal:
+        scan = {'products': product_list, 'flow': 'no-plan' if args.no_plan else 'plan', 'bounds': VERSIONBOUNDS,
+                'days': search_days, 'pages': [max_results, max_cpe_results], 'url': NVD_URL}
+        journal = nvd_journal.Journal(args.journal, scan, (mod_start, mod_end))
+        if journal.resumed:
+            mod_start, mod_end = (datetime.datetime.fromisoformat(moment) for moment in journal.window())
+            print(f"Resuming the scan in {args.journal}: {len(journal.resolutions)} product list entries resolved, "
+                  f"{len(journal.pages)} queries started and {journal.rows} rows reported before")
+
+    try:
+        report = nvd_sinks.Report(args.output or [FILENAME], stages, args.summary_top)
+    except ValueError as e:
+        parser.error(str(e))
+
+    mode = "offline" if args.offline else "sync" if args.sync else "no-plan" if args.no_plan else "processes" if args.processes else "plan"
+    metrics_server = nvd_metrics.serve(nvd_metrics.REGISTRY, args.metrics_port, args.metrics_host) if args.metrics_port else None
+    tracer.enabled = bool(args.otlp)
+    tracer.root = tracer.start("nvd scan", mode=mode, products=len(product_list))
+    started = time.time()
+    outcome = "failed"
+
+    # Rows are written out as they are matched. The outputs are closed even when the run fails
+    # part way, so whatever was found until then is kept, and so are the metrics.
+    try:
+        if journal and journal.rows:
+            report.extend(journal.replay())
+
+        if cpe_dictionary is not None:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=MAXWORKERS) as executor:
+                update_cpe_dictionary(executor, cpe_dictionary)
+
+        if args.offline:
+            # The product list entries are matched as they are, partial CPE strings act as prefixes
+            store = nvd_store.CveStore(args.store)
+            try:
+                cpe_list = list(unique(product_list))
+                match_store(store, cpe_list, report)
+            finally:
+                store.close()
+
+        elif args.sync:
+            store = nvd_store.CveStore(args.store)
+            try:
+                with concurrent.futures.ThreadPoolExecutor(max_workers=MAXWORKERS) as executor:
+                    expand_plan(executor, plan)
+                    cpe_list = sync_report(executor, store, plan, report)
+            finally:
+                store.close()
+
+        elif args.no_plan:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=MAXWORKERS) as executor:
+                cpe_list = fetch_report(executor, product_list, report)
+
+        elif args.processes:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=MAXWORKERS) as executor:
+                expand_plan(executor, plan)
+                with concurrent.futures.ProcessPoolExecutor(args.processes, initializer=nvd_workers.init, initargs=(plan.inventory(),)) as pool:
+                    cpe_list = parallel_plan_report(executor, pool, 2 * args.processes, plan, report)
+
+        else:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=MAXWORKERS) as executor:
+                expand_plan(executor, plan)
+                cpe_list = plan_report(executor, plan, report)
+        outcome = "success"
+    finally:
+        report.close()
+        if cpe_dictionary is not None:
+            cpe_dictionary.close()
+        export_telemetry(args, mode, outcome, started, report, metrics_server)
+
+    # The journal is only needed again when some query could not be finished
+    if journal:
+        if journal.complete():
+            journal.remove()
+        else:
+            journal.close()
+            print(f"Some queries did not finish, run again with --journal {args.journal} to fetch only what is missing")
+
+    if not args.offline:
+        print(f"Made {rate_limiter.granted} API requests")
+
+    if response_cache is not None:
+        print(response_cache.summary())
+        response_cache.close()
+
+    # If we had no CPEs there was nothing to look for
+    if len(cpe_list) == 0:
+        exit("No CPEs found. Please check your product list or CPE list file.")
+
+    if report.count == 0:
+        exit("No CVEs found for the provided CPEs.")
+
+if __name__ == "__main__":
+    main()
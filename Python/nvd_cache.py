@@ -0,0 +1,261 @@
+"""
+On-disk cache for NVD API responses, used by nist_vuln_checker.py.
+
+Response bodies are stored gzip compressed in a content-addressed directory, named after the
+hash of the normalized request URL. A small SQLite index keeps the size, age and last access
+of every entry so that expired entries are ignored and the least recently used entries are
+evicted once the cache grows past its size limit. Streamed responses are written through a
+CacheWriter as they are read and read back through open(), without holding the body in memory.
+"""
+
+import gzip
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import urllib.parse
+
+# Timestamps in these query parameters are truncated to the day when building the cache key, so
+# repeated runs with a rolling search window share entries. The TTL bounds how stale they can be
+DATEPARAMS = ("lastModStartDate", "lastModEndDate", "pubStartDate", "pubEndDate")
+
+# Query parameters that never change the answer and must not end up in the key
+IGNOREDPARAMS = ("apiKey",)
+
+
+# Normalize a URL so that equivalent requests map to the same cache entry
+def normalize_url(url):
+    parts = urllib.parse.urlsplit(url)
+    query = []
+    for key, value in urllib.parse.parse_qsl(parts.query, keep_blank_values=True):
+        if key in IGNOREDPARAMS:
+            continue
+        if key in DATEPARAMS:
+            value = value[:10]
+        query.append((key, value))
+    query.sort()
+    return urllib.parse.urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path.rstrip("/"), urllib.parse.urlencode(query), ""))
+
+
+# Format a byte count for the summary line
+def format_bytes(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+class ResponseCache:
+    # ttls maps an endpoint path fragment such as '/cves/2.0' to its time to live in seconds,
+    # responses from endpoints without a TTL are never cached
+    def __init__(self, directory, ttls, max_bytes):
+        self.directory = directory
+        self.ttls = ttls
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+
+        # Counters reported at the end of a run
+        self.hits = 0
+        self.misses = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(directory, "index.sqlite"), check_same_thread=False)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS entries (
+                               key TEXT PRIMARY KEY,
+                               url TEXT NOT NULL,
+                               size INTEGER NOT NULL,
+                               stored REAL NOT NULL,
+                               accessed REAL NOT NULL)""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+        self.db.commit()
+        self.total_bytes = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    # Look up the time to live for the endpoint a URL belongs to
+    def ttl(self, url):
+        path = urllib.parse.urlsplit(url).path
+        for endpoint, ttl in self.ttls.items():
+            if endpoint in path:
+                return ttl
+        return 0
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".json.gz")
+
+    def key(self, url):
+        normalized = normalize_url(url)
+        return hashlib.sha256(normalized.encode()).hexdigest(), normalized
+
+    # Return the cached response body for a URL, or None if it is missing or expired
+    def get(self, url):
+        ttl = self.ttl(url)
+        if ttl <= 0:
+            return None
+
+        key, normalized = self.key(url)
+        now = time.time()
+
+        with self.lock:
+            row = self.db.execute("SELECT stored, size FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None or row[0] + ttl < now:
+                if row is not None:
+                    self.remove(key, row[1])
+                    self.db.commit()
+                self.misses += 1
+                return None
+
+        # Decompress outside the lock so that concurrent lookups do not queue behind each other
+        try:
+            with gzip.open(self.path(key), "rb") as f:
+                body = f.read()
+        except OSError:
+            body = None
+
+        with self.lock:
+            if body is None:
+                # The file was evicted meanwhile or is damaged, forget about it
+                row = self.db.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    self.remove(key, row[0])
+                    self.db.commit()
+                self.misses += 1
+                return None
+
+            self.db.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+            self.db.commit()
+            self.hits += 1
+            self.bytes_read += len(body)
+            return body
+
+    # Like get, but return the cached body as an open file to be read in chunks
+    def open(self, url):
+        ttl = self.ttl(url)
+        if ttl <= 0:
+            return None
+
+        key, normalized = self.key(url)
+        now = time.time()
+
+        with self.lock:
+            row = self.db.execute("SELECT stored, size FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is not None and row[0] + ttl >= now:
+                try:
+                    f = gzip.open(self.path(key), "rb")
+                except OSError:
+                    f = None
+                if f is not None:
+                    self.db.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+                    self.db.commit()
+                    self.hits += 1
+                    return f
+
+            if row is not None:
+                self.remove(key, row[1])
+                self.db.commit()
+            self.misses += 1
+            return None
+
+    # Start writing a streamed response body for a URL, or return None if the endpoint is not cached
+    def writer(self, url):
+        if self.ttl(url) <= 0:
+            return None
+        return CacheWriter(self, url)
+
+    # Store a response body for a URL and evict the least recently used entries if needed
+    def put(self, url, body):
+        if self.ttl(url) <= 0:
+            return
+
+        key, normalized = self.key(url)
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write to a temporary file first so a crash never leaves a truncated entry behind
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with gzip.open(temp_path, "wb", compresslevel=6) as f:
+            f.write(body)
+        self.add(key, normalized, temp_path, len(body))
+
+    # Move a completely written temporary file into place and record it in the index
+    def add(self, key, normalized, temp_path, length):
+        path = self.path(key)
+        size = os.path.getsize(temp_path)
+        os.replace(temp_path, path)
+
+        now = time.time()
+        with self.lock:
+            row = self.db.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self.total_bytes -= row[0]
+            self.db.execute("INSERT OR REPLACE INTO entries (key, url, size, stored, accessed) VALUES (?, ?, ?, ?, ?)",
+                            (key, normalized, size, now, now))
+            self.total_bytes += size
+            self.bytes_written += length
+            self.evict()
+            self.db.commit()
+
+    # Drop the least recently used entries until the cache fits its size limit, lock must be held
+    def evict(self):
+        if self.total_bytes <= self.max_bytes:
+            return
+        for key, size in self.db.execute("SELECT key, size FROM entries ORDER BY accessed").fetchall():
+            self.remove(key, size)
+            if self.total_bytes <= self.max_bytes:
+                break
+
+    # Delete a single entry and its file, lock must be held
+    def remove(self, key, size):
+        self.db.execute("DELETE FROM entries WHERE key = ?", (key,))
+        self.total_bytes -= size
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def hit_ratio(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def summary(self):
+        return (f"Cache: {self.hits} hits, {self.misses} misses ({self.hit_ratio():.0%} hit ratio), "
+                f"{format_bytes(self.bytes_read)} served from cache, {format_bytes(self.bytes_written)} stored, "
+                f"{format_bytes(self.total_bytes)} on disk")
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+# Writes a response body into the cache chunk by chunk while it is being streamed. The entry only
+# becomes visible once the whole body was written and commit() is called.
+class CacheWriter:
+    def __init__(self, cache, url):
+        self.cache = cache
+        self.key, self.normalized = cache.key(url)
+        path = cache.path(self.key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.temp_path = f"{path}.{threading.get_ident()}.{id(self)}.tmp"
+        self.file = gzip.open(self.temp_path, "wb", compresslevel=6)
+        self.length = 0
+
+    # Pass chunks through while copying them into the cache file
+    def tee(self, chunks):
+        for chunk in chunks:
+            self.file.write(chunk)
+            self.length += len(chunk)
+            yield chunk
+
+    def commit(self):
+        self.file.close()
+        self.cache.add(self.key, self.normalized, self.temp_path, self.length)
+
+    # Throw away a partially written body, does nothing once committed
+    def discard(self):
+        if not self.file.closed:
+            self.file.close()
+            try:
+                os.remove(self.temp_path)
+            except FileNotFoundError:
+                pass
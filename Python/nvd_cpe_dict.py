@@ -0,0 +1,224 @@
+"""
+Local copy of the NVD CPE dictionary for nist_vuln_checker.py --cpe-dictionary.
+
+Product list entries such as cpe:2.3:h:fortinet:fortigate-1801f: are partial CPE strings. Without
+the dictionary each one costs a request to the CPE API to learn the CPE names it stands for,
+before a single CVE was fetched. CpeDictionary keeps the CPE names in SQLite instead and resolves
+the entries locally, the same way the API answers a cpeMatchString: every component given has to
+match, * and ? inside a component are wildcards and missing trailing components match anything.
+
+The names are indexed in a trie, one level per component, so an entry only looks at the names
+under the components it spells out. The trie is filled one part:vendor at a time as entries ask
+for them, a product list only ever touches a small share of the dictionary. An entry with a
+wildcard part or vendor loads the whole dictionary.
+
+The dictionary is filled from the CPE feed, nvdcpe-2.0.tar.gz, with --import-feeds, or from the
+CPE API. After that the API is only asked for the CPE names modified since the last update.
+"""
+
+import os
+import re
+import sqlite3
+import tarfile
+
+import nvd_feeds
+import nvd_match
+import nvd_stream
+
+TRIEDEPTH = 5   # Components indexed by the trie, the rest are compared name by name
+BATCH = 5000    # CPE names upserted at a time when importing a feed
+
+FEEDNAME = re.compile(r"nvdcpe-2\.0.*\.(json|json\.gz|json\.zip|tar\.gz|tgz)$")
+WILDCARD = re.compile(r"(?<!\\)[*?]")
+
+
+# How a component of a cpeMatchString is compared: None matches anything, a string has to be
+# equal and a wildcard pattern is compiled to a regular expression
+def component_matcher(component):
+    if component == nvd_match.ANY:
+        return None
+    if not WILDCARD.search(component):
+        return component
+    pattern = "".join(".*" if part == "*" else "." if part == "?" else re.escape(part)
+                      for part in re.split(r"((?<!\\)[*?])", component))
+    return re.compile(pattern).fullmatch
+
+
+def component_matches(matcher, component):
+    return matcher is None or (matcher == component if isinstance(matcher, str) else matcher(component) is not None)
+
+
+class CpeTrie:
+    def __init__(self):
+        self.root = {}
+
+    def add(self, components, name):
+        node = self.root
+        for component in components[:TRIEDEPTH]:
+            node = node.setdefault(component, {})
+        node.setdefault(None, []).append((components[TRIEDEPTH:], name))
+
+    # The names matching a parsed cpeMatchString, in the order they were added
+    def find(self, components):
+        return list(self.walk(self.root, [component_matcher(component) for component in components], 0))
+
+    def walk(self, node, matchers, depth):
+        if depth == TRIEDEPTH:
+            for rest, name in node.get(None, ()):
+                if all(component_matches(matcher, component) for matcher, component in zip(matchers[TRIEDEPTH:], rest)):
+                    yield name
+            return
+
+        matcher = matchers[depth]
+        if isinstance(matcher, str):
+            child = node.get(matcher)
+            if child is not None:
+                yield from self.walk(child, matchers, depth + 1)
+        else:
+            for component, child in node.items():
+                if matcher is None or matcher(component) is not None:
+                    yield from self.walk(child, matchers, depth + 1)
+
+
+class CpeDictionary:
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS cpes (
+                name TEXT PRIMARY KEY,
+                part TEXT NOT NULL,
+                vendor TEXT NOT NULL,
+                deprecated INTEGER NOT NULL,
+                last_modified TEXT NOT NULL);
+            CREATE INDEX IF NOT EXISTS cpes_vendor ON cpes (part, vendor);
+            CREATE TABLE IF NOT EXISTS watermarks (
+                scope TEXT PRIMARY KEY,
+                synced TEXT NOT NULL);
+        """)
+        self.db.commit()
+        self.forget()
+
+    # Drop the trie, it is filled again from the database as entries are resolved
+    def forget(self):
+        self.trie = CpeTrie()
+        self.loaded = set()
+        self.loaded_all = False
+
+    # Insert or update CPE names in the shape the CPE API returns them. A name is only replaced by
+    # one that is at least as recent. Returns the number of names.
+    def upsert(self, products):
+        rows = []
+        for product in products:
+            cpe = product['cpe']
+            components = nvd_match.parse_cpe(cpe['cpeName'])
+            rows.append((cpe['cpeName'], components[nvd_match.PART], components[nvd_match.VENDOR],
+                         int(cpe.get('deprecated', False)), cpe.get('lastModified', '')))
+        if not rows:
+            return 0
+
+        self.db.executemany("""INSERT INTO cpes (name, part, vendor, deprecated, last_modified) VALUES (?, ?, ?, ?, ?)
+                               ON CONFLICT (name) DO UPDATE SET deprecated = excluded.deprecated, last_modified = excluded.last_modified
+                               WHERE excluded.last_modified >= cpes.last_modified""", rows)
+        self.forget()
+        return len(rows)
+
+    def load(self, where="", params=()):
+        for (name,) in self.db.execute(f"SELECT name FROM cpes {where} ORDER BY name", params):
+            self.trie.add(nvd_match.parse_cpe(name), name)
+
+    # The CPE names a CPE string stands for, like the CPE API's answer to it as a cpeMatchString
+    def resolve(self, cpe_string):
+        components = nvd_match.parse_cpe(cpe_string)
+        part, vendor = components[nvd_match.PART], components[nvd_match.VENDOR]
+
+        if not self.loaded_all:
+            if WILDCARD.search(part) or WILDCARD.search(vendor) or nvd_match.ANY in (part, vendor):
+                self.forget()
+                self.load()
+                self.loaded_all = True
+            elif (part, vendor) not in self.loaded:
+                self.load("WHERE part = ? AND vendor = ?", (part, vendor))
+                self.loaded.add((part, vendor))
+
+        return self.trie.find(components)
+
+    # When the dictionary was last brought up to date, or None if it never was
+    def watermark(self):
+        row = self.db.execute("SELECT synced FROM watermarks WHERE scope = 'cpes'").fetchone()
+        return row[0] if row else None
+
+    def set_watermark(self, synced):
+        self.db.execute("INSERT OR REPLACE INTO watermarks (scope, synced) VALUES ('cpes', ?)", (synced,))
+        self.db.commit()
+
+    def count(self):
+        return self.db.execute("SELECT COUNT(*) FROM cpes").fetchone()[0]
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+
+# The CPE feed files under the given files and directories
+def feed_files(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, name) for name in os.listdir(path) if FEEDNAME.search(name))
+        elif FEEDNAME.search(os.path.basename(path)):
+            files.append(path)
+    return sorted(set(files))
+
+
+# The pages of a CPE feed file, each in the shape the CPE API returns one with 'products' an
+# iterator. NVD publishes the feed as a tarball of such pages, it is read as a stream, one
+# page after the other.
+def iter_feed(path):
+    if not path.endswith((".tar.gz", ".tgz")):
+        yield nvd_feeds.read_feed(path, 'products')
+        return
+
+    with tarfile.open(path, 'r|gz') as archive:
+        for member in archive:
+            if not member.isfile() or not member.name.endswith(".json"):
+                continue
+            f = archive.extractfile(member)
+            fields, items = nvd_stream.parse_page(iter(lambda: f.read(nvd_stream.CHUNKSIZE), b''), 'products')
+            fields['products'] = items
+            yield fields
+
+
+# Import CPE feed files into a CpeDictionary. The feed holds the whole dictionary, so updates
+# from the API only need to catch up from when it was published. Returns the number of CPE
+# names read.
+def import_feeds(dictionary, files):
+    total = 0
+    published = []
+    for path in files:
+        count = 0
+        batch = []
+        try:
+            for page in iter_feed(path):
+                if page.get('timestamp'):
+                    published.append(nvd_feeds.feed_timestamp(page['timestamp']))
+                for product in page['products']:
+                    batch.append(product)
+                    if len(batch) >= BATCH:
+                        count += dictionary.upsert(batch)
+                        batch = []
+            count += dictionary.upsert(batch)
+        except (ValueError, OSError, EOFError, tarfile.TarError) as e:
+            # What was read of the file is kept, importing it again replaces nothing newer
+            raise ValueError(f"Could not read the CPE feed {path}: {e}") from None
+        dictionary.commit()
+        print(f"Imported {count} CPE names from {path}")
+        total += count
+
+    # A watermark is never moved back
+    if published and (dictionary.watermark() is None or dictionary.watermark() < min(published)):
+        dictionary.set_watermark(min(published))
+    return total
@@ -0,0 +1,148 @@
+"""
+Import of the NVD JSON 2.0 data feeds into the local CVE store, for nist_vuln_checker.py
+--import-feeds.
+
+Paging through every CVE with the API takes hours at its rate limit. NVD also publishes the
+whole CVE dataset as a feed file per year, nvdcve-2.0-<year>.json.gz, along with the modified
+and recent feeds of the last days. These can be downloaded once and carried to a machine without
+internet access. A feed file has the same shape as a page of the CVE API, only much larger.
+read_feed decompresses it a chunk at a time and hands the vulnerabilities to nvd_stream one at a
+time, so the checker's matching and report code works on them unchanged. Memory stays bounded
+however large the file is. .json.gz, .json.zip and plain .json files are read.
+
+Feeds are imported oldest year first and the modified feed last. The store only replaces a CVE
+with a record that is at least as recent, so the order only matters for speed. Once the yearly
+feeds of every year are imported, the timestamp of the oldest of them becomes the baseline of
+the store. --sync then only asks the API for what changed since then, even for queries it never
+ran before.
+"""
+
+import datetime
+import gzip
+import os
+import re
+import time
+import zipfile
+
+import nvd_stream
+
+BASELINE = "feeds"   # Watermark scope of the timestamp the yearly feeds were published at
+FIRSTYEAR = 2002     # The oldest yearly feed NVD publishes, holding every CVE up to 2002
+BATCH = 1000         # CVEs upserted at a time
+
+FEEDNAME = re.compile(r"nvdcve-2\.0-(\w+)\.json(\.gz|\.zip)?$")
+
+
+# The feed files under the given files and directories, yearly feeds by year then the others
+def feed_files(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, name) for name in os.listdir(path) if FEEDNAME.search(name))
+        else:
+            files.append(path)
+
+    def order(path):
+        match = FEEDNAME.search(os.path.basename(path))
+        name = match.group(1) if match else ""
+        return (0, name, path) if name.isdigit() else (1, name, path)
+
+    return sorted(set(files), key=order)
+
+
+# The year of a yearly feed, None for the modified and recent feeds or files named otherwise
+def feed_year(path):
+    match = FEEDNAME.search(os.path.basename(path))
+    return int(match.group(1)) if match and match.group(1).isdigit() else None
+
+
+# Open a feed file for reading its decompressed bytes
+def open_feed(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, 'rb')
+    if path.endswith(".zip"):
+        archive = zipfile.ZipFile(path)
+        names = [name for name in archive.namelist() if name.endswith(".json")]
+        if len(names) != 1:
+            archive.close()
+            raise ValueError(f"{path} does not hold exactly one JSON file")
+        # The archive is closed once the member is, ZipFile keeps it open until then
+        f = archive.open(names[0])
+        archive.close()
+        return f
+    return open(path, 'rb')
+
+
+# Read a feed file in the shape query_nvd returns a page, with its `key` array, 'vulnerabilities'
+# for CVEs, an iterator that decodes them one at a time. The file is closed when the iterator is
+# exhausted.
+def read_feed(path, key='vulnerabilities'):
+    f = open_feed(path)
+    try:
+        fields, items = nvd_stream.parse_page(iter(lambda: f.read(nvd_stream.CHUNKSIZE), b''), key)
+    except (ValueError, OSError, EOFError):
+        f.close()
+        raise
+
+    def iter_items():
+        with f:
+            yield from items
+
+    fields[key] = iter_items()
+    return fields
+
+
+# The publication time of a feed in the format of the store's watermarks. NVD gives it in UTC,
+# with more fractional digits than datetime reads.
+def feed_timestamp(value):
+    moment = datetime.datetime.fromisoformat(value.replace("Z", "")[:26])
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=datetime.timezone.utc)
+    return moment.isoformat(timespec='milliseconds')
+
+
+# Import feed files into a CveStore. Each file is committed once it is read, so an interrupted
+# import only has to read the unfinished file again. Returns the number of CVEs read.
+def import_feeds(store, files):
+    total = 0
+    years = set()
+    published = []
+    for path in files:
+        started = time.perf_counter()
+        try:
+            feed = read_feed(path)
+            count = 0
+            batch = []
+            for vulnerability in feed['vulnerabilities']:
+                batch.append(vulnerability)
+                if len(batch) >= BATCH:
+                    count += store.upsert(batch)
+                    batch = []
+            count += store.upsert(batch)
+        except (ValueError, OSError, EOFError) as e:
+            # What was read of the file is kept, importing it again replaces nothing newer
+            raise ValueError(f"Could not read the feed {path}: {e}") from None
+        store.commit()
+
+        expected = feed.get('totalResults')
+        if expected is not None and count != expected:
+            print(f"The feed {path} announced {expected} CVEs but held {count}")
+        print(f"Imported {count} CVEs from {path} in {time.perf_counter() - started:.1f} seconds")
+        total += count
+
+        if feed_year(path) is not None:
+            years.add(feed_year(path))
+            if feed.get('timestamp'):
+                published.append(feed_timestamp(feed['timestamp']))
+
+    # Every CVE is in one of the yearly feeds, so with all of them the store holds everything
+    # modified before the oldest was published. A baseline is never moved back.
+    if published:
+        missing = set(range(FIRSTYEAR, int(min(published)[:4]) + 1)) - years
+        if missing:
+            print(f"No yearly feeds for {', '.join(str(year) for year in sorted(missing))}, --sync will still fetch every query in full")
+        else:
+            baseline = min(published)
+            if store.watermark(BASELINE) is None or store.watermark(BASELINE) < baseline:
+                store.set_watermark(BASELINE, baseline)
+    return total
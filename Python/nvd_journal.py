@@ -0,0 +1,163 @@
+"""
+Checkpoint journal for nist_vuln_checker.py, so that an interrupted run continues where it
+stopped instead of starting over.
+
+The journal is a JSON Lines file that only ever grows. A record is appended once a piece of work
+is complete: a product list entry resolved into its CPE names, or a page of CVEs matched along
+with the rows it produced. Every record is written with a single write to a file opened for
+appending and synced to disk, so a crash leaves at most a torn last line, which is dropped when
+the journal is read back.
+
+The first record describes the scan. A restarted run with the same product list and settings
+takes the search window from it, so the pages line up with the ones already done. It writes the
+recorded rows to the new report, skips the finished work and fetches only what is missing. The
+journal is removed once a run completes every query.
+"""
+
+import hashlib
+import json
+import os
+import time
+
+MAXAGE = 24 * 3600   # Seconds after which a journal is started over, its search window is too old by then
+SYNC = True          # Sync every record to disk, not only to the operating system
+
+
+class Journal:
+    # `scan` holds everything that decides which pages the run fetches and what they contain. A
+    # journal written for a different scan, or too long ago, is started over.
+    def __init__(self, path, scan, window):
+        self.path = path
+        self.key = hashlib.sha256(json.dumps(scan, sort_keys=True).encode()).hexdigest()
+        self.header = None
+        self.resolutions = {}
+        self.pages = {}     # Query -> [next start index, total results]
+        self.seen = set()   # CVEs already reported
+        self.rows = 0
+        self.logs = []
+        self.load()
+
+        self.resumed = self.header is not None
+        flags = os.O_WRONLY | os.O_APPEND | os.O_CREAT | (0 if self.resumed else os.O_TRUNC)
+        self.fd = os.open(path, flags, 0o600)
+        if not self.resumed:
+            self.header = {'type': 'scan', 'key': self.key, 'started': time.time(),
+                           'window': [moment.isoformat() for moment in window]}
+            self.append(self.header)
+
+    # Read back an earlier journal of the same scan, dropping a torn last record
+    def load(self):
+        if not os.path.isfile(self.path):
+            return
+
+        complete = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                complete += len(line)
+
+                if self.header is None:
+                    if record.get('type') != 'scan' or record.get('key') != self.key or time.time() - record['started'] > MAXAGE:
+                        return
+                    self.header = record
+                else:
+                    self.apply(record)
+
+        if self.header is not None and complete < os.path.getsize(self.path):
+            os.truncate(self.path, complete)
+
+    def apply(self, record):
+        if record['type'] == 'cpes':
+            self.resolutions[record['entry']] = record['names']
+        elif record['type'] == 'page':
+            progress = self.pages.setdefault(record['query'], [0, None])
+            # Only pages that follow on from the ones done move a query forward, a page after a
+            # gap is fetched again and its CVEs are skipped as already reported
+            if record['start'] <= progress[0]:
+                progress[0] = max(progress[0], record['start'] + record['size'])
+            progress[1] = record['total']
+            self.seen.update(record['ids'])
+            self.rows += len(record['rows'])
+
+    # Write a record in one go and make sure it is on disk before the work goes on
+    def append(self, record):
+        os.write(self.fd, (json.dumps(record, separators=(",", ":")) + "\n").encode())
+        if SYNC:
+            os.fsync(self.fd)
+
+    # The search window of the scan, as (start, end) in ISO format
+    def window(self):
+        return self.header['window']
+
+    # The CPE names a product list entry resolved into, or None if it was not resolved yet
+    def resolved(self, entry):
+        return self.resolutions.get(entry)
+
+    def add_resolution(self, entry, names):
+        record = {'type': 'cpes', 'entry': entry, 'names': names}
+        self.append(record)
+        self.apply(record)
+
+    # The start index to continue a query from, or None if it was finished
+    def resume_at(self, query):
+        start, total = self.pages.get(query, (0, None))
+        if total is not None and start >= total:
+            return None
+        return start
+
+    def add_page(self, query, start, size, total, ids, rows):
+        record = {'type': 'page', 'query': query, 'start': start, 'size': size, 'total': total, 'ids': ids, 'rows': rows}
+        self.append(record)
+        self.apply(record)
+
+    # Collects what a query reports between the ends of its pages
+    def log(self, query):
+        log = QueryLog(self, query)
+        self.logs.append(log)
+        return log
+
+    # True when every query logged in this run reached its last page
+    def complete(self):
+        return all(log.done for log in self.logs)
+
+    # The rows recorded so far, in the order they were reported
+    def replay(self):
+        with open(self.path, 'rb') as f:
+            next(f)
+            for line in f:
+                record = json.loads(line)
+                if record['type'] == 'page':
+                    yield from record['rows']
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def remove(self):
+        self.close()
+        os.remove(self.path)
+
+
+class QueryLog:
+    def __init__(self, journal, query):
+        self.journal = journal
+        self.query = query
+        self.ids = []
+        self.rows = []
+        self.done = False
+
+    def add(self, cve_id, rows):
+        self.ids.append(cve_id)
+        self.rows.extend(row.values() for row in rows)
+
+    # Called once every CVE of a page was reported, records the page and what it reported
+    def page_done(self, start, size, total):
+        self.journal.add_page(self.query, start, size, total, self.ids, self.rows)
+        self.ids, self.rows = [], []
+        self.done = start + size >= total
@@ -0,0 +1,237 @@
+"""
+Offline matching of CPE names against locally held CVE records.
+
+CpeMatchIndex files every cpeMatch criteria of every configuration under its
+part:vendor:product key, so the CVEs that may affect a CPE name are found with a single
+hash lookup. A candidate is only reported when the configuration it belongs to is satisfied
+by the inventory, honouring the AND/OR operators and negation of the configuration nodes.
+InventoryMatcher applies the same rules to records one at a time, as they arrive from the API.
+"""
+
+import collections
+import re
+
+import nvd_versions
+
+# Component positions of a CPE 2.3 formatted string once the 'cpe:2.3' prefix is removed
+PART, VENDOR, PRODUCT, VERSION = 0, 1, 2, 3
+COMPONENTS = 11
+
+ANY = "*"
+NA = "-"
+
+UNESCAPEDCOLON = re.compile(r"(?<!\\):")
+
+
+# Split a CPE 2.3 formatted string into its 11 components. Missing or empty trailing components,
+# as in the partial strings of the product list, are treated as ANY.
+def parse_cpe(cpe):
+    parts = UNESCAPEDCOLON.split(cpe.lower()) if "\\" in cpe else cpe.lower().split(":")
+    components = [part or ANY for part in parts[2:2 + COMPONENTS]]
+    components += [ANY] * (COMPONENTS - len(components))
+    return tuple(components)
+
+
+# The key the index files criteria under, e.g. 'o:fortinet:fortios'
+def product_key(components):
+    return f"{components[PART]}:{components[VENDOR]}:{components[PRODUCT]}"
+
+
+# Every part:vendor:product key a CVE record has criteria for
+def product_keys(vulnerability):
+    keys = set()
+    for configuration in vulnerability['cve'].get('configurations', []):
+        for node in configuration.get('nodes', []):
+            for match in node.get('cpeMatch', []):
+                keys.add(product_key(parse_cpe(match['criteria'])))
+    return keys
+
+
+# Check whether a parsed CPE name falls under a cpeMatch criteria. A wildcard on either side
+# matches anything, an inventory entry without a version is assumed to be affected. Versions are
+# compared with the version scheme of the product, so 'r81.10' or '7.2.7-build1577' compare sanely.
+def cpe_matches(components, criteria, match):
+    for wanted, have in zip(criteria[VERSION + 1:], components[VERSION + 1:]):
+        if wanted != ANY and have != ANY and wanted != have:
+            return False
+
+    version = components[VERSION]
+    if version == ANY:
+        return True
+
+    wanted = criteria[VERSION]
+    scheme = nvd_versions.scheme_for(components[VENDOR], components[PRODUCT])
+    if wanted != ANY:
+        if NA in (wanted, version):
+            if wanted != version:
+                return False
+        elif nvd_versions.version_key(wanted, scheme) != nvd_versions.version_key(version, scheme):
+            return False
+
+    if not nvd_versions.has_range(match):
+        return True
+    if version == NA:
+        return False
+    return nvd_versions.in_range(version, match, scheme)
+
+
+# The version range a cpeMatch criteria covers, as used by nvd_versions.VersionRanges
+def criteria_range(criteria, match):
+    version = criteria[VERSION]
+    if version not in (ANY, NA):
+        return (version, True), (version, True)
+
+    lower = upper = None
+    if 'versionStartIncluding' in match:
+        lower = (match['versionStartIncluding'], True)
+    elif 'versionStartExcluding' in match:
+        lower = (match['versionStartExcluding'], False)
+    if 'versionEndIncluding' in match:
+        upper = (match['versionEndIncluding'], True)
+    elif 'versionEndExcluding' in match:
+        upper = (match['versionEndExcluding'], False)
+    return lower, upper
+
+
+class CpeMatchIndex:
+    # keys optionally restricts the index to the part:vendor:product keys of an inventory,
+    # records for other products are dropped as they are added
+    def __init__(self, keys=None):
+        self.keys = keys
+        self.entries = collections.defaultdict(list)
+        self.records = {}
+
+        # Version ranges of the criteria of each key, compiled when the key is first matched
+        self.ranges = {}
+
+    # Add a CVE record in the shape the CVE API returns it
+    def add(self, vulnerability):
+        cve = vulnerability['cve']
+        added = False
+        for configuration_index, configuration in enumerate(cve.get('configurations', [])):
+            for node in configuration.get('nodes', []):
+                for match in node.get('cpeMatch', []):
+                    criteria = parse_cpe(match['criteria'])
+                    key = product_key(criteria)
+                    if self.keys is not None and key not in self.keys:
+                        continue
+                    self.entries[key].append((cve['id'], configuration_index, criteria, match))
+                    self.ranges.pop(key, None)
+                    added = True
+        if added:
+            self.records[cve['id']] = vulnerability
+        return added
+
+    def __len__(self):
+        return len(self.records)
+
+    # The criteria of a key that may match a CPE name, found through the version ranges
+    def candidates(self, key, components):
+        entries = self.entries.get(key)
+        if not entries:
+            return ()
+
+        # Without a concrete version every criteria has to be looked at
+        version = components[VERSION]
+        if version in (ANY, NA):
+            return entries
+
+        ranges = self.ranges.get(key)
+        if ranges is None:
+            scheme = nvd_versions.scheme_for(components[VENDOR], components[PRODUCT])
+            ranges = nvd_versions.VersionRanges([(*criteria_range(criteria, match), position)
+                                                 for position, (cve_id, configuration_index, criteria, match) in enumerate(entries)
+                                                 if criteria[VERSION] != NA], scheme)
+            self.ranges[key] = ranges
+
+        return [entries[position] for position in sorted(ranges.containing(version))]
+
+    # Match a whole inventory of CPE names in one pass. Yields (cpe, vulnerability, cpeMatch) for
+    # every vulnerable criteria an inventory entry falls under, within a configuration that the
+    # inventory as a whole satisfies.
+    def match(self, inventory):
+        parsed = [(cpe, parse_cpe(cpe)) for cpe in inventory]
+        by_key = collections.defaultdict(list)
+        for cpe, components in parsed:
+            by_key[product_key(components)].append(components)
+
+        # Configurations are shared by every inventory entry, only evaluate each one once
+        satisfied = {}
+
+        for cpe, components in parsed:
+            seen = set()
+            for cve_id, configuration_index, criteria, match in self.candidates(product_key(components), components):
+                if not match.get('vulnerable', True) or id(match) in seen:
+                    continue
+                if not cpe_matches(components, criteria, match):
+                    continue
+
+                configuration_key = (cve_id, configuration_index)
+                if configuration_key not in satisfied:
+                    configuration = self.records[cve_id]['cve']['configurations'][configuration_index]
+                    satisfied[configuration_key] = configuration_satisfied(configuration, by_key)
+                if satisfied[configuration_key]:
+                    seen.add(id(match))
+                    yield cpe, self.records[cve_id], match
+
+
+# Evaluate a configuration against the inventory, grouped by part:vendor:product key
+def configuration_satisfied(configuration, by_key):
+    results = (node_satisfied(node, by_key) for node in configuration.get('nodes', []))
+    if configuration.get('operator', 'OR') == 'AND':
+        satisfied = all(results)
+    else:
+        satisfied = any(results)
+    return not satisfied if configuration.get('negate') else satisfied
+
+
+# Check whether any inventory entry falls under a cpeMatch criteria
+def inventory_matches(match, by_key):
+    criteria = parse_cpe(match['criteria'])
+    return any(cpe_matches(components, criteria, match) for components in by_key.get(product_key(criteria), ()))
+
+
+# A node is satisfied when any (OR) or all (AND) of its criteria are present in the inventory.
+# Nodes that only list non-vulnerable platforms, e.g. the hardware a firmware runs on, are
+# assumed present when the inventory does not mention any of those products at all, so that an
+# incomplete inventory does not hide a vulnerability.
+def node_satisfied(node, by_key):
+    matches = node.get('cpeMatch', [])
+    results = (inventory_matches(match, by_key) for match in matches)
+    if node.get('operator', 'OR') == 'AND':
+        satisfied = all(results)
+    else:
+        satisfied = any(results)
+
+    if not satisfied and matches and not any(match.get('vulnerable', True) for match in matches):
+        satisfied = not any(product_key(parse_cpe(match['criteria'])) in by_key for match in matches)
+
+    return not satisfied if node.get('negate') else satisfied
+
+
+# Matches CVE records one at a time as they are streamed from the API, against a whole inventory
+class InventoryMatcher:
+    def __init__(self, inventory):
+        self.targets = collections.defaultdict(list)
+        for cpe in inventory:
+            components = parse_cpe(cpe)
+            self.targets[product_key(components)].append((cpe, components))
+        self.by_key = {key: [components for cpe, components in targets] for key, targets in self.targets.items()}
+
+    # Yield (cpe, cpeMatch) for every vulnerable criteria of a record that an inventory entry falls
+    # under, within a configuration that the inventory as a whole satisfies
+    def match_record(self, vulnerability):
+        for configuration in vulnerability['cve'].get('configurations', []):
+            satisfied = None
+            for node in configuration.get('nodes', []):
+                for match in node.get('cpeMatch', []):
+                    if not match.get('vulnerable', True):
+                        continue
+                    criteria = parse_cpe(match['criteria'])
+                    for cpe, components in self.targets.get(product_key(criteria), ()):
+                        if not cpe_matches(components, criteria, match):
+                            continue
+                        if satisfied is None:
+                            satisfied = configuration_satisfied(configuration, self.by_key)
+                        if satisfied:
+                            yield cpe, match
@@ -0,0 +1,424 @@
+"""
+Metrics and traces of nist_vuln_checker.py runs.
+
+Every request to the NVD API is timed by endpoint and status, and failed attempts, throttling,
+back-off sleeps and the bytes received are counted. The main thread books its time to stages,
+CPE resolution, CVE fetch, matching and report writing, through a StageTimer. Stages nest and
+the time of an inner stage is not counted again for the outer one, so the stages add up to the
+time the run spent on them.
+
+The metrics are rendered in the Prometheus text format, to a file for the node_exporter textfile
+collector or on an HTTP endpoint while the run lasts. They can also be pushed together with the
+spans of the run to an OpenTelemetry collector over OTLP/HTTP with JSON encoding, such as the
+one in Docker/GrafanaPrometheus, which needs nothing beyond requests.
+"""
+
+import collections
+import contextlib
+import os
+import random
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+SERVICE = "nist_vuln_checker"
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)   # Request duration buckets in seconds
+MAXSPANS = 20000   # Spans kept for export, later ones are dropped
+OTLPTIMEOUT = 10   # Seconds to wait for the collector to take a push
+HOST = "127.0.0.1"   # Address /metrics is served on, only scrapers on this machine by default
+
+
+# The API endpoint a URL belongs to, such as 'cves/2.0'
+def endpoint(url):
+    return "/".join(urllib.parse.urlsplit(url).path.strip("/").split("/")[-2:])
+
+
+# Escape a label value for the Prometheus text format
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in pairs) + "}"
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def key(self, labels):
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def reset(self):
+        with self.lock:
+            self.values = {}
+
+    def samples(self):
+        with self.lock:
+            return sorted(self.values.items())
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in self.samples():
+            lines.append(f"{self.name}{format_labels(self.labels, key)} {format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    # Values are [count per bucket..., count above the last bucket, sum]
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            else:
+                counts[len(self.buckets)] += 1
+            counts[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, counts in self.samples():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{format_labels(self.labels, key, [('le', format_value(float(bound)))])} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, key)} {format_value(counts[-1])}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.started = time.time()
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def reset(self):
+        for metric in self.metrics:
+            metric.reset()
+        self.started = time.time()
+
+    def render(self):
+        return "\n".join(line for metric in self.metrics for line in metric.render()) + "\n"
+
+    # Write atomically, the textfile collector must never read a half written file
+    def write_textfile(self, path):
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(self.render())
+        os.replace(temp_path, path)
+
+    # The metrics as OTLP resourceMetrics, cumulative since the registry was started or reset
+    def otlp(self):
+        start, now = str(int(self.started * 1e9)), str(time.time_ns())
+        metrics = []
+        for metric in self.metrics:
+            points = []
+            for key, value in metric.samples():
+                point = {'attributes': otlp_attributes(zip(metric.labels, key)), 'startTimeUnixNano': start, 'timeUnixNano': now}
+                if metric.kind == "histogram":
+                    point.update(count=str(sum(value[:-1])), sum=value[-1],
+                                 bucketCounts=[str(count) for count in value[:-1]], explicitBounds=list(metric.buckets))
+                else:
+                    point['asDouble'] = float(value)
+                points.append(point)
+            if not points:
+                continue
+
+            # OpenTelemetry names counters without the _total suffix, the collector adds it back
+            entry = {'name': metric.name, 'description': metric.help}
+            if metric.kind == "counter":
+                entry['name'] = metric.name.removesuffix("_total")
+                entry['sum'] = {'dataPoints': points, 'aggregationTemporality': 2, 'isMonotonic': True}
+            elif metric.kind == "histogram":
+                entry['histogram'] = {'dataPoints': points, 'aggregationTemporality': 2}
+            else:
+                entry['gauge'] = {'dataPoints': points}
+            metrics.append(entry)
+
+        return {'resourceMetrics': [{'resource': otlp_resource(),
+                                     'scopeMetrics': [{'scope': {'name': __name__}, 'metrics': metrics}]}]}
+
+
+def otlp_attributes(pairs):
+    attributes = []
+    for name, value in pairs:
+        if isinstance(value, bool):
+            attributes.append({'key': name, 'value': {'boolValue': value}})
+        elif isinstance(value, int):
+            attributes.append({'key': name, 'value': {'intValue': str(value)}})
+        elif isinstance(value, float):
+            attributes.append({'key': name, 'value': {'doubleValue': value}})
+        else:
+            attributes.append({'key': name, 'value': {'stringValue': str(value)}})
+    return attributes
+
+
+def otlp_resource():
+    return {'attributes': otlp_attributes([("service.name", SERVICE), ("host.name", os.uname().nodename if hasattr(os, "uname") else "")])}
+
+
+REGISTRY = Registry()
+
+REQUEST_SECONDS = REGISTRY.add(Histogram("nvd_request_duration_seconds", "Time taken by each request to the NVD API, until the body was read unless it is streamed", ("endpoint", "status")))
+RETRIES = REGISTRY.add(Counter("nvd_retries_total", "Requests to the NVD API that failed and were retried or given up, by reason", ("endpoint", "reason")))
+THROTTLED = REGISTRY.add(Counter("nvd_throttled_total", "Requests the NVD API throttled, by status", ("endpoint", "status")))
+FAILED = REGISTRY.add(Counter("nvd_failed_queries_total", "Queries given up after every attempt failed", ("endpoint",)))
+BACKOFF_SECONDS = REGISTRY.add(Counter("nvd_backoff_seconds_total", "Seconds spent backing off, as asked by Retry-After or after an error", ("reason",)))
+RATELIMIT_SECONDS = REGISTRY.add(Counter("nvd_ratelimit_wait_seconds_total", "Seconds requests waited for the client side rate limit, summed over threads"))
+RESPONSE_BYTES = REGISTRY.add(Counter("nvd_response_bytes_total", "Bytes of response bodies received from the NVD API after decompression", ("endpoint",)))
+CACHE_LOOKUPS = REGISTRY.add(Gauge("nvd_cache_lookups", "Response cache lookups in the run, by result", ("result",)))
+CACHE_HIT_RATIO = REGISTRY.add(Gauge("nvd_cache_hit_ratio", "Share of response cache lookups in the run that were hits"))
+CACHE_BYTES = REGISTRY.add(Gauge("nvd_cache_bytes", "Bytes served from and stored into the response cache in the run", ("direction",)))
+STAGE_SECONDS = REGISTRY.add(Gauge("nvd_stage_duration_seconds", "Seconds the run spent in each stage on its main thread", ("stage",)))
+REPORT_ROWS = REGISTRY.add(Gauge("nvd_report_rows", "Rows written to the report"))
+RUN_SECONDS = REGISTRY.add(Gauge("nvd_run_duration_seconds", "Wall time of the run"))
+RUN_TIMESTAMP = REGISTRY.add(Gauge("nvd_run_timestamp_seconds", "Unix time the run ended, by mode and outcome", ("mode", "outcome")))
+
+
+# Book a back-off sleep and take it
+def backoff(seconds, reason):
+    BACKOFF_SECONDS.inc(seconds, reason=reason)
+    time.sleep(seconds)
+
+
+# Count the bytes of a streamed body as they are read
+def count_bytes(chunks, endpoint):
+    for chunk in chunks:
+        RESPONSE_BYTES.inc(len(chunk), endpoint=endpoint)
+        yield chunk
+
+
+# Copy the counters a ResponseCache keeps into the metrics
+def record_cache(cache):
+    CACHE_LOOKUPS.set(cache.hits, result="hit")
+    CACHE_LOOKUPS.set(cache.misses, result="miss")
+    CACHE_HIT_RATIO.set(cache.hit_ratio())
+    CACHE_BYTES.set(cache.bytes_read, direction="served")
+    CACHE_BYTES.set(cache.bytes_written, direction="stored")
+
+
+# Books the time of a single thread to named stages. Only the innermost stage runs its clock, so
+# the time spent in a nested stage is taken out of the one around it.
+class StageTimer:
+    def __init__(self):
+        self.seconds = collections.defaultdict(float)
+        self.stack = []
+        self.started = 0.0
+
+    def enter(self, stage):
+        now = time.perf_counter()
+        if self.stack:
+            self.seconds[self.stack[-1]] += now - self.started
+        self.stack.append(stage)
+        self.started = now
+
+    def exit(self):
+        now = time.perf_counter()
+        self.seconds[self.stack.pop()] += now - self.started
+        self.started = now
+
+    @contextlib.contextmanager
+    def time(self, stage):
+        self.enter(stage)
+        try:
+            yield
+        finally:
+            self.exit()
+
+    # Book the time taken to produce each item of an iterable, not the time the consumer spends on it
+    def timed(self, items, stage):
+        iterator = iter(items)
+        while True:
+            self.enter(stage)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.exit()
+            yield item
+
+    def record(self):
+        for stage, seconds in self.seconds.items():
+            STAGE_SECONDS.set(seconds, stage=stage)
+
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "kind", "start", "end", "attributes", "error")
+
+    def __init__(self, name, trace_id, parent_id, kind, attributes):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = random.getrandbits(64)
+        self.parent_id = parent_id
+        self.kind = kind
+        self.attributes = attributes
+        self.error = False
+        self.start = time.time_ns()
+        self.end = None
+
+    def duration(self):
+        return (self.end - self.start) / 1e9
+
+
+INTERNAL, CLIENT = 1, 3   # OTLP span kinds
+
+
+# Records the spans of a run. Spans opened with span() nest on the thread that opened them, spans
+# started on other threads, such as the requests of the worker threads, belong to the root span.
+# When disabled nothing is kept, but start() and end() still time what they surround.
+class Tracer:
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.trace_id = random.getrandbits(128)
+        self.root = None
+        self.spans = []
+        self.dropped = 0
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def current(self):
+        stack = getattr(self.local, 'stack', None)
+        return stack[-1] if stack else self.root
+
+    def start(self, name, kind=INTERNAL, **attributes):
+        parent = self.current()
+        return Span(name, self.trace_id, parent.span_id if parent else None, kind, attributes)
+
+    # Finish a span and return how long it took in seconds
+    def end(self, span, error=False, **attributes):
+        span.end = time.time_ns()
+        span.error = bool(error)
+        span.attributes.update(attributes)
+        if self.enabled:
+            with self.lock:
+                if len(self.spans) < MAXSPANS:
+                    self.spans.append(span)
+                else:
+                    self.dropped += 1
+        return span.duration()
+
+    @contextlib.contextmanager
+    def span(self, name, **attributes):
+        span = self.start(name, **attributes)
+        if self.root is None:
+            self.root = span
+        stack = self.local.__dict__.setdefault('stack', [])
+        stack.append(span)
+        try:
+            yield span
+        except BaseException:
+            span.error = True
+            raise
+        finally:
+            stack.pop()
+            self.end(span, span.error)
+
+    def otlp(self):
+        with self.lock:
+            spans = list(self.spans)
+        return {'resourceSpans': [{'resource': otlp_resource(),
+                                   'scopeSpans': [{'scope': {'name': __name__},
+                                                   'spans': [otlp_span(span) for span in spans]}]}]}
+
+
+def otlp_span(span):
+    entry = {'traceId': f"{span.trace_id:032x}",
+             'spanId': f"{span.span_id:016x}",
+             'name': span.name,
+             'kind': span.kind,
+             'startTimeUnixNano': str(span.start),
+             'endTimeUnixNano': str(span.end),
+             'attributes': otlp_attributes(span.attributes.items()),
+             'status': {'code': 2 if span.error else 1}}
+    if span.parent_id is not None:
+        entry['parentSpanId'] = f"{span.parent_id:016x}"
+    return entry
+
+
+# Push the metrics and spans to an OpenTelemetry collector, such as http://localhost:4318. A
+# collector that is down is reported but does not fail the run.
+def push_otlp(url, registry, tracer):
+    url = url.rstrip("/")
+    for path, payload in (("/v1/metrics", registry.otlp()), ("/v1/traces", tracer.otlp())):
+        try:
+            resp = requests.post(url + path, json=payload, timeout=OTLPTIMEOUT)
+            resp.raise_for_status()
+        except requests.RequestException as e:
+            print(f"Pushing telemetry to {url + path} failed: {e}")
+            return False
+    return True
+
+
+# Serve the metrics for scraping on /metrics from a background thread. Returns the server, call
+# shutdown() on it when done.
+def serve(registry, port, host=HOST):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
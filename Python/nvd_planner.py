@@ -0,0 +1,113 @@
+"""
+Query planning for nist_vuln_checker.py.
+
+The product list often names several models or versions of one product, and querying the CVE
+API once per CPE name downloads the same CVEs again for each of them. The planner normalizes
+and deduplicates the entries and groups them by part:vendor:product, so that one CVE API query
+with a virtualMatchString covers a whole group. When every version of a group is a plain release
+number the query is narrowed with version bounds. Entries with a wildcard part, vendor or product
+can not be grouped and are still expanded through the CPE API first.
+"""
+
+import collections
+import re
+import urllib.parse
+
+import nvd_match
+import nvd_versions
+
+# Only plain release numbers are handed to the API as version bounds. Anything else, such as
+# 'r81.20' or '7.2.7-build1577', may compare differently in the API than in nvd_versions.
+RELEASE = re.compile(r"^\d+(\.\d+)*$")
+
+# Unescaped CPE 2.3 wildcards inside a component
+WILDCARD = re.compile(r"(?<!\\)[*?]")
+
+
+# Rewrite a CPE string, possibly partial, as a full CPE 2.3 formatted string
+def normalize_cpe(cpe):
+    return "cpe:2.3:" + ":".join(nvd_match.parse_cpe(cpe))
+
+
+# Entries whose part, vendor or product is a wildcard do not belong to a single group
+def needs_expansion(components):
+    return any(WILDCARD.search(component) for component in components[:nvd_match.VERSION])
+
+
+class CveQuery:
+    # label names the query in messages, params are its CVE API query parameters and inventory
+    # the entries it fetches CVEs for. The scope identifies the query in the local store.
+    def __init__(self, label, params, inventory):
+        self.label = label
+        self.params = params
+        self.inventory = inventory
+        self.scope = urllib.parse.urlencode(sorted(params.items()))
+
+
+# Build the query of a part:vendor:product group, bounded by the lowest and highest version in it
+def group_query(key, inventory, bounds=True):
+    query_params = {'virtualMatchString': f"cpe:2.3:{key}"}
+    label = key
+
+    versions = {nvd_match.parse_cpe(cpe)[nvd_match.VERSION] for cpe in inventory}
+    if bounds and all(RELEASE.match(version) for version in versions):
+        vendor, product = key.split(":")[1:3]
+        scheme = nvd_versions.scheme_for(vendor, product)
+        ordered = sorted(versions, key=lambda version: nvd_versions.version_key(version, scheme))
+        query_params.update(versionStart=ordered[0], versionStartType='including',
+                            versionEnd=ordered[-1], versionEndType='including')
+        label = f"{key} {ordered[0]}" if len(ordered) == 1 else f"{key} {ordered[0]} to {ordered[-1]}"
+
+    return CveQuery(label, query_params, inventory)
+
+
+class QueryPlan:
+    # bounds can be turned off to always fetch every version of a product and filter locally
+    def __init__(self, product_list, bounds=True):
+        self.rows = len(product_list)
+        self.bounds = bounds
+        self.groups = collections.defaultdict(list)
+        self.expand = []
+        for cpe in product_list:
+            self.add(cpe)
+
+    # File an entry under its group, or set it aside for expansion. Returns False for duplicates.
+    def add(self, cpe):
+        cpe = normalize_cpe(cpe)
+        components = nvd_match.parse_cpe(cpe)
+        if needs_expansion(components):
+            if cpe in self.expand:
+                return False
+            self.expand.append(cpe)
+            return True
+
+        entries = self.groups[nvd_match.product_key(components)]
+        if cpe in entries:
+            return False
+        entries.append(cpe)
+        return True
+
+    # Every entry the CVEs are matched against, group by group
+    def inventory(self):
+        return [cpe for entries in self.groups.values() for cpe in entries]
+
+    def queries(self):
+        return [group_query(key, entries, self.bounds) for key, entries in self.groups.items()]
+
+    # The fewest API requests the plan can take: one per query and a CPE lookup per wildcard entry
+    def estimate(self):
+        return len(self.groups) + len(self.expand)
+
+    # The per-CPE flow makes a CPE lookup for every row and then a CVE query for every CPE name found
+    def legacy_estimate(self):
+        return self.rows
+
+    def describe(self):
+        lines = [f"Query plan: {self.rows} product list entries, {len(self.inventory()) + len(self.expand)} after normalizing and removing duplicates"]
+        for query in self.queries():
+            lines.append(f"  {query.label}: {len(query.inventory)} entries")
+        for cpe in self.expand:
+            lines.append(f"  {cpe}: expanded through the CPE API")
+        lines.append(f"Estimated requests: {self.estimate()}{' or more' if self.expand else ''}, "
+                     f"the per-CPE flow needs {self.legacy_estimate()} CPE lookups plus a CVE query per CPE name found")
+        return "\n".join(lines)
@@ -0,0 +1,195 @@
+"""
+Compact report rows for nist_vuln_checker.py.
+
+Every field of a row used to be looked up in the CVE record with its own guarded chain of
+subscripts, and each row was a list of 24 values. Here the CVE level fields are looked up once
+per CVE, after resolving which CVSS version to report, and kept in a tuple shared by every row
+of that CVE. A row only adds the CPE name and the cpeMatch fields in __slots__. The CVSS columns
+of CVEs with the same vector share one tuple, and strings that repeat across many CVEs, such as
+source identifiers, weaknesses and criteria, are interned.
+"""
+
+import collections
+import sys
+
+NA = "N/A"
+
+# Report columns, in order
+COLUMNS = ("id",
+           "configurations.cpeSearch",
+           "sourceIdentifier",
+           "published",
+           "lastModified",
+           "vulnStatus",
+           "description",
+           "configurations.version",
+           "cvss.source",
+           "cvss.baseScore",
+           "cvss.baseSeverity",
+           "cvss.attackVector",
+           "cvss.privilegesRequired",
+           "cvss.userInteraction",
+           "cvss.confidentialityImpact",
+           "cvss.integrityImpact",
+           "cvss.availabilityImpact",
+           "cvss.exploitabilityScore",
+           "cvss.impactScore",
+           "weakness.description",
+           "configurations.vulnerable",
+           "configurations.criteria",
+           "configurations.versionStartIncluding",
+           "configurations.versionEndExcluding")
+
+# Return strings interned, so repeated values share one object across rows
+def intern(value):
+    return sys.intern(value) if value.__class__ is str else value
+
+
+# The value of the first entry of a list such as descriptions, NA when there is none
+def first_value(entries):
+    return entries[0].get('value', NA) if entries else NA
+
+
+# The version and the CVSS columns of a metric, from 'cvss.source' to 'cvss.impactScore'
+def cvss3_columns(version, metric):
+    data = metric.get('cvssData', {})
+    return (version,
+            metric.get('source', NA),
+            data.get('baseScore', NA),
+            data.get('baseSeverity', NA),
+            data.get('attackVector', NA),
+            data.get('privilegesRequired', NA),
+            data.get('userInteraction', NA),
+            data.get('confidentialityImpact', NA),
+            data.get('integrityImpact', NA),
+            data.get('availabilityImpact', NA),
+            metric.get('exploitabilityScore', NA),
+            metric.get('impactScore', NA))
+
+
+# CVSS 2.0 keeps the severity outside cvssData and names the vectors differently
+def cvss2_columns(version, metric):
+    data = metric.get('cvssData', {})
+    return (version,
+            metric.get('source', NA),
+            data.get('baseScore', NA),
+            metric.get('baseSeverity', NA),
+            data.get('accessVector', NA),
+            data.get('authentication', NA),
+            metric.get('userInteractionRequired', NA),
+            data.get('confidentialityImpact', NA),
+            data.get('integrityImpact', NA),
+            data.get('availabilityImpact', NA),
+            metric.get('exploitabilityScore', NA),
+            metric.get('impactScore', NA))
+
+
+# Metrics in order of preference with the version reported for them and their columns.
+# A CVE without any metric is reported as version 2.0 with every CVSS column N/A.
+CVSSVERSIONS = (("cvssMetricV31", "3.1", cvss3_columns),
+                ("cvssMetricV30", "3.0", cvss3_columns),
+                ("cvssMetricV2", "2.0", cvss2_columns))
+
+NOCVSS = ("2.0",) + (NA,) * 11   # The version and the eleven CVSS columns
+
+# Where each column of a row is found: in the row itself, in the CVE summary or in its shared CVSS
+# tuple, and at which index
+SUMMARY, CVSS, MATCH = 0, 1, 2
+LAYOUT = ((SUMMARY, 0),
+          (MATCH, 0),
+          *((SUMMARY, index) for index in range(1, 6)),
+          *((CVSS, index) for index in range(len(NOCVSS))),
+          (SUMMARY, 6),
+          *((MATCH, index) for index in range(1, 5)))
+
+
+# Extract the columns shared by every row of a CVE. The CVSS columns of many CVEs are identical,
+# `shared` maps their vector, or the columns themselves when there is none, to a single tuple.
+# The id, timestamps and description are unique per CVE and not interned.
+def summarize(vulnerability, shared):
+    cve = vulnerability['cve']
+    descriptions = cve.get('descriptions')
+    weaknesses = cve.get('weaknesses')
+    weakness = first_value(weaknesses[0].get('description')) if weaknesses else NA
+
+    metrics = cve.get('metrics') or {}
+    for name, version, columns in CVSSVERSIONS:
+        if name in metrics:
+            metric = metrics[name][0]
+            vector = metric.get('cvssData', {}).get('vectorString')
+            if vector is None:
+                cvss = columns(version, metric)
+                cvss = shared.setdefault(cvss, cvss)
+                break
+            # The scores and labels follow from the vector, a metric with the version, source and
+            # vector of one seen before gets its tuple without reading the columns again
+            key = (name, metric.get('source'), vector, metric.get('userInteractionRequired'))
+            cvss = shared.get(key)
+            if cvss is None:
+                cvss = shared[key] = columns(version, metric)
+            break
+    else:
+        cvss = NOCVSS
+
+    return (cve.get('id', NA), intern(cve.get('sourceIdentifier', NA)), cve.get('published', NA), cve.get('lastModified', NA),
+            intern(cve.get('vulnStatus', NA)), descriptions[0].get('value', NA) if descriptions else NA, intern(weakness), cvss)
+
+
+class CveRow:
+    __slots__ = ("summary", "cpe", "vulnerable", "criteria", "versionStartIncluding", "versionEndExcluding")
+
+    def __init__(self, summary, cpe, match):
+        self.summary = summary
+        self.cpe = cpe
+        self.vulnerable = match.get('vulnerable', NA)
+        self.criteria = intern(match.get('criteria', NA))
+        self.versionStartIncluding = intern(match.get('versionStartIncluding', NA))
+        self.versionEndExcluding = intern(match.get('versionEndExcluding', NA))
+
+    # Rows behave as read-only sequences of column values, which is all xlsxwriter needs
+    def __len__(self):
+        return len(COLUMNS)
+
+    def __getitem__(self, column):
+        where, index = LAYOUT[column]
+        if where == SUMMARY:
+            return self.summary[index]
+        if where == CVSS:
+            return self.summary[-1][index]
+        return getattr(self, CveRow.__slots__[1 + index])
+
+    def values(self):
+        return [self[column] for column in range(len(COLUMNS))]
+
+
+SUMMARIES = 10000   # CVE summaries a RowBuilder keeps for reuse, the oldest are dropped first
+
+
+# Builds rows, summarizing each CVE only the first time a row is built for it. The CPE names come
+# from the inventory, which holds each of them once already. Only the most recent summaries are
+# kept, so a builder feeding rows straight to an output does not grow with the report. The oldest
+# summary is dropped with OrderedDict.popitem, finding the first key of a plain dict means
+# scanning past every entry deleted from its front before.
+class RowBuilder:
+    def __init__(self, max_summaries=SUMMARIES):
+        self.summaries = collections.OrderedDict()
+        self.max_summaries = max_summaries
+        self.cvss = {}
+
+    def row(self, cpe, vulnerability, match):
+        cve_id = vulnerability['cve'].get('id', NA)
+        summary = self.summaries.get(cve_id)
+        if summary is None:
+            if len(self.summaries) >= self.max_summaries:
+                self.summaries.popitem(last=False)
+            summary = self.summaries[cve_id] = summarize(vulnerability, self.cvss)
+        return CveRow(summary, cpe, match)
+
+    # The rows of a record for the (cpe, cpeMatch) pairs it matched. A CVE matched by a single
+    # row, the most common case, is summarized for that row alone and not kept for reuse.
+    def rows(self, vulnerability, matches):
+        matches = list(matches)
+        if len(matches) != 1:
+            return [self.row(cpe, vulnerability, match) for cpe, match in matches]
+        summary = self.summaries.get(vulnerability['cve'].get('id', NA)) or summarize(vulnerability, self.cvss)
+        return [CveRow(summary, *matches[0])]
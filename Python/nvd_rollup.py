@@ -0,0 +1,263 @@
+"""
+Risk rollups of the report for nist_vuln_checker.py, written as summary worksheets next to the
+table in the Excel report.
+
+Rows are not kept. Rollup.add reduces each row to three codes appended to compact arrays: the
+CVE, the CPE name and the CVSS values the summaries use. The CVSS values of many CVEs are the
+same, their severity, attack vector, privileges and scores are looked up by code once the
+summaries are computed. At the end the summaries are computed over whole columns: every CVE is counted
+once per CPE name and once per vendor, however many configurations matched it. For each CPE name
+and each vendor there is a count of CVEs by severity, by attack vector and by privileges
+required, the highest baseScore and exploitabilityScore, and the `top` CVEs ranked by baseScore
+and then exploitabilityScore. A third summary ranks the CVEs of the whole report.
+
+The passes over the columns run in NumPy when it is installed, otherwise in plain Python over the
+array module's columns, which gives the same summaries.
+"""
+
+import array
+import collections
+import heapq
+
+try:
+    import numpy   #pip install numpy, optional
+except ImportError:
+    numpy = None
+
+import nvd_match
+import nvd_records
+
+TOP = 5          # CVEs listed for every CPE name and vendor
+TOPCVES = 100    # CVEs in the ranking of the whole report
+
+# Report columns the summaries are computed from
+ID = nvd_records.COLUMNS.index("id")
+CPE = nvd_records.COLUMNS.index("configurations.cpeSearch")
+BASESCORE = nvd_records.COLUMNS.index("cvss.baseScore")
+SEVERITY = nvd_records.COLUMNS.index("cvss.baseSeverity")
+ATTACKVECTOR = nvd_records.COLUMNS.index("cvss.attackVector")
+PRIVILEGES = nvd_records.COLUMNS.index("cvss.privilegesRequired")
+EXPLOITABILITY = nvd_records.COLUMNS.index("cvss.exploitabilityScore")
+
+# Values of the breakdowns in the order their columns are written, values not listed follow in
+# alphabetical order. CVSS 2.0 reports authentication where 3.x reports privileges required.
+ORDER = {'cvss.baseSeverity': ("CRITICAL", "HIGH", "MEDIUM", "LOW", "NONE"),
+         'cvss.attackVector': ("NETWORK", "ADJACENT_NETWORK", "ADJACENT", "LOCAL", "PHYSICAL"),
+         'cvss.privilegesRequired': ("NONE", "LOW", "HIGH", "SINGLE", "MULTIPLE")}
+
+CVECOLUMNS = ("id", "cvss.baseScore", "cvss.baseSeverity", "cvss.exploitabilityScore",
+              "cvss.attackVector", "cvss.privilegesRequired", "cpes")
+
+
+# Numbers for the distinct values of a column, in the order they first appear
+class Codes:
+    def __init__(self):
+        self.codes = {}
+        self.values = []
+
+    def __call__(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def __len__(self):
+        return len(self.values)
+
+
+def score(value):
+    return float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else float("nan")
+
+
+# Scores that are missing sort after every real score
+def score_key(value):
+    return value if value == value else -1.0
+
+
+# A score as written to the report, N/A when missing
+def cell(value):
+    return value if value == value else nvd_records.NA
+
+
+# What the summaries need to know of every distinct CVSS code: the scores, and for every
+# breakdown the values in the order of their columns and the column of each code
+class CvssTables:
+    def __init__(self, cvss):
+        self.base = array.array('d', (score(values[0]) for values in cvss))
+        self.exploitability = array.array('d', (score(values[1]) for values in cvss))
+        self.labels = {}
+        self.columns = {}
+        for position, name in enumerate(ORDER, 2):
+            present = {values[position] for values in cvss}
+            labels = [value for value in ORDER[name] if value in present]
+            labels += sorted(present - set(labels), key=str)
+            index = {label: column for column, label in enumerate(labels)}
+            self.labels[name] = labels
+            self.columns[name] = array.array('q', (index[values[position]] for values in cvss))
+
+
+class Rollup:
+    def __init__(self, top=TOP):
+        self.top = top
+        self.cves = Codes()
+        self.cpes = Codes()
+        self.cvss = Codes()
+        self.cve_column = array.array('q')
+        self.cpe_column = array.array('q')
+        self.cvss_column = array.array('q')
+
+    def __len__(self):
+        return len(self.cve_column)
+
+    def add(self, row):
+        self.cve_column.append(self.cves(row[ID]))
+        self.cpe_column.append(self.cpes(row[CPE]))
+        self.cvss_column.append(self.cvss((row[BASESCORE], row[EXPLOITABILITY], row[SEVERITY], row[ATTACKVECTOR], row[PRIVILEGES])))
+
+    # The summaries as {sheet name: (header, rows)}
+    def summaries(self):
+        rollup, rank = (rollup_numpy, rank_numpy) if numpy is not None else (rollup_python, rank_python)
+        tables = CvssTables(self.cvss.values)
+        vendors = Codes()
+        cpe_vendor = array.array('q', (vendors(nvd_match.parse_cpe(cpe)[nvd_match.VENDOR]) for cpe in self.cpes.values))
+        cpe_cpe = array.array('q', range(len(self.cpes)))
+        return {"Summary by CPE": self.sheet("configurations.cpeSearch", self.cpes.values, tables, rollup(self, tables, cpe_cpe, len(self.cpes))),
+                "Summary by vendor": self.sheet("vendor", vendors.values, tables, rollup(self, tables, cpe_vendor, len(vendors))),
+                "Top CVEs": self.ranking(tables, rank(self, tables))}
+
+    # One row per group, the most exposed first
+    def sheet(self, name, groups, tables, rolled):
+        cves, counts, base_max, exploitability_max, top = rolled
+        header = [name, "cves"]
+        for breakdown in ORDER:
+            header.extend(f"{breakdown}.{label}" for label in tables.labels[breakdown])
+        header.extend(("cvss.baseScore.max", "cvss.exploitabilityScore.max", f"top {self.top} cves"))
+
+        rows = []
+        for group, value in enumerate(groups):
+            if not cves[group]:
+                continue
+            row = [value, cves[group]]
+            for breakdown in ORDER:
+                row.extend(counts[breakdown][group])
+            row.extend((cell(base_max[group]), cell(exploitability_max[group]),
+                        ", ".join(f"{self.cves.values[cve]} ({cell(base)})" for cve, base in top[group])))
+            rows.append((-score_key(base_max[group]), -score_key(exploitability_max[group]), -cves[group], group, row))
+        rows.sort()
+        return header, [row[-1] for row in rows]
+
+    # The most exposed CVEs of the whole report, with the number of CPE names they were found for
+    def ranking(self, tables, ranked):
+        rows = []
+        for cve, cvss, cpes in ranked:
+            rows.append([self.cves.values[cve], cell(tables.base[cvss]), self.cvss.values[cvss][2], cell(tables.exploitability[cvss]),
+                         self.cvss.values[cvss][3], self.cvss.values[cvss][4], cpes])
+        return list(CVECOLUMNS), rows
+
+
+def as_numpy(column):
+    return numpy.frombuffer(column, dtype=numpy.float64 if column.typecode == 'd' else numpy.int64)
+
+
+# Roll the rows up by group in NumPy, the group of a row is that of its CPE name in cpe_group.
+# Returns the CVEs of every group, the counts of each breakdown by group and column, the highest
+# scores of every group and its top CVEs as (cve, baseScore) pairs.
+def rollup_numpy(rollup, tables, cpe_group, count):
+    group = as_numpy(cpe_group)[as_numpy(rollup.cpe_column)]
+    cve = as_numpy(rollup.cve_column)
+
+    # Every CVE once per group, at its first row
+    _, first = numpy.unique(group * len(rollup.cves) + cve, return_index=True)
+    first.sort()
+    group = group[first]
+    cve = cve[first]
+    cvss = as_numpy(rollup.cvss_column)[first]
+    base = as_numpy(tables.base)[cvss]
+    exploitability = as_numpy(tables.exploitability)[cvss]
+
+    cves = numpy.bincount(group, minlength=count)
+    counts = {}
+    for name in ORDER:
+        columns = len(tables.labels[name])
+        codes = as_numpy(tables.columns[name])[cvss]
+        counts[name] = numpy.bincount(group * columns + codes, minlength=count * columns).reshape(count, columns).tolist()
+
+    base_max = numpy.full(count, numpy.nan)
+    numpy.fmax.at(base_max, group, base)
+    exploitability_max = numpy.full(count, numpy.nan)
+    numpy.fmax.at(exploitability_max, group, exploitability)
+
+    # Sorted by group, then highest scores first with missing scores last, the first `top` rows
+    # of every group are its top CVEs
+    order = numpy.lexsort((cve, -numpy.nan_to_num(exploitability, nan=-1.0), -numpy.nan_to_num(base, nan=-1.0), group))
+    ranked = group[order]
+    starts = numpy.searchsorted(ranked, numpy.arange(count))
+    keep = order[numpy.arange(len(order)) - starts[ranked] < rollup.top]
+    top = [[] for _ in range(count)]
+    for g, c, b in zip(group[keep].tolist(), cve[keep].tolist(), base[keep].tolist()):
+        top[g].append((c, b))
+
+    return cves.tolist(), counts, base_max.tolist(), exploitability_max.tolist(), top
+
+
+# The TOPCVES highest ranked CVEs of the report as (cve, cvss, CPE names) in NumPy
+def rank_numpy(rollup, tables):
+    cve = as_numpy(rollup.cve_column)
+    distinct, first = numpy.unique(cve, return_index=True)
+    cvss = as_numpy(rollup.cvss_column)[first]
+    width = max(len(rollup.cpes), 1)
+    pairs = numpy.unique(cve * width + as_numpy(rollup.cpe_column))
+    cpes = numpy.bincount(pairs // width, minlength=len(rollup.cves))[distinct]
+
+    base = numpy.nan_to_num(as_numpy(tables.base)[cvss], nan=-1.0)
+    exploitability = numpy.nan_to_num(as_numpy(tables.exploitability)[cvss], nan=-1.0)
+    order = numpy.lexsort((distinct, -exploitability, -base))[:TOPCVES]
+    return list(zip(distinct[order].tolist(), cvss[order].tolist(), cpes[order].tolist()))
+
+
+# The same rollup in plain Python, in one pass over the columns. The first row of every CVE in a
+# group counts, a set of the (group, CVE) pairs seen skips the rows after it. The top CVEs of
+# every group are picked with heapq.nlargest from the CVEs counted for it.
+def rollup_python(rollup, tables, cpe_group, count):
+    breakdowns = [(tables.columns[name], [[0] * len(tables.labels[name]) for _ in range(count)]) for name in ORDER]
+    base_keys = [score_key(value) for value in tables.base]
+    exploitability_keys = [score_key(value) for value in tables.exploitability]
+
+    cves = [0] * count
+    nan = float("nan")
+    base_max = [nan] * count
+    exploitability_max = [nan] * count
+    candidates = [[] for _ in range(count)]
+
+    seen = set()
+    for cve, cpe, cvss in zip(rollup.cve_column, rollup.cpe_column, rollup.cvss_column):
+        group = cpe_group[cpe]
+        if (group, cve) in seen:
+            continue
+        seen.add((group, cve))
+
+        cves[group] += 1
+        for columns, table in breakdowns:
+            table[group][columns[cvss]] += 1
+        base, exploitability = tables.base[cvss], tables.exploitability[cvss]
+        if base == base and not base_max[group] >= base:
+            base_max[group] = base
+        if exploitability == exploitability and not exploitability_max[group] >= exploitability:
+            exploitability_max[group] = exploitability
+        # Highest baseScore first, then exploitabilityScore, then the CVE seen first
+        candidates[group].append((base_keys[cvss], exploitability_keys[cvss], -cve, base))
+
+    top = [[(-cve, base) for _, _, cve, base in heapq.nlargest(rollup.top, group)] for group in candidates]
+    return cves, {name: table for name, (_, table) in zip(ORDER, breakdowns)}, base_max, exploitability_max, top
+
+
+# The same ranking in plain Python, each CVE with the CVSS values of its first row
+def rank_python(rollup, tables):
+    first = {}
+    cpes = collections.defaultdict(set)
+    for cve, cpe, cvss in zip(rollup.cve_column, rollup.cpe_column, rollup.cvss_column):
+        first.setdefault(cve, cvss)
+        cpes[cve].add(cpe)
+    ranked = heapq.nlargest(TOPCVES, first.items(), key=lambda item: (score_key(tables.base[item[1]]), score_key(tables.exploitability[item[1]]), -item[0]))
+    return [(cve, cvss, len(cpes[cve])) for cve, cvss in ranked]
@@ -0,0 +1,272 @@
+"""
+Vulnerability lookup service for nist_vuln_checker.py --serve.
+
+Tools that ask which CVEs affect a CPE name many times a day would otherwise start the checker
+for every question. The service loads the local CVE store into a CpeMatchIndex once, with the
+version ranges of every product compiled up front, and answers lookups over HTTP with the same
+matching and report rows as the checker. The most recent answers are kept in an LRU cache. The
+store is synced in the background and the index rebuilt and swapped in whole, so lookups never
+wait for a refresh and never see a half built index.
+
+    GET  /cves?cpe=cpe:2.3:o:fortinet:fortios:7.2.7    CVEs affecting one or more CPE names,
+         &since=2025-01-01                              optionally only those modified since then
+    POST /cves  {"cpes": [...], "since": "..."}         the same for a whole inventory
+    GET  /health                                        size and age of the index
+    GET  /metrics                                       Prometheus metrics, see nvd_metrics
+    POST /refresh                                       sync and reload now
+
+The CPE names of one lookup are matched as an inventory, so configurations that need several
+products present, such as an application running on an operating system, are honoured.
+"""
+
+import collections
+import datetime
+import json
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import nvd_match
+import nvd_metrics
+import nvd_planner
+import nvd_records
+import nvd_store
+import nvd_stream
+
+LOOKUPCACHE = 1024   # Lookup answers kept, the least recently used are dropped first
+MAXCPES = 1000       # CPE names a single lookup may ask about
+MAXBODY = 1024 * 1024   # Largest POST body accepted, in bytes
+
+LOOKUP_SECONDS = nvd_metrics.REGISTRY.add(nvd_metrics.Histogram("nvd_lookup_duration_seconds", "Time taken to answer a lookup, by whether the answer was cached", ("cache",), buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)))
+INDEX_CVES = nvd_metrics.REGISTRY.add(nvd_metrics.Gauge("nvd_index_cves", "CVEs held by the lookup index"))
+INDEX_LOADED = nvd_metrics.REGISTRY.add(nvd_metrics.Gauge("nvd_index_loaded_timestamp_seconds", "Unix time the lookup index was last loaded"))
+REFRESHES = nvd_metrics.REGISTRY.add(nvd_metrics.Counter("nvd_refreshes_total", "Background refreshes of the lookup index, by outcome", ("outcome",)))
+
+
+# Raised for a lookup that can not be answered, with the HTTP status to answer it with
+class ServiceError(ValueError):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class LruCache:
+    def __init__(self, size):
+        self.size = size
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+# The index of everything in the store at one point in time. Matching compiles version ranges
+# and summarizes CVEs into shared caches, so lookups take turns on a snapshot.
+class Snapshot:
+    def __init__(self, store_path):
+        store = nvd_store.CveStore(store_path)
+        try:
+            self.index = nvd_match.CpeMatchIndex()
+            for vulnerability in store.iter_cves():
+                self.index.add(nvd_stream.prune(vulnerability))
+        finally:
+            store.close()
+
+        # Compile the version ranges of every product now rather than on its first lookup
+        for key in list(self.index.entries):
+            self.index.candidates(key, nvd_match.parse_cpe(f"cpe:2.3:{key}:0"))
+
+        self.rows = nvd_records.RowBuilder()
+        self.loaded = time.time()
+        self.lock = threading.Lock()
+
+    def match(self, cpes, since=None):
+        with self.lock:
+            rows = [self.rows.row(cpe, vulnerability, match) for cpe, vulnerability, match in self.index.match(cpes)
+                    if since is None or vulnerability['cve'].get('lastModified', '') >= since]
+            return [dict(zip(nvd_records.COLUMNS, row.values())) for row in rows]
+
+
+class VulnerabilityService:
+    # refresh syncs the store and is called from a background thread every `interval` seconds,
+    # None for a store that something else keeps up to date
+    def __init__(self, store_path, refresh=None, interval=None, cache_size=LOOKUPCACHE):
+        self.store_path = store_path
+        self.refresh = refresh
+        self.interval = interval
+        self.cache = LruCache(cache_size)
+        self.snapshot = None
+        self.wake = threading.Event()
+        self.refreshed = None
+
+    def load(self):
+        started = time.perf_counter()
+        snapshot = Snapshot(self.store_path)
+        self.snapshot = snapshot
+        self.cache.clear()
+        INDEX_CVES.set(len(snapshot.index))
+        INDEX_LOADED.set(snapshot.loaded)
+        print(f"Loaded {len(snapshot.index)} CVEs from {self.store_path} in {time.perf_counter() - started:.2f} seconds")
+
+    def wait(self):
+        self.wake.wait(self.interval)
+        self.wake.clear()
+
+    # Sync and reload until the process ends, right away when woken by /refresh. Without a way
+    # to sync, the store is only reloaded, after the first wait as it was just loaded.
+    def refresh_loop(self):
+        if self.refresh is None:
+            self.wait()
+        while True:
+            try:
+                if self.refresh is not None:
+                    self.refresh()
+                self.load()
+                self.refreshed = time.time()
+                REFRESHES.inc(outcome="success")
+            except Exception as e:
+                # A failed refresh keeps serving the index that was loaded before
+                REFRESHES.inc(outcome="failed")
+                print(f"Refreshing the CVE index failed: {e}")
+            self.wait()
+
+    # Answer a lookup as a JSON body, from the cache when the same question was asked before
+    def lookup(self, cpes, since=None):
+        started = time.perf_counter()
+        if not cpes:
+            raise ServiceError("Ask about at least one CPE name with cpe=")
+        if len(cpes) > MAXCPES:
+            raise ServiceError(f"At most {MAXCPES} CPE names can be looked up at once")
+        for cpe in cpes:
+            if not isinstance(cpe, str) or not cpe.startswith("cpe:2.3:"):
+                raise ServiceError(f"Not a CPE 2.3 formatted string: {cpe!r}")
+        if since is not None:
+            try:
+                since = datetime.datetime.fromisoformat(since).isoformat()
+            except (TypeError, ValueError):
+                raise ServiceError(f"Not an ISO date or timestamp: {since!r}") from None
+
+        snapshot = self.snapshot
+        if snapshot is None:
+            raise ServiceError("The CVE index is still loading", 503)
+
+        cpes = sorted({nvd_planner.normalize_cpe(cpe) for cpe in cpes})
+        key = (snapshot.loaded, tuple(cpes), since)
+        body = self.cache.get(key)
+        if body is not None:
+            LOOKUP_SECONDS.observe(time.perf_counter() - started, cache="hit")
+            return body, True
+
+        rows = snapshot.match(cpes, since)
+        body = json.dumps({'cpes': cpes,
+                           'since': since,
+                           'indexed': datetime.datetime.fromtimestamp(snapshot.loaded, datetime.timezone.utc).isoformat(timespec='seconds'),
+                           'count': len(rows),
+                           'results': rows}).encode()
+        self.cache.put(key, body)
+        LOOKUP_SECONDS.observe(time.perf_counter() - started, cache="miss")
+        return body, False
+
+    def health(self):
+        snapshot = self.snapshot
+        return {'status': "ok" if snapshot else "loading",
+                'cves': len(snapshot.index) if snapshot else 0,
+                'indexed': snapshot.loaded if snapshot else None,
+                'age': time.time() - snapshot.loaded if snapshot else None,
+                'refreshed': self.refreshed,
+                'cached_lookups': len(self.cache.entries)}
+
+
+def make_handler(service):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def send_body(self, status, body, content_type="application/json", headers=()):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in headers:
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def send_json(self, status, value):
+            self.send_body(status, json.dumps(value).encode())
+
+        def answer(self, cpes, since):
+            try:
+                body, cached = service.lookup(cpes, since)
+            except ServiceError as e:
+                self.send_json(e.status, {'error': str(e)})
+                return
+            self.send_body(200, body, headers=[("X-Cache", "hit" if cached else "miss")])
+
+        def do_GET(self):
+            url = urllib.parse.urlsplit(self.path)
+            params = urllib.parse.parse_qs(url.query)
+            if url.path == "/cves":
+                self.answer(params.get('cpe', []), params.get('since', [None])[0])
+            elif url.path == "/health":
+                self.send_json(200, service.health())
+            elif url.path == "/metrics":
+                self.send_body(200, nvd_metrics.REGISTRY.render().encode(), "text/plain; version=0.0.4; charset=utf-8")
+            else:
+                self.send_json(404, {'error': f"Unknown path {url.path}"})
+
+        def do_POST(self):
+            path = urllib.parse.urlsplit(self.path).path
+            if path == "/refresh":
+                service.wake.set()
+                self.send_json(202, {'status': "refreshing"})
+                return
+            if path != "/cves":
+                self.send_json(404, {'error': f"Unknown path {path}"})
+                return
+
+            length = int(self.headers.get("Content-Length") or 0)
+            if length > MAXBODY:
+                self.send_json(413, {'error': f"Bodies are limited to {MAXBODY} bytes"})
+                return
+            try:
+                request = json.loads(self.rfile.read(length) or b"{}")
+                cpes = request.get('cpes', [])
+            except (ValueError, AttributeError):
+                self.send_json(400, {'error': "Send a JSON object such as {\"cpes\": [...]}"})
+                return
+            self.answer(cpes if isinstance(cpes, list) else [cpes], request.get('since'))
+
+    return Handler
+
+
+# Load the index and serve lookups until interrupted. The first refresh runs in the background,
+# lookups are answered from what the store already holds in the meantime.
+def serve(service, host, port):
+    service.load()
+    threading.Thread(target=service.refresh_loop, name="refresh", daemon=True).start()
+
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    server.daemon_threads = True
+    print(f"Answering CVE lookups on http://{host}:{port}/cves?cpe=...")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,177 @@
+"""
+Report outputs for nist_vuln_checker.py, fed one row at a time as the matching produces them.
+
+Rows are written out as they arrive instead of being collected for the end of the run, so memory
+stays flat however large the report gets. The Excel workbook is written in xlsxwriter's
+constant_memory mode and the filter is set over the written rows when it is closed. The CSV
+and JSON Lines outputs are flushed as they go, so a long run can be inspected while it works and
+keeps what it wrote if it dies. Outputs are only created once the first row arrives.
+
+The Excel workbook also gets summary worksheets after the table, the rollups of nvd_rollup by
+CPE name and by vendor and a ranking of the CVEs. They are computed from compact columns kept
+alongside the rows, not from the rows themselves.
+"""
+
+import abc
+import csv
+import json
+import os
+
+import xlsxwriter   #pip install xlsxwriter
+
+import nvd_records
+import nvd_rollup
+
+FLUSHROWS = 500   # Rows between flushes of the CSV and JSON Lines outputs
+
+
+class Sink(abc.ABC):
+    def __init__(self, path, top=nvd_rollup.TOP):
+        self.path = path
+        self.top = top
+        self.count = 0
+
+    def write(self, row):
+        if self.count == 0:
+            # If the file already exists, delete it to avoid appending to an old file
+            if os.path.isfile(self.path):
+                os.remove(self.path)
+                print(f"Deleted existing file ready for new data: {self.path}")
+            self.open()
+        self.write_row(row)
+        self.count += 1
+
+    @abc.abstractmethod
+    def open(self):
+        pass
+
+    @abc.abstractmethod
+    def write_row(self, row):
+        pass
+
+    # Finish the output, nothing is created when no row was written
+    def close(self):
+        if self.count:
+            self.finish()
+            print(f"Wrote {self.count} entries to {self.path}")
+
+    @abc.abstractmethod
+    def finish(self):
+        pass
+
+
+# Excel worksheet, written row by row. xlsxwriter does not support tables in constant_memory mode,
+# so the header row is frozen and an autofilter is set over the rows written once they are known.
+# The summary worksheets are left out when `top` is 0.
+class XlsxSink(Sink):
+    def open(self):
+        self.workbook = xlsxwriter.Workbook(self.path, {'constant_memory': True})
+        self.header = self.workbook.add_format({'bold': True, 'bottom': 1})
+        self.worksheet = self.workbook.add_worksheet()
+        self.worksheet.write_row(0, 0, nvd_records.COLUMNS, self.header)
+        self.worksheet.freeze_panes(1, 0)
+        self.rollup = nvd_rollup.Rollup(self.top) if self.top else None
+
+    def write_row(self, row):
+        self.worksheet.write_row(self.count + 1, 0, list(row))
+        if self.rollup is not None:
+            self.rollup.add(row)
+
+    def finish(self):
+        self.worksheet.autofilter(0, 0, self.count, len(nvd_records.COLUMNS) - 1)
+        if self.rollup is not None:
+            for name, (columns, rows) in self.rollup.summaries().items():
+                self.write_sheet(name, columns, rows)
+        self.workbook.close()
+
+    def write_sheet(self, name, columns, rows):
+        worksheet = self.workbook.add_worksheet(name)
+        worksheet.write_row(0, 0, columns, self.header)
+        worksheet.freeze_panes(1, 0)
+        for number, row in enumerate(rows, 1):
+            worksheet.write_row(number, 0, row)
+        worksheet.autofilter(0, 0, len(rows), len(columns) - 1)
+
+
+class CsvSink(Sink):
+    def open(self):
+        self.file = open(self.path, 'w', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(nvd_records.COLUMNS)
+
+    def write_row(self, row):
+        self.writer.writerow(list(row))
+        if self.count % FLUSHROWS == 0:
+            self.file.flush()
+
+    def finish(self):
+        self.file.close()
+
+
+# One JSON object per line, keyed by column
+class JsonlSink(Sink):
+    def open(self):
+        self.file = open(self.path, 'w', encoding='utf-8')
+
+    def write_row(self, row):
+        self.file.write(json.dumps(dict(zip(nvd_records.COLUMNS, row))) + "\n")
+        if self.count % FLUSHROWS == 0:
+            self.file.flush()
+
+    def finish(self):
+        self.file.close()
+
+
+# Output types by file extension
+SINKS = {
+    ".xlsx": XlsxSink,
+    ".csv": CsvSink,
+    ".jsonl": JsonlSink,
+    ".ndjson": JsonlSink,
+}
+
+
+def open_sink(path, top=nvd_rollup.TOP):
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in SINKS:
+        raise ValueError(f"Unsupported report file '{path}', use one of {', '.join(SINKS)}")
+    return SINKS[extension](path, top)
+
+
+# Hands every row to each of a number of outputs. The time spent writing is booked to the
+# 'report_writing' stage of `stages`, an nvd_metrics.StageTimer, when one is given. `top` is the
+# number of CVEs the summary worksheets list for every CPE name and vendor, 0 for none.
+class Report:
+    def __init__(self, paths, stages=None, top=nvd_rollup.TOP):
+        self.sinks = [open_sink(path, top) for path in paths]
+        self.count = 0
+        self.stages = stages
+
+    def write(self, row):
+        if self.stages is None:
+            self.write_sinks(row)
+            return
+        self.stages.enter('report_writing')
+        try:
+            self.write_sinks(row)
+        finally:
+            self.stages.exit()
+
+    def write_sinks(self, row):
+        for sink in self.sinks:
+            sink.write(row)
+        self.count += 1
+
+    def extend(self, rows):
+        for row in rows:
+            self.write(row)
+
+    def close(self):
+        if self.stages is not None:
+            self.stages.enter('report_writing')
+        try:
+            for sink in self.sinks:
+                sink.close()
+        finally:
+            if self.stages is not None:
+                self.stages.exit()
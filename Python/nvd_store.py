@@ -0,0 +1,104 @@
+"""
+Local CVE store used by the sync mode of nist_vuln_checker.py.
+
+Vulnerabilities are kept in SQLite in the same shape the NVD CVE API returns them, one
+compressed JSON document per CVE id. Each sync scope, such as a CPE name, records a
+high-water mark so the next run only asks the API for CVEs modified since then.
+"""
+
+import json
+import sqlite3
+import zlib
+
+import nvd_match
+
+
+class CveStore:
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS cves (
+                id TEXT PRIMARY KEY,
+                last_modified TEXT NOT NULL,
+                data BLOB NOT NULL);
+            CREATE INDEX IF NOT EXISTS cves_last_modified ON cves (last_modified);
+            CREATE TABLE IF NOT EXISTS cve_products (
+                product TEXT NOT NULL,
+                id TEXT NOT NULL,
+                PRIMARY KEY (product, id)) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS cve_products_id ON cve_products (id);
+            CREATE TABLE IF NOT EXISTS watermarks (
+                scope TEXT PRIMARY KEY,
+                synced TEXT NOT NULL);
+        """)
+        self.db.commit()
+
+    # Insert or update CVE records, together with the part:vendor:product keys of their criteria.
+    # A record is only replaced by one that is at least as recent, and the keys of a CVE are
+    # replaced along with its record. Returns the number of records.
+    def upsert(self, vulnerabilities):
+        rows = []
+        latest = {}   # CVE id -> (lastModified, keys) of the record in the batch that is stored
+        for vulnerability in vulnerabilities:
+            cve = vulnerability['cve']
+            last_modified = cve.get('lastModified', '')
+            rows.append((cve['id'], last_modified, zlib.compress(json.dumps(vulnerability, separators=(',', ':')).encode())))
+            if cve['id'] not in latest or last_modified >= latest[cve['id']][0]:
+                latest[cve['id']] = (last_modified, nvd_match.product_keys(vulnerability))
+        if not rows:
+            return 0
+
+        self.db.executemany("""INSERT INTO cves (id, last_modified, data) VALUES (?, ?, ?)
+                               ON CONFLICT (id) DO UPDATE SET last_modified = excluded.last_modified, data = excluded.data
+                               WHERE excluded.last_modified >= cves.last_modified""", rows)
+
+        # Only the CVEs whose stored record is now the one from this batch get its keys, an older
+        # record keeps the keys of the newer one already stored
+        stored = [(cve_id, last_modified) for cve_id, (last_modified, keys) in latest.items()]
+        self.db.executemany("""DELETE FROM cve_products WHERE id = ?1
+                               AND EXISTS (SELECT 1 FROM cves WHERE id = ?1 AND last_modified = ?2)""", stored)
+        self.db.executemany("""INSERT OR IGNORE INTO cve_products (product, id)
+                               SELECT ?1, ?2 WHERE EXISTS (SELECT 1 FROM cves WHERE id = ?2 AND last_modified = ?3)""",
+                            [(key, cve_id, last_modified) for cve_id, (last_modified, keys) in latest.items() for key in keys])
+        return len(rows)
+
+    # Yield the stored CVE records, optionally only those with criteria for any of the given
+    # part:vendor:product keys, or those modified since a timestamp
+    def iter_cves(self, modified_since=None, products=None):
+        query = "SELECT data FROM cves"
+        where = []
+        params = []
+        if products is not None:
+            products = sorted(products)
+            where.append(f"id IN (SELECT id FROM cve_products WHERE product IN ({', '.join('?' * len(products))}))")
+            params.extend(products)
+        if modified_since is not None:
+            where.append("last_modified >= ?")
+            params.append(modified_since)
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        query += " ORDER BY id"
+
+        for (data,) in self.db.execute(query, params):
+            yield json.loads(zlib.decompress(data))
+
+    # Return the high-water mark of a sync scope, or None if it was never synced
+    def watermark(self, scope):
+        row = self.db.execute("SELECT synced FROM watermarks WHERE scope = ?", (scope,)).fetchone()
+        return row[0] if row else None
+
+    # Record a successful sync of a scope together with the records upserted for it
+    def set_watermark(self, scope, synced):
+        self.db.execute("INSERT OR REPLACE INTO watermarks (scope, synced) VALUES (?, ?)", (scope, synced))
+        self.db.commit()
+
+    def count(self):
+        return self.db.execute("SELECT COUNT(*) FROM cves").fetchone()[0]
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
@@ -0,0 +1,140 @@
+"""
+Incremental parsing of NVD API responses.
+
+A CVE API page holds up to 2000 vulnerabilities, and parsing it with resp.json() builds the
+whole page as one object tree. parse_page reads the body chunk by chunk instead. It decodes the
+top-level fields as they arrive and hands out the items of the result array one at a time, so
+only the item being worked on is ever held in memory. prune drops the parts of a vulnerability
+that the report does not use as soon as it is decoded.
+"""
+
+import codecs
+import json
+
+CHUNKSIZE = 64 * 1024   # Bytes read from the socket or cache file at a time
+
+WHITESPACE = " \t\n\r"
+
+# Parts of a CVE record that the report and the matching use
+CVEFIELDS = ("id", "sourceIdentifier", "published", "lastModified", "vulnStatus", "configurations")
+
+
+# Raised when a body is not valid JSON or ends before the page is complete
+class StreamError(ValueError):
+    pass
+
+
+# A JSON text read from an iterable of byte chunks, decoded a value at a time
+class JsonStream:
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.json = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    # Drop what was consumed and append the next chunk, returns False at the end of the body
+    def fill(self):
+        if self.eof:
+            return False
+        text = ""
+        for chunk in self.chunks:
+            text = self.decoder.decode(chunk)
+            if text:
+                break
+        else:
+            text = self.decoder.decode(b"", final=True)
+            self.eof = True
+        self.buffer = self.buffer[self.pos:] + text
+        self.pos = 0
+        return bool(text)
+
+    # Skip whitespace and return the next character without consuming it, '' at the end
+    def peek(self):
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return ""
+
+    # Consume one of the given structural characters and return it
+    def expect(self, chars):
+        char = self.peek()
+        if not char or char not in chars:
+            raise StreamError(f"Expected one of {chars!r} but found {char or 'the end of the body'!r}")
+        self.pos += 1
+        return char
+
+    # Decode the next complete JSON value, reading more chunks until it is complete
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.json.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError as e:
+                if self.fill():
+                    continue
+                raise StreamError(f"Invalid or truncated JSON: {e}") from None
+
+            # A number that runs up to the end of the buffer may continue in the next chunk
+            if end == len(self.buffer) and type(value) in (int, float) and self.fill():
+                continue
+
+            self.pos = end
+            return value
+
+    # Read whatever is left of the body, so that a copy being written elsewhere is complete
+    def drain(self):
+        for chunk in self.chunks:
+            pass
+        self.eof = True
+
+
+# Parse a response body given as byte chunks. Returns the top-level fields that come before the
+# `key` array, such as totalResults, and an iterator over the items of that array. NVD sends
+# the counts first, so they are known before the first item is decoded.
+def parse_page(chunks, key):
+    stream = JsonStream(chunks)
+    fields = {}
+    stream.expect("{")
+    if stream.peek() == "}":
+        return fields, iter(())
+
+    while True:
+        if stream.peek() != '"':
+            stream.expect('"')
+        name = stream.value()
+        stream.expect(":")
+        if name == key:
+            stream.expect("[")
+            return fields, iter_items(stream)
+        fields[name] = stream.value()
+        if stream.expect(",}") == "}":
+            return fields, iter(())
+
+
+def iter_items(stream):
+    if stream.peek() == "]":
+        stream.pos += 1
+    else:
+        while True:
+            yield stream.value()
+            if stream.expect(",]") == "]":
+                break
+    stream.drain()
+
+
+# Keep only what the report uses of a vulnerability. The report reads the first description,
+# the first score of each CVSS version and the first weakness, the references are dropped.
+def prune(vulnerability):
+    cve = vulnerability['cve']
+    pruned = {name: cve[name] for name in CVEFIELDS if name in cve}
+    if 'descriptions' in cve:
+        pruned['descriptions'] = cve['descriptions'][:1]
+    if 'weaknesses' in cve:
+        pruned['weaknesses'] = cve['weaknesses'][:1]
+    pruned['metrics'] = {name: scores[:1] for name, scores in cve.get('metrics', {}).items()}
+    return {'cve': pruned}
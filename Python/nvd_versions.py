@@ -0,0 +1,213 @@
+"""
+Version comparison for CPE version strings.
+
+Every version string is parsed once into a cached sortable key. Vendors whose version scheme
+the generic parser gets wrong, such as Check Point R-releases or FortiOS builds, register
+their own parser. VersionRanges keeps the versionStart/End Including/Excluding ranges of a
+product in an interval tree, so the ranges that contain a version are found in logarithmic
+time instead of rescanning every range.
+"""
+
+import bisect
+import functools
+import re
+
+# Words that mark a pre-release, these sort before the release they precede. The single letters
+# only do when a number follows them, as in 1.0a1 or 1.0b2, a trailing letter as in OpenSSL's
+# 1.1.1a or 1.0.2k marks a later release instead.
+PRERELEASE = {"dev": 0, "alpha": 1, "a": 1, "beta": 2, "b": 2, "pre": 3, "preview": 3, "rc": 4}
+NUMBERED = {"a", "b"}
+
+TOKENS = re.compile(r"\d+|[a-z]+")
+
+# Marks the end of a key, sorts after pre-release words and before numbers or other words
+END = (0, 0, "")
+
+
+# Split a version into comparable items: numbers compare numerically, pre-release words sort
+# before the end of a key and any other words after it. Trailing zeros of each run of numbers
+# are dropped, so 7.2 and 7.2.0 or 7.2-rc1 and 7.2.0-rc1 get the same key.
+def generic_key(version):
+    items = []
+    version = version.lower()
+    for match in TOKENS.finditer(version):
+        token = match.group()
+        if token.isdigit():
+            items.append((1, int(token), ""))
+            continue
+        while items and items[-1] == (1, 0, ""):
+            items.pop()
+        if token in PRERELEASE and (token not in NUMBERED or version[match.end():match.end() + 1].isdigit()):
+            items.append((-1, PRERELEASE[token], token))
+        else:
+            items.append((2, 0, token))
+    while items and items[-1] == (1, 0, ""):
+        items.pop()
+    items.append(END)
+    return tuple(items)
+
+
+# Check Point releases are written R81, R81.10, R81.20, R82 and so on. Hotfix takes are appended
+# as e.g. 'r81.20_take_89' or 'r81.20 jhf take 89' and sort after the plain release.
+def checkpoint_key(version):
+    version = version.lower().strip()
+    if version.startswith("r"):
+        version = version[1:]
+    return generic_key(version)
+
+
+# FortiOS and the other Fortinet firmwares are versioned 7.2.7, optionally with the build number
+# such as '7.2.7-build1577', 'v7.2.7,build1577' or '7.2.7 b1577'. A build number identifies the
+# release it belongs to, so it is dropped and ranges written against releases still apply.
+FORTINETBUILD = re.compile(r"[\s,\-_]*(build|b)\s*\d+$")
+
+
+def fortinet_key(version):
+    version = version.lower().strip()
+    if version.startswith("v"):
+        version = version[1:]
+    return generic_key(FORTINETBUILD.sub("", version))
+
+
+# Version parsers by scheme name, add to this and SCHEMES to support another vendor
+PARSERS = {
+    "generic": generic_key,
+    "checkpoint": checkpoint_key,
+    "fortinet": fortinet_key,
+}
+
+# Scheme used by a vendor, or by a single product as 'vendor:product'
+SCHEMES = {
+    "checkpoint": "checkpoint",
+    "fortinet": "fortinet",
+}
+
+
+def register_parser(scheme, parser, vendors=()):
+    PARSERS[scheme] = parser
+    for vendor in vendors:
+        SCHEMES[vendor] = scheme
+    version_key.cache_clear()
+
+
+# The version scheme of a product
+def scheme_for(vendor, product=None):
+    if product is not None and f"{vendor}:{product}" in SCHEMES:
+        return SCHEMES[f"{vendor}:{product}"]
+    return SCHEMES.get(vendor, "generic")
+
+
+# Parse a version string into its sortable key, each version is only ever parsed once per scheme
+@functools.lru_cache(maxsize=None)
+def version_key(version, scheme="generic"):
+    return PARSERS[scheme](version)
+
+
+RANGEKEYS = ("versionStartIncluding", "versionStartExcluding", "versionEndIncluding", "versionEndExcluding")
+
+
+def has_range(match):
+    return any(key in match for key in RANGEKEYS)
+
+
+# Check a version against the versionStart/End Including/Excluding bounds of a cpeMatch
+def in_range(version, match, scheme="generic"):
+    key = version_key(version, scheme)
+    if "versionStartIncluding" in match and key < version_key(match["versionStartIncluding"], scheme):
+        return False
+    if "versionStartExcluding" in match and key <= version_key(match["versionStartExcluding"], scheme):
+        return False
+    if "versionEndIncluding" in match and key > version_key(match["versionEndIncluding"], scheme):
+        return False
+    if "versionEndExcluding" in match and key >= version_key(match["versionEndExcluding"], scheme):
+        return False
+    return True
+
+
+class VersionRanges:
+    # Build from (lower, upper, payload) items where lower and upper are (version, inclusive)
+    # or None when unbounded. A concrete version is the range (v, True), (v, True).
+    def __init__(self, ranges, scheme="generic"):
+        self.scheme = scheme
+
+        # Every distinct bound becomes a boundary. Position 2i+1 stands for boundary i itself and
+        # 2i for the versions between boundary i-1 and boundary i, so a version maps to one position
+        # and each range to a contiguous span of positions.
+        self.boundaries = sorted({version_key(bound[0], scheme) for lower, upper, payload in ranges for bound in (lower, upper) if bound})
+        last = 2 * len(self.boundaries)
+        spans = []
+        for lower, upper, payload in ranges:
+            if lower is None:
+                start = 0
+            else:
+                index = bisect.bisect_left(self.boundaries, version_key(lower[0], scheme))
+                start = 2 * index + 1 if lower[1] else 2 * index + 2
+            if upper is None:
+                end = last
+            else:
+                index = bisect.bisect_left(self.boundaries, version_key(upper[0], scheme))
+                end = 2 * index + 1 if upper[1] else 2 * index
+            if start <= end:
+                spans.append((start, end, payload))
+        self.tree = IntervalTree(spans)
+
+    def position(self, version):
+        key = version_key(version, self.scheme)
+        index = bisect.bisect_left(self.boundaries, key)
+        if index < len(self.boundaries) and self.boundaries[index] == key:
+            return 2 * index + 1
+        return 2 * index
+
+    # Yield the payload of every range containing a version
+    def containing(self, version):
+        return self.tree.stab(self.position(version))
+
+
+# Static centered interval tree over integer spans, stabbing queries take O(log n + k)
+class IntervalTree:
+    __slots__ = ("center", "by_start", "by_end", "left", "right")
+
+    def __init__(self, spans):
+        self.left = self.right = None
+        self.by_start = self.by_end = ()
+        if not spans:
+            self.center = None
+            return
+
+        points = sorted(point for start, end, payload in spans for point in (start, end))
+        self.center = points[len(points) // 2]
+        left, right, here = [], [], []
+        for span in spans:
+            if span[1] < self.center:
+                left.append(span)
+            elif span[0] > self.center:
+                right.append(span)
+            else:
+                here.append(span)
+
+        self.by_start = sorted(here, key=lambda span: span[0])
+        self.by_end = sorted(here, key=lambda span: span[1], reverse=True)
+        if left:
+            self.left = IntervalTree(left)
+        if right:
+            self.right = IntervalTree(right)
+
+    def stab(self, point):
+        node = self
+        while node is not None and node.center is not None:
+            if point < node.center:
+                for start, end, payload in node.by_start:
+                    if start > point:
+                        break
+                    yield payload
+                node = node.left
+            elif point > node.center:
+                for start, end, payload in node.by_end:
+                    if end < point:
+                        break
+                    yield payload
+                node = node.right
+            else:
+                for start, end, payload in node.by_start:
+                    yield payload
+                return
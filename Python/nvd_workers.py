@@ -0,0 +1,35 @@
+"""
+Worker processes for nist_vuln_checker.py --processes.
+
+Decoding pages of CVEs, walking their configurations, comparing versions and building rows is
+CPU bound and would otherwise run on a single core. The checker hands the raw body of every page
+it fetches to a pool of worker processes running process_page. Each worker matches against the
+whole inventory it was started with and sends back compact rows. This module is kept apart from
+the checker so that worker processes do not import the networking side.
+"""
+
+import json
+
+import nvd_match
+import nvd_records
+
+# Per process state, set up once by init()
+matcher = None
+rows = None
+
+
+def init(inventory):
+    global matcher, rows
+    matcher = nvd_match.InventoryMatcher(inventory)
+    rows = nvd_records.RowBuilder()
+
+
+# Decode a page of CVEs and match every CVE on it. Returns (cve id, rows) for each CVE with any
+# rows, in the order of the page.
+def process_page(body, key='vulnerabilities'):
+    results = []
+    for cve in json.loads(body).get(key, []):
+        cve_rows = rows.rows(cve, matcher.match_record(cve))
+        if cve_rows:
+            results.append((cve['cve']['id'], cve_rows))
+    return results
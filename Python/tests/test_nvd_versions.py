@@ -0,0 +1,27 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import nvd_versions
+
+
+def test_numbered_letters_are_prereleases():
+    key = nvd_versions.generic_key
+    assert key("1.0a1") < key("1.0b2") < key("1.0rc1") < key("1.0")
+    assert key("1.0 b2") < key("1.0")
+
+
+def test_trailing_letters_are_later_releases():
+    key = nvd_versions.generic_key
+    assert key("1.0.2") < key("1.0.2a") < key("1.0.2b") < key("1.0.2k") < key("1.0.3")
+    assert key("1.0") < key("1.0a")
+
+
+def test_letter_releases_fall_in_ranges():
+    match = {"versionStartIncluding": "1.1.1", "versionEndExcluding": "1.1.1w"}
+    assert nvd_versions.in_range("1.1.1a", match)
+    assert nvd_versions.in_range("1.1.1b", match)
+    assert nvd_versions.in_range("1.1.1k", match)
+    assert not nvd_versions.in_range("1.1.0l", match)
+    assert not nvd_versions.in_range("1.1.1w", match)